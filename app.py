@@ -1,15 +1,21 @@
 # app.py
 import os
+import uuid
 import base64
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-import face_recognition
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, send_from_directory
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
+import arranque
 import database
+import importador
+import metricas
+import retencion
 import reconocimiento as rc
 
 app = Flask(__name__, static_folder="static")
@@ -19,9 +25,42 @@ app.secret_key = "CAMBIAR_POR_ALGO_MUY_SEGURO"
 os.makedirs(os.path.join("data","autorizados"), exist_ok=True)
 os.makedirs(os.path.join("data","intrusos"), exist_ok=True)
 
-# Init DB and caches
-database.init_db()
-rc.initialize_caches()
+# BD, cachés y modelos se preparan en segundo plano (arranque.py): importar este
+# módulo no espera a dlib y el servidor responde desde el primer momento. Los procesos
+# de los pools (forkserver/spawn) reimportan el módulo principal: ahí no se arranca nada.
+if multiprocessing.parent_process() is None:
+    arranque.estado.iniciar({
+        "bd": lambda: database.init_db(default_camera_url=rc.ESP32_STREAM_URL),
+        "caches": rc.initialize_caches,
+        "pool": rc.start_pool,
+    })
+    retencion.iniciar()
+
+@app.before_request
+def esperar_bd():
+    # las rutas esperan al esquema de la BD (milisegundos); salud y estáticos responden siempre
+    if request.endpoint in ("healthz", "readyz", "static"):
+        return None
+    if not arranque.estado.esperar("bd", timeout=30):
+        return Response("Iniciando, reintentar en unos segundos", status=503, headers={"Retry-After": "5"})
+
+@app.context_processor
+def estado_arranque():
+    return {"arranque": arranque.estado.resumen()}
+
+# --- Salud: /healthz = el proceso responde; /readyz = modelos, cachés y pool listos ---
+@app.route("/healthz")
+def healthz():
+    return jsonify({"ok": True, "modo": arranque.estado.modo})
+
+@app.route("/readyz")
+def readyz():
+    estado = arranque.estado.resumen()
+    return jsonify(estado), (200 if estado["listo"] else 503)
+
+def sin_reconocimiento():
+    # APP_MODO=admin: este proceso no ejecuta cámaras ni carga modelos
+    return Response("Reconocimiento no disponible en este servidor (APP_MODO=admin)", status=503)
 
 # --- Static file serving for images ---
 @app.route("/data/autorizados/<filename>")
@@ -58,7 +97,7 @@ def logout():
 def index():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    autorizados = database.list_autorizados()
+    autorizados = database.recent_autorizados(6)
     logo_exists = os.path.exists(os.path.join("static","logo-unmsm.png"))
     alarm_exists = os.path.exists(os.path.join("static","alarm.mp3"))
     return render_template("index.html", autorizados=autorizados, logo_exists=logo_exists, alarm_exists=alarm_exists)
@@ -68,27 +107,143 @@ def index():
 def transmision():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    return render_template("transmision.html")
+    camaras = database.list_camaras(solo_activas=True)
+    camera_id = request.args.get("camara", type=int)
+    if camera_id is None and camaras:
+        camera_id = camaras[0]["id"]
+    # id por ventana para que "Cerrar" solo detenga el stream de este visor
+    return render_template("transmision.html", viewer_id=uuid.uuid4().hex,
+                           camaras=camaras, camera_id=camera_id)
 
 @app.route("/video_feed")
-def video_feed():
+@app.route("/video_feed/<int:camera_id>")
+def video_feed(camera_id=None):
     if "usuario" not in session:
         return redirect(url_for("login"))
-    return Response(rc.gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    if not arranque.estado.completo:
+        return sin_reconocimiento()
+    viewer_id = request.args.get("viewer")
+    return Response(rc.gen_frames(viewer_id, camera_id, *stream_args()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+def stream_args():
+    # ?modo=crudo reenvía el JPEG de la cámara sin cajas (se dibujan desde /video_meta);
+    # ?calidad= y ?fps= ajustan el stream solo para este visor. Lo usa también servidor.py.
+    modo = request.args.get("modo", "anotado")
+    calidad = request.args.get("calidad", type=int)
+    fps = request.args.get("fps", type=float)
+    calidad = min(max(calidad, 10), 95) if calidad else None
+    fps = min(max(fps, 1.0), 30.0) if fps else None
+    return modo, calidad, fps
+
+@app.route("/video_meta")
+@app.route("/video_meta/<int:camera_id>")
+def video_meta(camera_id=None):
+    if "usuario" not in session:
+        return jsonify({"ok": False, "msg":"No autenticado"}), 401
+    if not arranque.estado.completo:
+        return sin_reconocimiento()
+    viewer_id = request.args.get("viewer")
+    return Response(rc.gen_metadata(viewer_id, camera_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Eventos del reconocimiento (intruso/autorizado) por Server-Sent Events; ?camara= filtra
+# por cámara. El navegador reenvía Last-Event-ID al reconectar y recibe lo que se perdió.
+@app.route("/eventos")
+def eventos():
+    if "usuario" not in session:
+        return jsonify({"ok": False, "msg":"No autenticado"}), 401
+    if not arranque.estado.completo:
+        return sin_reconocimiento()
+    camara = request.args.get("camara", type=int)
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    return Response(rc.gen_events(camara, last_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/stop_video", methods=["POST"])
 def stop_video():
     if "usuario" not in session:
         return jsonify({"ok": False, "msg":"No autenticado"}), 401
-    rc.stop_camera()
+    data = request.get_json(silent=True) or {}
+    viewer_id = data.get("viewer") or request.args.get("viewer")
+    if viewer_id:
+        rc.stop_camera(viewer_id)
     return jsonify({"ok": True, "msg":"Cámara detenida"})
 
+@app.route("/api/pipeline")
+def api_pipeline():
+    if "usuario" not in session:
+        return jsonify({"ok": False, "msg":"No autenticado"}), 401
+    return jsonify({"ok": True, "camaras": rc.pipeline_stats()})
+
+# Prometheus: con METRICS_TOKEN se exige "Authorization: Bearer <token>"; sin token
+# solo se permite desde la propia máquina o con sesión iniciada.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN:
+        if request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+            return Response("No autorizado\n", status=401, mimetype="text/plain")
+    elif "usuario" not in session and request.remote_addr not in ("127.0.0.1", "::1"):
+        return Response("No autorizado\n", status=401, mimetype="text/plain")
+    return Response(metricas.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 # --- Captura autorizados ---
 @app.route("/captura_autorizado")
 def captura_autorizado():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    return render_template("captura_autorizado.html")
+    return render_template("captura_autorizado.html", personas=database.list_personas())
+
+# Una persona se registra con una o varias muestras (ráfaga de la cámara o varias
+# fotos subidas); las muestras sin rostro se descartan.
+MAX_MUESTRAS = 20
+
+def _embeddings_muestras(imagenes):
+    # dlib nunca se carga en este proceso: en modo completo se usa el pool del
+    # reconocimiento; con APP_MODO=admin, un pool de un solo uso que se cierra al
+    # terminar (no queda un forkserver con los modelos en memoria)
+    rgbs = [np.ascontiguousarray(img[:, :, ::-1]) if img is not None else None for img in imagenes]
+    try:
+        if arranque.estado.completo:
+            return [rc.run_in_pool(rc.encode_image, rgb) if rgb is not None else None for rgb in rgbs]
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return [pool.submit(rc.encode_image, rgb).result() if rgb is not None else None for rgb in rgbs]
+    except Exception as e:
+        print(f"[app] Error calculando embeddings: {e}")
+        return [None] * len(imagenes)
+
+def _registrar_muestras(nombre, imagenes, persona_id=None):
+    # imagenes: lista de frames BGR. Devuelve (persona_id o None, muestras válidas).
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    muestras = []
+    imagenes = imagenes[:MAX_MUESTRAS]
+    for i, (img, emb) in enumerate(zip(imagenes, _embeddings_muestras(imagenes))):
+        if emb is None:
+            continue
+        filename = secure_filename(f"{nombre}_{stamp}_{i}.jpg")
+        cv2.imwrite(os.path.join("data","autorizados", filename), img)
+        muestras.append((filename, emb))
+    if not muestras:
+        return None, 0
+    pid = None
+    try:
+        pid, _ = database.add_persona_muestras(nombre, muestras, persona_id)
+    finally:
+        if pid is None:
+            # sin filas en la BD (persona borrada entretanto o error): fuera las fotos
+            database.file_remover.remove(os.path.join("data","autorizados", f) for f, _ in muestras)
+    if pid is None:
+        return None, 0
+    rc.sync_caches()
+    return pid, len(muestras)
+
+def _persona_arg(value):
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
 
 @app.route("/registrar_autorizado", methods=["GET","POST"])
 def registrar_autorizado():
@@ -96,27 +251,22 @@ def registrar_autorizado():
         return redirect(url_for("login"))
     if request.method == "POST":
         nombre = request.form.get("nombre","").strip()
-        file = request.files.get("imagen")
-        if not nombre or not file:
+        persona_id = _persona_arg(request.form.get("persona_id"))
+        files = [f for f in request.files.getlist("imagen") if f and f.filename]
+        if (not nombre and persona_id is None) or not files:
             flash("Nombre e imagen requeridos", "warning")
             return redirect(url_for("registrar_autorizado"))
-        filename = secure_filename(f"{nombre}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
-        path = os.path.join("data","autorizados", filename)
-        file.save(path)
-        # compute embedding
-        emb_hex = None
-        try:
-            img = face_recognition.load_image_file(path)
-            encs = face_recognition.face_encodings(img)
-            if encs:
-                emb_hex = np.array(encs[0], dtype=np.float64).tobytes().hex()
-        except Exception:
-            emb_hex = None
-        database.add_autorizado(nombre, filename, emb_hex)
-        rc.load_autorizados_cache()
-        flash("Autorizado registrado", "success")
+        if persona_id is not None and database.get_persona(persona_id) is None:
+            flash("La persona seleccionada ya no existe", "warning")
+            return redirect(url_for("registrar_autorizado"))
+        imagenes = [cv2.imdecode(np.frombuffer(f.read(), np.uint8), cv2.IMREAD_COLOR) for f in files[:MAX_MUESTRAS]]
+        pid, n = _registrar_muestras(nombre, imagenes, persona_id)
+        if pid is None:
+            flash("No se detectó un rostro en las imágenes", "warning")
+            return redirect(url_for("registrar_autorizado"))
+        flash(f"Autorizado registrado ({n} de {len(imagenes)} fotos con rostro)", "success")
         return redirect(url_for("index"))
-    return render_template("registrar_autorizado.html")
+    return render_template("registrar_autorizado.html", personas=database.list_personas())
 
 @app.route("/api/registrar_autorizado", methods=["POST"])
 def api_registrar_autorizado():
@@ -124,31 +274,48 @@ def api_registrar_autorizado():
         return jsonify({"ok": False, "msg":"No autenticado"}), 401
     data = request.get_json()
     nombre = data.get("nombre","").strip()
-    image_b64 = data.get("image","")
-    if not nombre or not image_b64:
+    persona_id = _persona_arg(data.get("persona_id"))
+    # "images": ráfaga de capturas; "image" se mantiene para una sola foto
+    images = data.get("images") or ([data["image"]] if data.get("image") else [])
+    if (not nombre and persona_id is None) or not images:
         return jsonify({"ok": False, "msg":"Nombre e imagen requeridos"}), 400
-    header, b64 = (image_b64.split(",",1) if "," in image_b64 else ("", image_b64))
-    try:
-        img_bytes = base64.b64decode(b64)
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    except Exception as e:
-        return jsonify({"ok": False, "msg": f"Error procesando imagen: {e}"}), 400
+    if persona_id is not None and database.get_persona(persona_id) is None:
+        return jsonify({"ok": False, "msg":"La persona no existe"}), 404
+    imagenes = []
+    for image_b64 in images[:MAX_MUESTRAS]:
+        header, b64 = (image_b64.split(",",1) if "," in image_b64 else ("", image_b64))
+        try:
+            img_bytes = base64.b64decode(b64)
+            nparr = np.frombuffer(img_bytes, np.uint8)
+            imagenes.append(cv2.imdecode(nparr, cv2.IMREAD_COLOR))
+        except Exception as e:
+            return jsonify({"ok": False, "msg": f"Error procesando imagen: {e}"}), 400
 
-    filename = secure_filename(f"{nombre}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
-    path = os.path.join("data","autorizados", filename)
-    cv2.imwrite(path, img)
-    emb_hex = None
-    try:
-        encs = face_recognition.face_encodings(img[:, :, ::-1])
-        if encs:
-            emb_hex = np.array(encs[0], dtype=np.float64).tobytes().hex()
-    except Exception:
-        emb_hex = None
+    pid, n = _registrar_muestras(nombre, imagenes, persona_id)
+    if pid is None:
+        return jsonify({"ok": False, "msg":"No se detectó un rostro en las capturas"}), 400
+    return jsonify({"ok": True, "msg":"Autorizado registrado", "persona_id": pid, "muestras": n})
 
-    database.add_autorizado(nombre, filename, emb_hex)
-    rc.load_autorizados_cache()
-    return jsonify({"ok": True, "msg":"Autorizado registrado"})
+@app.route("/autorizados/importar", methods=["GET","POST"])
+def importar_autorizados():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if not session.get("is_admin"):
+        flash("Acceso denegado: administrador requerido", "danger")
+        return redirect(url_for("index"))
+    if request.method == "POST":
+        archivo = request.files.get("zip")
+        if not archivo or not archivo.filename.lower().endswith(".zip"):
+            flash("Sube un archivo .zip con las fotos", "warning")
+            return redirect(url_for("importar_autorizados"))
+        zip_path = os.path.join("data", f"importar_{uuid.uuid4().hex}.zip")
+        archivo.save(zip_path)
+        csv_file = request.files.get("csv")
+        csv_text = csv_file.read().decode("utf-8-sig", errors="replace") if csv_file and csv_file.filename else None
+        job = importador.importar_zip_en_segundo_plano(zip_path, csv_text, on_commit=rc.sync_caches)
+        return redirect(url_for("importar_autorizados", job=job.id))
+    job = importador.get_job(request.args.get("job", ""))
+    return render_template("importar_autorizados.html", job=job)
 
 # --- Usuarios (admin area) ---
 @app.route("/usuarios")
@@ -223,20 +390,181 @@ def usuarios_eliminar(uid):
     flash("Usuario eliminado", "success")
     return redirect(url_for("usuarios"))
 
+# --- Cámaras (admin area) ---
+@app.route("/camaras")
+def camaras():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if not session.get("is_admin"):
+        flash("Acceso denegado: administrador requerido", "danger")
+        return redirect(url_for("index"))
+    rows = database.list_camaras()
+    return render_template("camaras.html", camaras=rows, activas=rc.active_cameras(),
+                           estado=rc.pipeline_stats(), backends=rc.available_backends())
+
+@app.route("/camaras/nueva", methods=["GET","POST"])
+def camaras_nueva():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if not session.get("is_admin"):
+        flash("Acceso denegado", "danger"); return redirect(url_for("index"))
+    if request.method == "POST":
+        nombre = request.form.get("nombre","").strip()
+        url = request.form.get("url","").strip()
+        activa = 1 if request.form.get("activa") == "on" else 0
+        if not nombre or not url:
+            flash("Nombre y URL requeridos", "warning"); return redirect(url_for("camaras_nueva"))
+        database.add_camara(nombre, url, activa)
+        flash("Cámara registrada", "success")
+        return redirect(url_for("camaras"))
+    return render_template("camaras_nueva.html")
+
+@app.route("/camaras/editar/<int:cid>", methods=["GET","POST"])
+def camaras_editar(cid):
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if not session.get("is_admin"):
+        flash("Acceso denegado", "danger"); return redirect(url_for("index"))
+    camara = database.get_camara(cid)
+    if not camara:
+        flash("Cámara no encontrada", "warning"); return redirect(url_for("camaras"))
+    if request.method == "POST":
+        nombre = request.form.get("nombre","").strip()
+        url = request.form.get("url","").strip()
+        activa = 1 if request.form.get("activa") == "on" else 0
+        if not nombre or not url:
+            flash("Nombre y URL requeridos", "warning"); return redirect(url_for("camaras_editar", cid=cid))
+        database.update_camara(cid, nombre, url, activa)
+        rc.restart_camera(cid)
+        flash("Cámara actualizada", "success")
+        return redirect(url_for("camaras"))
+    return render_template("camaras_nueva.html", edit=True, camara=camara)
+
+@app.route("/camaras/detector/<int:cid>", methods=["POST"])
+def camaras_detector(cid):
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if not session.get("is_admin"):
+        flash("Acceso denegado", "danger"); return redirect(url_for("index"))
+    backend = request.form.get("detector", "hog")
+    objetivo_ms = request.form.get("objetivo_ms", 0, type=float)
+    if backend not in rc.available_backends():
+        flash("Detector no disponible", "warning"); return redirect(url_for("camaras"))
+    if not 0 <= objetivo_ms < float("inf"):
+        flash("Objetivo de latencia no válido", "warning"); return redirect(url_for("camaras"))
+    database.update_camara_detector(cid, backend, objetivo_ms)
+    rc.configure_detector(cid, backend, objetivo_ms)
+    flash("Detector actualizado", "success")
+    return redirect(url_for("camaras"))
+
+@app.route("/api/detector/<int:cid>", methods=["GET","POST"])
+def api_detector(cid):
+    if "usuario" not in session:
+        return jsonify({"ok": False, "msg":"No autenticado"}), 401
+    if request.method == "GET":
+        estado = rc.pipeline_stats().get(cid)
+        return jsonify({"ok": True, "detector": estado["detector"] if estado else None})
+    if not session.get("is_admin"):
+        return jsonify({"ok": False, "msg":"Administrador requerido"}), 403
+    data = request.get_json(silent=True) or {}
+    # se valida aquí: sin worker en marcha configure_detector no ve los valores y se guardarían tal cual
+    backend, objetivo_ms, nivel = data.get("detector"), data.get("objetivo_ms"), data.get("nivel")
+    if backend is not None and backend not in rc.available_backends():
+        return jsonify({"ok": False, "msg": f"Detector no disponible: {backend}"}), 400
+    try:
+        if objetivo_ms is not None:
+            objetivo_ms = float(objetivo_ms)
+            if not 0 <= objetivo_ms < float("inf"):
+                raise ValueError
+        if nivel is not None:
+            nivel = int(nivel)
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "msg": "objetivo_ms debe ser un número no negativo y nivel un entero"}), 400
+    try:
+        estado = rc.configure_detector(cid, backend, objetivo_ms, nivel)
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": str(e)}), 400
+    camara = database.get_camara(cid)
+    if camara and (backend or objetivo_ms is not None):
+        database.update_camara_detector(cid, backend or camara["detector"],
+                                        camara["objetivo_ms"] if objetivo_ms is None else objetivo_ms)
+    return jsonify({"ok": True, "detector": estado})
+
+@app.route("/camaras/eliminar/<int:cid>", methods=["POST"])
+def camaras_eliminar(cid):
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if not session.get("is_admin"):
+        flash("Acceso denegado", "danger"); return redirect(url_for("index"))
+    database.delete_camara(cid)
+    rc.restart_camera(cid)
+    flash("Cámara eliminada", "success")
+    return redirect(url_for("camaras"))
+
 # --- Autorizados & Intrusos pages ---
+# Los listados se paginan por cursor: la página trae el primer bloque y el resto
+# se pide a /api/autorizados y /api/intrusos con el cursor `siguiente`.
+def _cursor_encode(cursor):
+    return f"{cursor[0]}|{cursor[1]}" if cursor else None
+
+def _cursor_decode(value):
+    if not value or "|" not in value:
+        return None
+    key, _, rid = value.rpartition("|")
+    try:
+        return (key, int(rid))
+    except ValueError:
+        return None
+
+def _fecha_arg(name):
+    value = request.args.get(name, "").strip()
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+def _autorizados_args():
+    return {"prefijo": request.args.get("q", "").strip() or None,
+            "limit": request.args.get("limite", type=int)}
+
+def _intrusos_args():
+    return {"desde": _fecha_arg("desde"), "hasta": _fecha_arg("hasta"),
+            "limit": request.args.get("limite", type=int)}
+
+def _autorizado_json(a):
+    return {"id": a["id"], "nombre": a["nombre"],
+            "img": url_for("serve_autorizado", filename=a["filename"]),
+            "eliminar": url_for("autorizados_eliminar", aid=a["id"])}
+
+def _intruso_json(it):
+    return {"id": it["id"], "fecha_hora": it["fecha_hora"],
+            "img": url_for("serve_intruso", filename=it["thumb"] or it["filename"]),
+            "descarga": url_for("serve_intruso", filename=it["filename"]),
+            "rostro": url_for("serve_intruso", filename=it["rostro"]) if it["rostro"] else None,
+            "eliminar": url_for("intrusos_eliminar", iid=it["id"])}
+
 @app.route("/autorizados")
 def autorizados_page():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    rows = database.list_autorizados()
-    return render_template("autorizados.html", autorizados=rows)
+    filtros = _autorizados_args()
+    rows, nxt = database.page_autorizados(**filtros)
+    return render_template("autorizados.html", autorizados=rows, siguiente=_cursor_encode(nxt),
+                           q=filtros["prefijo"] or "")
+
+@app.route("/api/autorizados")
+def api_autorizados():
+    if "usuario" not in session:
+        return jsonify({"ok": False, "msg":"No autenticado"}), 401
+    rows, nxt = database.page_autorizados(after=_cursor_decode(request.args.get("cursor")), **_autorizados_args())
+    return jsonify({"ok": True, "items": [_autorizado_json(a) for a in rows], "siguiente": _cursor_encode(nxt)})
 
 @app.route("/autorizados/eliminar/<int:aid>", methods=["POST"])
 def autorizados_eliminar(aid):
     if "usuario" not in session:
         return redirect(url_for("login"))
     database.delete_autorizado(aid)
-    rc.load_autorizados_cache()
+    rc.sync_caches()
     flash("Autorizado eliminado", "success")
     return redirect(url_for("autorizados_page"))
 
@@ -244,17 +572,28 @@ def autorizados_eliminar(aid):
 def intrusos_page():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    rows = database.list_intrusos()
-    return render_template("reporte_intrusos.html", intrusos=rows)
+    filtros = _intrusos_args()
+    rows, nxt = database.page_intrusos(**filtros)
+    return render_template("reporte_intrusos.html", intrusos=rows, siguiente=_cursor_encode(nxt),
+                           desde=filtros["desde"] or "", hasta=filtros["hasta"] or "")
+
+@app.route("/api/intrusos")
+def api_intrusos():
+    if "usuario" not in session:
+        return jsonify({"ok": False, "msg":"No autenticado"}), 401
+    rows, nxt = database.page_intrusos(before=_cursor_decode(request.args.get("cursor")), **_intrusos_args())
+    return jsonify({"ok": True, "items": [_intruso_json(it) for it in rows], "siguiente": _cursor_encode(nxt)})
 
 @app.route("/intrusos/eliminar/<int:iid>", methods=["POST"])
 def intrusos_eliminar(iid):
     if "usuario" not in session:
         return redirect(url_for("login"))
     database.delete_intruso(iid)
-    rc.load_intrusos_cache()
+    rc.sync_caches()
     flash("Intruso eliminado", "success")
     return redirect(url_for("intrusos_page"))
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # servidor de desarrollo; en producción usar servidor.py. Sin reloader: cargaría
+    # los modelos dos veces y duplicaría los workers de cámara.
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG", "1") == "1", use_reloader=False)
\ No newline at end of file
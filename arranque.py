@@ -0,0 +1,91 @@
+# arranque.py
+# Arranque en segundo plano y estado de disponibilidad. Importar app.py ya no carga
+# los modelos ni las cachés: el servidor responde enseguida (login, administración,
+# /healthz) y un hilo ejecuta las etapas: BD, cachés y pool de procesos (que es quien
+# carga los modelos de dlib). /readyz y el aviso de la interfaz muestran en qué etapa está.
+# Con APP_MODO=admin el proceso solo atiende la administración: no carga modelos,
+# cachés ni cámaras (p. ej. un worker aparte detrás del proxy para /autorizados).
+import os
+import sys
+import time
+import threading
+
+APP_MODO = os.environ.get("APP_MODO", "completo")
+# etapas por modo; las de un mismo grupo corren en paralelo
+GRUPOS = {
+    "completo": [["bd"], ["caches", "pool"]],
+    "admin": [["bd"]],
+}
+
+class Arranque:
+    def __init__(self, modo=APP_MODO):
+        if modo not in GRUPOS:
+            print(f"[arranque] APP_MODO desconocido '{modo}', se usa 'completo'")
+            modo = "completo"
+        self.modo = modo
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._hechas = {e: threading.Event() for grupo in GRUPOS[modo] for e in grupo}
+        self.etapas = {e: {"estado": "pendiente", "segundos": None, "error": None} for e in self._hechas}
+        self.listo_en = None
+        self._thread = None
+
+    @property
+    def completo(self):
+        return self.modo == "completo"
+
+    def listo(self):
+        return self.listo_en is not None
+
+    def esperar(self, etapa, timeout=None):
+        # True si la etapa terminó bien; las etapas que el modo no tiene cuentan como hechas
+        ev = self._hechas.get(etapa)
+        if ev is None:
+            return True
+        return ev.wait(timeout) and self.etapas[etapa]["estado"] == "listo"
+
+    def _etapa(self, nombre, fn):
+        with self._lock:
+            self.etapas[nombre]["estado"] = "en_curso"
+        t0 = time.perf_counter()
+        try:
+            fn()
+            estado, error = "listo", None
+        except Exception as e:
+            estado, error = "error", str(e)
+            print(f"[arranque] Error en la etapa {nombre}: {e}")
+        with self._lock:
+            self.etapas[nombre].update(estado=estado, error=error, segundos=round(time.perf_counter() - t0, 3))
+        self._hechas[nombre].set()
+        return estado == "listo"
+
+    def _run(self, pasos):
+        for grupo in GRUPOS[self.modo]:
+            hilos = [threading.Thread(target=self._etapa, args=(e, pasos[e]), daemon=True, name=f"arranque-{e}")
+                     for e in grupo]
+            for t in hilos:
+                t.start()
+            for t in hilos:
+                t.join()
+            if any(self.etapas[e]["estado"] != "listo" for e in grupo):
+                return
+        self.listo_en = round(time.perf_counter() - self._t0, 3)
+        print(f"[arranque] Listo en {self.listo_en}s ({self.modo})")
+
+    def iniciar(self, pasos):
+        # pasos: {etapa: función}; vuelve enseguida
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(pasos,), daemon=True, name="arranque")
+            self._thread.start()
+        return self._thread
+
+    def resumen(self):
+        with self._lock:
+            etapas = {e: dict(v) for e, v in self.etapas.items()}
+        return {"modo": self.modo, "listo": self.listo(), "listo_en": self.listo_en,
+                "segundos": round(time.perf_counter() - self._t0, 3), "etapas": etapas,
+                # dlib en este proceso: debería ser siempre False (los modelos viven en el pool)
+                "modelos_cargados": "face_recognition" in sys.modules}
+
+estado = Arranque()
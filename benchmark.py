@@ -0,0 +1,274 @@
+# benchmark.py
+# Benchmarks offline del sistema. Uso:
+#   python benchmark.py intrusos --tamanos 1000 10000 100000
+#   python benchmark.py pipeline grabacion.mp4 --frames 300 --detector hog
+#   python benchmark.py galeria --tamanos 100 1000 10000 --rostros 4
+#   python benchmark.py arranque --modos completo admin --importtime 15
+import os
+import sys
+import re
+import json
+import socket
+import argparse
+import subprocess
+import time
+import urllib.request
+import cv2
+import numpy as np
+
+from galeria import Gallery, IntrusoIndex, person_template
+
+# etapas de process_frame más la lectura de la fuente y la codificación JPEG del visor
+ETAPAS = ["decodificacion", "redimension", "movimiento", "deteccion", "calidad", "codificacion",
+          "comparacion", "intruso", "anotacion", "jpeg"]
+
+def percentil_ms(tiempos, p):
+    return float(np.percentile(np.asarray(tiempos) * 1000.0, p))
+
+def embeddings_sinteticos(n, rng, identidades=None, ruido=0.08):
+    # Embeddings agrupados por identidad, con distancias intra/inter-persona parecidas
+    # a las de face_recognition (~0.3 misma persona, ~0.8 personas distintas).
+    identidades = identidades or max(1, n // 4)
+    centros = rng.normal(0.0, 0.07, size=(identidades, 128))
+    quien = rng.integers(0, identidades, size=n)
+    datos = centros[quien] + rng.normal(0.0, ruido / np.sqrt(128) * 2, size=(n, 128))
+    return datos.astype(np.float64), centros
+
+def bench_intrusos(args):
+    rng = np.random.default_rng(args.semilla)
+    print(f"{'N':>8} {'lineal p50':>11} {'lineal p95':>11} {'índice p50':>11} {'índice p95':>11} {'carga':>8} {'acuerdo':>8}")
+    for n in args.tamanos:
+        datos, centros = embeddings_sinteticos(n, rng)
+        # mitad consultas repetidas (deben deduplicarse), mitad personas nuevas
+        mitad = args.consultas // 2
+        repetidas = datos[rng.integers(0, n, size=mitad)] + rng.normal(0, 0.01, size=(mitad, 128))
+        nuevas = rng.normal(0.0, 0.07, size=(args.consultas - mitad, 128))
+        consultas = np.vstack([repetidas, nuevas])
+
+        # implementación anterior: lista de arrays float64 y face_distance por consulta
+        lista = list(datos)
+        t_lineal, esperado = [], []
+        for q in consultas:
+            t0 = time.perf_counter()
+            d = np.linalg.norm(np.asarray(lista) - q, axis=1)
+            esperado.append(bool((d <= args.tolerancia).any()))
+            t_lineal.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        indice = IntrusoIndex(nprobe=args.nprobe)
+        indice.load(list(range(n)), datos, np.full(n, time.time()))
+        t_carga = time.perf_counter() - t0
+        t_indice, obtenido = [], []
+        for q in consultas:
+            t0 = time.perf_counter()
+            obtenido.append(indice.contains_near(q, args.tolerancia))
+            t_indice.append(time.perf_counter() - t0)
+
+        acuerdo = np.mean(np.array(esperado) == np.array(obtenido)) * 100.0
+        print(f"{n:>8} {percentil_ms(t_lineal, 50):>9.3f}ms {percentil_ms(t_lineal, 95):>9.3f}ms "
+              f"{percentil_ms(t_indice, 50):>9.3f}ms {percentil_ms(t_indice, 95):>9.3f}ms "
+              f"{t_carga:>7.2f}s {acuerdo:>7.1f}%")
+
+def galeria_sintetica(personas, rng, muestras=5):
+    # personas con varias muestras alrededor de su centro, ya convertidas a plantilla
+    datos, _ = embeddings_sinteticos(personas * muestras, rng, identidades=personas)
+    return [(i, f"persona_{i}", person_template(datos[i * muestras:(i + 1) * muestras]))
+            for i in range(personas)]
+
+def tabla_percentiles(filas):
+    print(f"{'etapa':<16} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'media/frame':>12}")
+    for nombre, tiempos, frames in filas:
+        if not tiempos:
+            print(f"{nombre:<16} {0:>6} {'-':>9} {'-':>9} {'-':>9} {'-':>12}")
+            continue
+        print(f"{nombre:<16} {len(tiempos):>6} {percentil_ms(tiempos, 50):>7.2f}ms {percentil_ms(tiempos, 95):>7.2f}ms "
+              f"{percentil_ms(tiempos, 99):>7.2f}ms {sum(tiempos) * 1000.0 / max(1, frames):>10.2f}ms")
+
+def bench_pipeline(args):
+    # import diferido: necesita face_recognition/dlib y el pool de procesos
+    import reconocimiento as rc
+    from fuentes import open_source
+
+    rng = np.random.default_rng(args.semilla)
+    if args.galeria:
+        rc.gallery.set_people(galeria_sintetica(args.galeria, rng), replace_all=True)
+    source = open_source(args.fuente, realtime=False)
+    if not source.isOpened():
+        raise SystemExit(f"No se pudo abrir {args.fuente}")
+    tracker = rc.FaceTracker()
+    motion = None if args.sin_movimiento else rc.MotionDetector()
+    detector = rc.DetectorController(args.detector, args.objetivo_ms)
+    # deduplicación real de intrusos pero sin escribir en disco ni en la BD
+    indice = IntrusoIndex()
+
+    def on_intruso(frame, enc, box):
+        if not indice.contains_near(enc, rc.INTRUSO_TOLERANCE):
+            indice.add(enc)
+
+    rc.start_pool()
+    por_etapa = {e: [] for e in ETAPAS}
+    totales = []
+    procesados = 0
+    inicio = time.perf_counter()
+    while procesados < args.frames + args.calentamiento:
+        t0 = time.perf_counter()
+        ret, frame = source.read()
+        if not ret or frame is None:
+            break
+        timings = {"decodificacion": time.perf_counter() - t0}
+        frame = rc.process_frame(frame, tracker, motion, detector, timings, on_intruso)
+        t1 = time.perf_counter()
+        cv2.imencode(".jpg", frame)
+        timings["jpeg"] = time.perf_counter() - t1
+        procesados += 1
+        if procesados == args.calentamiento:
+            inicio = time.perf_counter()
+        if procesados <= args.calentamiento:
+            continue
+        totales.append(time.perf_counter() - t0)
+        for etapa, s in timings.items():
+            por_etapa[etapa].append(s)
+    source.release()
+    rc.shutdown_pool()
+
+    medidos = len(totales)
+    if not medidos:
+        raise SystemExit("La fuente no tiene frames suficientes")
+    duracion = time.perf_counter() - inicio
+    print(f"fuente={args.fuente} frames={medidos} detector={detector.backend} "
+          f"escala={detector.scale} galeria={len(rc.gallery)} filas")
+    tabla_percentiles([(e, por_etapa[e], medidos) for e in ETAPAS] + [("total", totales, medidos)])
+    print(f"{medidos / duracion:.1f} frames/s en un solo hilo")
+
+def bench_galeria(args):
+    # coste de gallery.match para un frame con `rostros` caras según el nº de personas
+    rng = np.random.default_rng(args.semilla)
+    print(f"{'personas':>9} {'filas':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for n in args.tamanos:
+        personas = galeria_sintetica(n, rng)
+        galeria = Gallery()
+        galeria.set_people(personas, replace_all=True)
+        consultas = np.vstack([p[2][0] for p in personas[:args.rostros]]) + rng.normal(0, 0.01, (min(n, args.rostros), 128))
+        tiempos = []
+        for _ in range(args.repeticiones):
+            t0 = time.perf_counter()
+            galeria.match(consultas, 0.6)
+            tiempos.append(time.perf_counter() - t0)
+        print(f"{n:>9} {len(galeria):>7} {percentil_ms(tiempos, 50):>7.3f}ms {percentil_ms(tiempos, 95):>7.3f}ms "
+              f"{percentil_ms(tiempos, 99):>7.3f}ms")
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _esperar(url, proceso, timeout):
+    # segundos hasta que url responde 200 y su JSON; (None, None) si el servidor muere o no llega
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout and proceso.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                return time.perf_counter(), json.loads(r.read() or b"{}")
+        except Exception:
+            time.sleep(0.02)
+    return None, None
+
+def medir_arranque(modo, timeout):
+    # proceso nuevo para cada medida: nada queda importado ni cacheado entre ellas
+    env = dict(os.environ, APP_MODO=modo)
+    # el arranque en segundo plano también escribe en stdout: el tiempo va en su propia línea marcada
+    code = "import time; t = time.perf_counter(); import app; print(f'\\n@importar {time.perf_counter() - t}', flush=True)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, timeout=timeout)
+    if out.returncode != 0:
+        raise SystemExit(f"Error importando app.py ({modo}):\n{out.stderr[-2000:]}")
+    importar = float(re.search(r"^@importar (\S+)", out.stdout, re.M).group(1))
+
+    port = _puerto_libre()
+    servidor = os.path.join(os.path.dirname(os.path.abspath(__file__)), "servidor.py")
+    t0 = time.perf_counter()
+    proceso = subprocess.Popen([sys.executable, servidor, "--host", "127.0.0.1", "--port", str(port)], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        primera, _ = _esperar(f"http://127.0.0.1:{port}/healthz", proceso, timeout)
+        listo, estado = _esperar(f"http://127.0.0.1:{port}/readyz", proceso, timeout)
+    finally:
+        proceso.terminate()
+        proceso.wait(10)
+    return {"importar": importar,
+            "primera": primera - t0 if primera else None,
+            "listo": listo - t0 if listo else None,
+            "etapas": {e: v["segundos"] for e, v in (estado or {}).get("etapas", {}).items()},
+            "modelos": (estado or {}).get("modelos_cargados")}
+
+def _mediana(valores):
+    valores = [v for v in valores if v is not None]
+    return float(np.median(valores)) if valores else None
+
+def _seg(v):
+    return f"{v:.2f}s" if v is not None else "-"
+
+def bench_arranque(args):
+    # importación de app.py, primera respuesta (/healthz) y disponibilidad (/readyz) de servidor.py
+    print(f"{'modo':<10} {'importar':>9} {'1ª resp.':>9} {'listo':>9} {'modelos':>8}  etapas")
+    for modo in args.modos:
+        medidas = [medir_arranque(modo, args.timeout) for _ in range(args.repeticiones)]
+        etapas = {e: _mediana([m["etapas"].get(e) for m in medidas]) for e in medidas[-1]["etapas"]}
+        modelos = {"sí" if m["modelos"] else "no" for m in medidas}
+        print(f"{modo:<10} {_seg(_mediana([m['importar'] for m in medidas])):>9} "
+              f"{_seg(_mediana([m['primera'] for m in medidas])):>9} {_seg(_mediana([m['listo'] for m in medidas])):>9} "
+              f"{'/'.join(sorted(modelos)):>8}  " + ", ".join(f"{e} {_seg(v)}" for e, v in etapas.items()))
+    if args.importtime:
+        # -X importtime: los módulos con más tiempo acumulado al importar app.py
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], capture_output=True, text=True,
+                             env=dict(os.environ, APP_MODO=args.modos[0]), timeout=args.timeout)
+        filas = []
+        for line in out.stderr.splitlines():
+            partes = line.split("|")
+            if len(partes) == 3 and partes[1].strip().isdigit():
+                filas.append((int(partes[1]), partes[2].rstrip()))
+        print(f"\nMódulos más lentos de importar ({args.modos[0]}):")
+        for us, nombre in sorted(filas, reverse=True)[:args.importtime]:
+            print(f"  {us / 1000.0:>9.1f}ms {nombre}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del sistema de reconocimiento")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("intrusos", help="Deduplicación de intrusos: búsqueda lineal vs índice IVF")
+    p.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--consultas", type=int, default=200)
+    p.add_argument("--tolerancia", type=float, default=0.6)
+    p.add_argument("--nprobe", type=int, default=4)
+    p.add_argument("--semilla", type=int, default=0)
+    p.set_defaults(func=bench_intrusos)
+
+    p = sub.add_parser("pipeline", help="Latencia por etapa y frames/s sobre una grabación")
+    p.add_argument("fuente", help="Archivo de video, carpeta de JPEGs o URL MJPEG (ver fuentes.py)")
+    p.add_argument("--frames", type=int, default=300)
+    p.add_argument("--calentamiento", type=int, default=10, help="Frames iniciales que no se miden")
+    p.add_argument("--detector", default=None, help="hog, haar, lbp, ssd o yunet")
+    p.add_argument("--objetivo-ms", type=float, default=0)
+    p.add_argument("--sin-movimiento", action="store_true", help="Desactiva la compuerta de movimiento")
+    p.add_argument("--galeria", type=int, default=0, help="Personas sintéticas en la galería")
+    p.add_argument("--semilla", type=int, default=0)
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("galeria", help="Coste de comparación según el tamaño de la galería")
+    p.add_argument("--tamanos", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    p.add_argument("--rostros", type=int, default=4, help="Rostros por frame")
+    p.add_argument("--repeticiones", type=int, default=200)
+    p.add_argument("--semilla", type=int, default=0)
+    p.set_defaults(func=bench_galeria)
+
+    p = sub.add_parser("arranque", help="Tiempo de importación, primera respuesta y disponibilidad del servidor")
+    p.add_argument("--modos", nargs="+", default=["completo", "admin"], choices=["completo", "admin"])
+    p.add_argument("--repeticiones", type=int, default=3)
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--importtime", type=int, default=0, metavar="N", help="Listar los N módulos más lentos de importar")
+    p.set_defaults(func=bench_arranque)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
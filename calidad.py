@@ -0,0 +1,101 @@
+# calidad.py
+# Puntuación barata de la calidad de un rostro, para decidir si vale la pena calcular
+# su embedding. Mide tamaño de la caja, nitidez (varianza del laplaciano), brillo y
+# pose a partir de los 5 landmarks de dlib. Cada factor va de 0 a 1 y la puntuación
+# es su producto. La pose necesita dlib: se calcula aparte, en el pool de procesos
+# (poses), y se combina con con_pose.
+import os
+import math
+from collections import namedtuple
+import cv2
+import numpy as np
+
+QUALITY_ENABLED = os.environ.get("QUALITY_ENABLED", "1") == "1"
+# por debajo de QUALITY_MIN la toma se descarta; desde QUALITY_GOOD se codifica sin esperar
+QUALITY_MIN = float(os.environ.get("QUALITY_MIN", "0.3"))
+QUALITY_GOOD = float(os.environ.get("QUALITY_GOOD", "0.7"))
+# detecciones que se esperan como máximo para elegir la mejor toma de un track nuevo
+QUALITY_WINDOW = int(os.environ.get("QUALITY_WINDOW", "3"))
+QUALITY_POSE = os.environ.get("QUALITY_POSE", "1") == "1"
+
+# rampas (valor con puntuación 0, valor con puntuación 1); tamaño en px del frame original
+FACE_PX = (30, 90)
+SHARPNESS = (15.0, 120.0)  # varianza del laplaciano sobre el rostro a 64x64
+DARK = (30, 70)            # brillo medio (0-255)
+BRIGHT = (235, 190)
+YAW = (0.55, 0.2)          # desplazamiento de la nariz respecto al centro de los ojos / distancia entre ojos
+ROLL = (40.0, 15.0)        # grados
+CROP_MARGIN = 0.3
+SAMPLE = 64
+
+Calidad = namedtuple("Calidad", "puntuacion tamano nitidez brillo pose motivo")
+
+def _rampa(value, zero, one):
+    if zero == one:
+        return 1.0
+    return float(min(1.0, max(0.0, (value - zero) / (one - zero))))
+
+def pose(rgb, box):
+    # 1.0 = frontal; None si dlib no encuentra los landmarks. Solo en procesos del pool.
+    import face_recognition
+    try:
+        marks = face_recognition.face_landmarks(rgb, [box], model="small")
+    except Exception:
+        return None
+    if not marks or "nose_tip" not in marks[0]:
+        return None
+    m = marks[0]
+    left = np.mean(m["left_eye"], axis=0)
+    right = np.mean(m["right_eye"], axis=0)
+    nose = np.mean(m["nose_tip"], axis=0)
+    eyes = right - left
+    dist = float(np.hypot(*eyes))
+    if dist < 1.0:
+        return 0.0
+    yaw = abs(float(nose[0] - (left[0] + right[0]) / 2.0)) / dist
+    roll = abs(math.degrees(math.atan2(eyes[1], eyes[0])))
+    roll = min(roll, 180.0 - roll)
+    return _rampa(yaw, *YAW) * _rampa(roll, *ROLL)
+
+def poses(crops):
+    # se ejecuta en un proceso del pool: pose de cada (recorte rgb, caja relativa) de recortar()
+    return [pose(rgb, box) for rgb, box in crops]
+
+def puntuar(frame, rgb_small, box, scale=1.0):
+    # frame: BGR original; rgb_small: la imagen reducida donde está `box` (top, right, bottom, left).
+    # Sin pose (cuenta como 1.0): ver con_pose.
+    top, right, bottom, left = (int(v / scale) for v in box)
+    h, w = frame.shape[:2]
+    face = frame[max(0, top):min(h, bottom), max(0, left):min(w, right)]
+    if not face.size:
+        return Calidad(0.0, 0.0, 0.0, 0.0, 0.0, "tamano")
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    sample = cv2.resize(gray, (SAMPLE, SAMPLE), interpolation=cv2.INTER_AREA)
+    factores = {
+        "tamano": _rampa(min(bottom - top, right - left), *FACE_PX),
+        "nitidez": _rampa(cv2.Laplacian(sample, cv2.CV_64F).var(), *SHARPNESS),
+    }
+    mean = float(sample.mean())
+    factores["brillo"] = min(_rampa(mean, *DARK), _rampa(mean, *BRIGHT))
+    factores["pose"] = 1.0
+    return _calidad(factores)
+
+def con_pose(q, p):
+    # añade la pose calculada en el pool; None (sin landmarks) no penaliza
+    if p is None:
+        return q
+    return _calidad({"tamano": q.tamano, "nitidez": q.nitidez, "brillo": q.brillo, "pose": p})
+
+def _calidad(factores):
+    puntuacion = float(np.prod(list(factores.values())))
+    motivo = min(factores, key=factores.get) if puntuacion < QUALITY_MIN else None
+    return Calidad(puntuacion, factores["tamano"], factores["nitidez"], factores["brillo"], factores["pose"], motivo)
+
+def recortar(rgb_small, box, margin=CROP_MARGIN):
+    # recorte con margen y la caja relativa a él: se envía al pool en lugar de la imagen entera
+    h, w = rgb_small.shape[:2]
+    top, right, bottom, left = (int(v) for v in box)
+    mh, mw = int((bottom - top) * margin), int((right - left) * margin)
+    t, l = max(0, top - mh), max(0, left - mw)
+    b, r = min(h, bottom + mh), min(w, right + mw)
+    return np.ascontiguousarray(rgb_small[t:b, l:r]), (top - t, right - l, bottom - t, left - l)
@@ -0,0 +1,151 @@
+# capturas.py
+import os
+import time
+import uuid
+import queue
+import threading
+from datetime import datetime
+import cv2
+import database
+
+DATA_INT = os.path.join("data", "intrusos")
+
+SNAPSHOT_WORKERS = int(os.environ.get("SNAPSHOT_WORKERS", "2"))
+SNAPSHOT_QUEUE = int(os.environ.get("SNAPSHOT_QUEUE", "32"))
+# "nuevo": con la cola llena se descarta la captura entrante; "antiguo": la más vieja en cola
+SNAPSHOT_DROP_POLICY = os.environ.get("SNAPSHOT_DROP_POLICY", "nuevo")
+THUMB_WIDTH = 240
+THUMB_QUALITY = 70
+FACE_PADDING = 0.3
+
+def snapshot_names(now=None):
+    # microsegundos + sufijo aleatorio: dos intrusos en el mismo segundo no se pisan
+    now = now or datetime.now()
+    base = f"intruso_{now.strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:6]}"
+    return f"{base}.jpg", f"{base}_rostro.jpg", f"{base}_thumb.jpg"
+
+def crop_face(frame, box, padding=FACE_PADDING):
+    h, w = frame.shape[:2]
+    top, right, bottom, left = box
+    ph, pw = int((bottom - top) * padding), int((right - left) * padding)
+    return frame[max(0, top - ph):min(h, bottom + ph), max(0, left - pw):min(w, right + pw)]
+
+def _notify(on_error):
+    # la captura no llegará a la BD: quien la encoló deshace lo que hizo (índice de intrusos)
+    if on_error is not None:
+        try:
+            on_error()
+        except Exception:
+            pass
+
+def make_thumbnail(frame, width=THUMB_WIDTH):
+    h, w = frame.shape[:2]
+    if w <= width:
+        return frame
+    return cv2.resize(frame, (width, max(1, int(h * width / float(w)))), interpolation=cv2.INTER_AREA)
+
+class SnapshotWriter:
+    # Pool de hilos que guarda frame completo, recorte del rostro y miniatura de cada
+    # intruso y después encola la fila en la BD. La cola es acotada: si el disco no da
+    # abasto se aplica la política de descarte en lugar de frenar el video.
+    def __init__(self, workers=SNAPSHOT_WORKERS, maxsize=SNAPSHOT_QUEUE, policy=SNAPSHOT_DROP_POLICY, directory=DATA_INT):
+        self.workers = workers
+        self.policy = policy
+        self.directory = directory
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.saved = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._run, daemon=True, name=f"capturas:{len(self._threads)}")
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, frame, box, embedding, ts, callback=None, on_error=None):
+        # frame debe ser una copia propia (el hilo de video lo sigue anotando). Si se
+        # descarta aquí devuelve None; si se pierde después (desalojo, error de disco o
+        # cola de la BD llena) se llama on_error()
+        self._ensure_started()
+        now = datetime.fromtimestamp(ts)
+        job = (frame, box, embedding, ts, now, snapshot_names(now), callback, on_error)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            if self.policy != "antiguo":
+                self.dropped += 1
+                return None
+            try:
+                evicted = self._queue.get_nowait()
+                self._queue.task_done()
+                _notify(evicted[7])
+            except queue.Empty:
+                pass
+            self.dropped += 1
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                return None
+        return job[5][0]
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._save(*job)
+            except Exception as e:
+                self.errors += 1
+                print(f"[capturas] Error guardando captura: {e}")
+                _notify(job[7])
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name, image, params=()):
+        # codifica en memoria para conocer el tamaño sin otro stat; 0 si falla
+        ok, buf = cv2.imencode(".jpg", image, list(params))
+        if not ok:
+            return 0
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(buf.tobytes())
+        return len(buf)
+
+    def _save(self, frame, box, embedding, ts, now, names, callback, on_error):
+        full, rostro, thumb = names
+        tamano = self._write(full, frame)
+        if not tamano:
+            raise IOError(f"no se pudo escribir {full}")
+        face = crop_face(frame, box) if box is not None else None
+        n = self._write(rostro, face) if face is not None and face.size else 0
+        if not n:
+            rostro = None
+        tamano += n
+        n = self._write(thumb, make_thumbnail(frame), [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+        if not n:
+            thumb = None
+        tamano += n
+        if not database.queue_intruso(full, now.strftime("%Y-%m-%d %H:%M:%S"), embedding, ts, callback=callback,
+                                      thumb=thumb, rostro=rostro, tamano=tamano, on_error=on_error):
+            # cola de la BD llena: sin fila, los archivos quedarían huérfanos
+            database.file_remover.remove(os.path.join(self.directory, n) for n in (full, rostro, thumb) if n)
+            self.dropped += 1
+            _notify(on_error)
+            return
+        self.saved += 1
+
+snapshot_writer = SnapshotWriter()
@@ -1,16 +1,140 @@
 # database.py
 import sqlite3
 import os
+import json
+import time
+import queue
+import atexit
+import threading
+import numpy as np
+from numpy.lib.format import open_memmap
 from werkzeug.security import generate_password_hash
 
+import metricas
+
 DB_FILE = "database.db"
+# Copia en disco (.npy mapeado en memoria) de los embeddings de cada tabla
+CACHE_DIR = os.path.join("data", "cache")
+EMBEDDING_DIM = 128
 
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
+# Pool de conexiones persistentes; close() devuelve la conexión al pool
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+# Escritura diferida de intrusos: tamaño de lote y espera máxima antes de confirmar
+WRITE_BATCH = 64
+WRITE_DELAY = 0.2
+WRITE_QUEUE_MAX = 1000
+# Filas que se conservan en el registro de cambios (un proceso más atrasado recarga todo)
+CAMBIOS_MAX = 10000
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+)
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, timeout=5.0)
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
+class _PooledConnection:
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE):
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._db_file = None
+
+    def acquire(self):
+        if self._db_file != DB_FILE:
+            # DB_FILE cambió (p. ej. en scripts): se descartan las conexiones anteriores
+            self.clear()
+            self._db_file = DB_FILE
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = _connect()
+        return _PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def clear(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pool = ConnectionPool()
+
+def get_connection():
+    return _pool.acquire()
+
+def _ensure_column(c, table, column, decl):
+    # migración mínima para bases creadas con versiones anteriores
+    cols = [r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in cols:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migrate_embedding_hex(c, table):
+    rows = c.execute(f"SELECT id, embedding_hex FROM {table} WHERE embedding_hex IS NOT NULL AND embedding IS NULL").fetchall()
+    if not rows:
+        return
+    updates = []
+    for r in rows:
+        try:
+            emb = np.frombuffer(bytes.fromhex(r[1]), dtype=np.float64)
+        except ValueError:
+            continue
+        updates.append((embedding_to_blob(emb), r[0]))
+    c.executemany(f"UPDATE {table} SET embedding = ?, embedding_hex = NULL WHERE id = ?", updates)
+    print(f"[INIT] {len(updates)} embeddings de {table} migrados a BLOB float32")
+
+def _migrate_personas(c):
+    # autorizados anteriores: una persona por nombre distinto, con todas sus fotos
+    rows = c.execute("SELECT DISTINCT nombre FROM autorizados WHERE persona_id IS NULL").fetchall()
+    for (nombre,) in rows:
+        cur = c.execute("INSERT INTO personas (nombre) VALUES (?)", (nombre,))
+        c.execute("UPDATE autorizados SET persona_id = ? WHERE persona_id IS NULL AND nombre = ?", (cur.lastrowid, nombre))
+    if rows:
+        print(f"[INIT] {len(rows)} personas creadas a partir de autorizados existentes")
+
+def embedding_to_blob(emb):
+    if emb is None:
+        return None
+    return np.asarray(emb, dtype=np.float32).reshape(EMBEDDING_DIM).tobytes()
+
+def blob_to_embedding(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+def init_db(default_camera_url=None):
     first_time = not os.path.exists(DB_FILE)
     conn = get_connection()
     c = conn.cursor()
@@ -31,6 +155,16 @@ def init_db():
         embedding_hex TEXT
     )''')
 
+    # una persona autorizada puede tener varias muestras (filas de autorizados)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS personas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        creado TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    _ensure_column(c, "autorizados", "persona_id", "INTEGER REFERENCES personas(id)")
+    _migrate_personas(c)
+
     c.execute('''
     CREATE TABLE IF NOT EXISTS intrusos (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,8 +173,79 @@ def init_db():
         embedding_hex TEXT
     )''')
 
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS camaras (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        url TEXT NOT NULL,
+        activa INTEGER DEFAULT 1,
+        detector TEXT DEFAULT 'hog',
+        objetivo_ms REAL DEFAULT 0
+    )''')
+    _ensure_column(c, "camaras", "detector", "TEXT DEFAULT 'hog'")
+    _ensure_column(c, "camaras", "objetivo_ms", "REAL DEFAULT 0")
+
+    # embeddings como BLOB float32 (512 bytes) en lugar de hex de float64
+    _ensure_column(c, "autorizados", "embedding", "BLOB")
+    _ensure_column(c, "intrusos", "embedding", "BLOB")
+    # miniatura y recorte del rostro de cada captura (NULL en capturas antiguas)
+    _ensure_column(c, "intrusos", "thumb", "TEXT")
+    _ensure_column(c, "intrusos", "rostro", "TEXT")
+    # bytes en disco de la captura (completa + rostro + miniatura), para el límite de tamaño
+    _ensure_column(c, "intrusos", "tamano", "INTEGER")
+    for table in ("autorizados", "intrusos"):
+        _migrate_embedding_hex(c, table)
+
+    # generación por tabla, incrementada por triggers en cada cambio de embeddings;
+    # permite saber sin leer filas si la copia .npy sigue al día
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS embedding_gen (
+        tabla TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    )''')
+    for table in ("autorizados", "intrusos"):
+        c.execute("INSERT OR IGNORE INTO embedding_gen (tabla, generation) VALUES (?, 0)", (table,))
+        bump = f"UPDATE embedding_gen SET generation = generation + 1 WHERE tabla = '{table}'"
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_gen_ins AFTER INSERT ON {table} BEGIN {bump}; END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_gen_del AFTER DELETE ON {table} BEGIN {bump}; END")
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_gen_upd AFTER UPDATE OF embedding ON {table} BEGIN {bump}; END")
+
+    # registro de cambios para las cachés en memoria: cada proceso aplica solo las filas
+    # posteriores a la última que vio (ver reconocimiento.CacheSync)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS cambios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tabla TEXT NOT NULL,
+        operacion TEXT NOT NULL,
+        fila INTEGER NOT NULL,
+        persona_id INTEGER
+    )''')
+    log = "INSERT INTO cambios (tabla, operacion, fila, persona_id) VALUES"
+    for name, sql in (
+        ("autorizados_log_ins", f"AFTER INSERT ON autorizados BEGIN {log} ('autorizados', 'alta', NEW.id, NEW.persona_id); END"),
+        ("autorizados_log_del", f"AFTER DELETE ON autorizados BEGIN {log} ('autorizados', 'baja', OLD.id, OLD.persona_id); END"),
+        ("autorizados_log_upd", "AFTER UPDATE OF embedding, persona_id ON autorizados BEGIN "
+                                f"{log} ('autorizados', 'cambio', NEW.id, NEW.persona_id); "
+                                f"{log} ('autorizados', 'cambio', OLD.id, OLD.persona_id); END"),
+        ("personas_log_upd", f"AFTER UPDATE OF nombre ON personas BEGIN {log} ('personas', 'cambio', NEW.id, NEW.id); END"),
+        ("intrusos_log_ins", f"AFTER INSERT ON intrusos BEGIN {log} ('intrusos', 'alta', NEW.id, NULL); END"),
+        ("intrusos_log_del", f"AFTER DELETE ON intrusos BEGIN {log} ('intrusos', 'baja', OLD.id, NULL); END"),
+    ):
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {sql}")
+
+    # índices para los listados paginados (orden + cursor) y el filtro por fechas
+    c.execute("CREATE INDEX IF NOT EXISTS idx_intrusos_fecha ON intrusos (fecha_hora, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_autorizados_nombre ON autorizados (nombre, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_autorizados_persona ON autorizados (persona_id)")
+
     conn.commit()
 
+    # la cámara configurada por defecto pasa a ser la primera del registro
+    if default_camera_url and c.execute("SELECT COUNT(*) FROM camaras").fetchone()[0] == 0:
+        c.execute("INSERT INTO camaras (nombre, url, activa) VALUES (?, ?, 1)",
+                  ("ESP32-CAM", default_camera_url))
+        conn.commit()
+
     if first_time:
         # crear admin por defecto
         pwd_hash = generate_password_hash("1234")
@@ -53,11 +258,6 @@ def init_db():
 
 # ---- Usuarios ----
 def add_user(username, password_hash, is_admin=0):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO usuarios (username, password, is_admin, password) VALUES (?, ?, ?, ?)",
-              (username, is_admin, is_admin, password_hash))  # legacy insertion (harmless)
-    # proper insertion
     conn = get_connection()
     c = conn.cursor()
     c.execute("INSERT INTO usuarios (username, password, is_admin) VALUES (?, ?, ?)",
@@ -105,20 +305,105 @@ def delete_user(uid):
     conn.commit()
     conn.close()
 
-# ---- Autorizados ----
-def add_autorizado(nombre, filename, embedding_hex=None):
+# ---- Personas y autorizados ----
+def _persona_por_nombre(conn, nombre):
+    row = conn.execute("SELECT id FROM personas WHERE nombre = ? ORDER BY id LIMIT 1", (nombre,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute("INSERT INTO personas (nombre) VALUES (?)", (nombre,)).lastrowid
+
+def add_persona_muestras(nombre, muestras, persona_id=None):
+    # muestras: [(filename, embedding)] de una misma persona. Sin persona_id se crea
+    # una persona nueva. Devuelve (persona_id, ids de autorizados), o (None, []) si
+    # persona_id no existe.
     conn = get_connection()
-    conn.execute("INSERT INTO autorizados (nombre, filename, embedding_hex) VALUES (?, ?, ?)",
-                 (nombre, filename, embedding_hex))
-    conn.commit()
-    conn.close()
+    ids = []
+    try:
+        with conn:
+            if persona_id is None:
+                persona_id = conn.execute("INSERT INTO personas (nombre) VALUES (?)", (nombre,)).lastrowid
+            else:
+                row = conn.execute("SELECT nombre FROM personas WHERE id = ?", (persona_id,)).fetchone()
+                if row is None:
+                    return None, []
+                nombre = row[0]
+            for filename, embedding in muestras:
+                cur = conn.execute("INSERT INTO autorizados (nombre, filename, embedding, persona_id) VALUES (?, ?, ?, ?)",
+                                   (nombre, filename, embedding_to_blob(embedding), persona_id))
+                ids.append(cur.lastrowid)
+    finally:
+        conn.close()
+    EMBEDDING_CACHES["autorizados"].append_many(
+        [(aid, emb, None) for aid, (_, emb) in zip(ids, muestras) if emb is not None], len(ids))
+    return persona_id, ids
+
+def add_autorizado(nombre, filename, embedding=None, persona_id=None):
+    _, ids = add_persona_muestras(nombre, [(filename, embedding)], persona_id)
+    return ids[0] if ids else None
+
+def add_autorizados_bulk(items):
+    # items: [(nombre, filename, embedding)]. Todo en una sola transacción: si algo
+    # falla no queda ninguna fila a medias. Las fotos con el mismo nombre (también
+    # las ya registradas) se agrupan en la misma persona. Devuelve los ids en orden.
+    conn = get_connection()
+    ids = []
+    personas = {}
+    try:
+        with conn:
+            for nombre, filename, embedding in items:
+                if nombre not in personas:
+                    personas[nombre] = _persona_por_nombre(conn, nombre)
+                cur = conn.execute("INSERT INTO autorizados (nombre, filename, embedding, persona_id) VALUES (?, ?, ?, ?)",
+                                   (nombre, filename, embedding_to_blob(embedding), personas[nombre]))
+                ids.append(cur.lastrowid)
+    finally:
+        conn.close()
+    EMBEDDING_CACHES["autorizados"].append_many(
+        [(aid, emb, None) for aid, (_, _, emb) in zip(ids, items) if emb is not None], len(ids))
+    return ids
+
+# columnas que muestran los listados: nunca se leen los embeddings
+AUTORIZADO_COLS = "id, nombre, filename"
+INTRUSO_COLS = "id, filename, fecha_hora, thumb, rostro"
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+
+def _page_limit(limit):
+    return max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
 
 def list_autorizados():
     conn = get_connection()
-    rows = conn.execute("SELECT * FROM autorizados ORDER BY id DESC").fetchall()
+    rows = conn.execute(f"SELECT {AUTORIZADO_COLS} FROM autorizados ORDER BY id DESC").fetchall()
+    conn.close()
+    return rows
+
+def recent_autorizados(n=6):
+    conn = get_connection()
+    rows = conn.execute(f"SELECT {AUTORIZADO_COLS} FROM autorizados ORDER BY id DESC LIMIT ?", (n,)).fetchall()
     conn.close()
     return rows
 
+def page_autorizados(limit=PAGE_SIZE, after=None, prefijo=None):
+    # Paginación por cursor (keyset) en orden alfabético: after = (nombre, id) de la
+    # última fila mostrada. Devuelve (filas, cursor siguiente o None).
+    limit = _page_limit(limit)
+    where, params = [], []
+    if prefijo:
+        where.append("nombre >= ? AND nombre < ?")
+        params += [prefijo, prefijo + "\uffff"]
+    if after:
+        where.append("(nombre, id) > (?, ?)")
+        params += list(after)
+    sql = f"SELECT {AUTORIZADO_COLS} FROM autorizados"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY nombre, id LIMIT ?"
+    conn = get_connection()
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    conn.close()
+    nxt = (rows[limit - 1]["nombre"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return rows[:limit], nxt
+
 def get_autorizado(aid):
     conn = get_connection()
     row = conn.execute("SELECT * FROM autorizados WHERE id = ?", (aid,)).fetchone()
@@ -126,62 +411,619 @@ def get_autorizado(aid):
     return row
 
 def delete_autorizado(aid):
+    # devuelve la persona afectada (su plantilla hay que recalcularla)
     conn = get_connection()
-    row = conn.execute("SELECT filename FROM autorizados WHERE id = ?", (aid,)).fetchone()
-    if row:
-        filename = row["filename"]
-        path = os.path.join("data", "autorizados", filename)
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-        except:
-            pass
-    conn = get_connection()
+    row = conn.execute("SELECT filename, persona_id FROM autorizados WHERE id = ?", (aid,)).fetchone()
     conn.execute("DELETE FROM autorizados WHERE id = ?", (aid,))
+    if row and row["persona_id"] is not None:
+        # persona sin muestras: se elimina también
+        conn.execute("DELETE FROM personas WHERE id = ? AND NOT EXISTS "
+                     "(SELECT 1 FROM autorizados WHERE persona_id = ?)", (row["persona_id"], row["persona_id"]))
     conn.commit()
     conn.close()
+    if row:
+        file_remover.remove([os.path.join("data", "autorizados", row["filename"])])
+        return row["persona_id"]
+    return None
+
+def get_persona(pid):
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM personas WHERE id = ?", (pid,)).fetchone()
+    conn.close()
+    return row
 
-def update_autorizado_embedding(aid, embedding_hex):
+def list_personas():
     conn = get_connection()
-    conn.execute("UPDATE autorizados SET embedding_hex = ? WHERE id = ?", (embedding_hex, aid))
+    rows = conn.execute("SELECT p.id, p.nombre, COUNT(a.id) AS muestras FROM personas p "
+                        "LEFT JOIN autorizados a ON a.persona_id = p.id GROUP BY p.id ORDER BY p.nombre").fetchall()
+    conn.close()
+    return rows
+
+def personas_embeddings(pids):
+    # {persona_id: (nombre, matriz de muestras)} solo para las personas pedidas;
+    # las que ya no existen o no tienen embeddings quedan fuera
+    conn = get_connection()
+    pids = list(pids)
+    grupos = {}
+    for i in range(0, len(pids), 500):
+        chunk = pids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        for pid, nombre, blob in conn.execute(
+                f"SELECT a.persona_id, p.nombre, a.embedding FROM autorizados a JOIN personas p ON p.id = a.persona_id "
+                f"WHERE a.persona_id IN ({marks}) AND a.embedding IS NOT NULL", chunk):
+            grupos.setdefault(pid, (nombre, []))[1].append(blob_to_embedding(blob))
+    conn.close()
+    return {pid: (nombre, np.vstack(embs)) for pid, (nombre, embs) in grupos.items()}
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def update_autorizado_embedding(aid, embedding):
+    conn = get_connection()
+    conn.execute("UPDATE autorizados SET embedding = ? WHERE id = ?", (embedding_to_blob(embedding), aid))
     conn.commit()
     conn.close()
 
+def list_autorizados_sin_embedding():
+    conn = get_connection()
+    rows = conn.execute("SELECT id, nombre, filename, persona_id FROM autorizados WHERE embedding IS NULL").fetchall()
+    conn.close()
+    return rows
+
+def autorizados_personas():
+    # {id de autorizado: (persona_id, nombre de la persona)} de las filas con embedding
+    conn = get_connection()
+    rows = conn.execute("SELECT a.id, a.persona_id, p.nombre FROM autorizados a JOIN personas p ON p.id = a.persona_id "
+                        "WHERE a.embedding IS NOT NULL").fetchall()
+    conn.close()
+    return {r[0]: (r[1], r[2]) for r in rows}
+
 # ---- Intrusos ----
-def add_intruso(filename, fecha_hora, embedding_hex=None):
+def add_intruso(filename, fecha_hora, embedding=None, ts=None):
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("INSERT INTO intrusos (filename, fecha_hora, embedding_hex) VALUES (?, ?, ?)",
-                (filename, fecha_hora, embedding_hex))
+    cur.execute("INSERT INTO intrusos (filename, fecha_hora, embedding) VALUES (?, ?, ?)",
+                (filename, fecha_hora, embedding_to_blob(embedding)))
     conn.commit()
     lastid = cur.lastrowid
     conn.close()
+    EMBEDDING_CACHES["intrusos"].append_many([(lastid, embedding, ts)] if embedding is not None else [], 1)
     return lastid
 
 def list_intrusos():
     conn = get_connection()
-    rows = conn.execute("SELECT * FROM intrusos ORDER BY id DESC").fetchall()
+    rows = conn.execute(f"SELECT {INTRUSO_COLS} FROM intrusos ORDER BY id DESC").fetchall()
     conn.close()
     return rows
 
+def page_intrusos(limit=PAGE_SIZE, before=None, desde=None, hasta=None):
+    # Más recientes primero; before = (fecha_hora, id) de la última fila mostrada.
+    # desde/hasta: fechas 'YYYY-MM-DD' inclusivas.
+    limit = _page_limit(limit)
+    where, params = [], []
+    if desde:
+        where.append("fecha_hora >= ?")
+        params.append(f"{desde} 00:00:00")
+    if hasta:
+        where.append("fecha_hora <= ?")
+        params.append(f"{hasta} 23:59:59")
+    if before:
+        where.append("(fecha_hora, id) < (?, ?)")
+        params += list(before)
+    sql = f"SELECT {INTRUSO_COLS} FROM intrusos"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY fecha_hora DESC, id DESC LIMIT ?"
+    conn = get_connection()
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    conn.close()
+    nxt = (rows[limit - 1]["fecha_hora"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return rows[:limit], nxt
+
 def get_last_intruso():
     conn = get_connection()
-    row = conn.execute("SELECT * FROM intrusos ORDER BY id DESC LIMIT 1").fetchone()
+    row = conn.execute(f"SELECT {INTRUSO_COLS} FROM intrusos ORDER BY id DESC LIMIT 1").fetchone()
     conn.close()
     return row
 
 def delete_intruso(iid):
+    delete_intrusos([iid])
+
+def delete_intrusos(ids, remove_files=True):
+    # borrado en bloque en una sola transacción; los archivos los borra file_remover
+    # en segundo plano. Devuelve las filas borradas (id, fecha_hora, archivos).
+    ids = list(ids)
     conn = get_connection()
-    row = conn.execute("SELECT filename FROM intrusos WHERE id = ?", (iid,)).fetchone()
-    if row:
-        filename = row["filename"]
-        path = os.path.join("data", "intrusos", filename)
+    rows = []
+    with conn:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows.extend(conn.execute(f"SELECT id, fecha_hora, filename, thumb, rostro FROM intrusos WHERE id IN ({marks})",
+                                     chunk).fetchall())
+            conn.execute(f"DELETE FROM intrusos WHERE id IN ({marks})", chunk)
+    conn.close()
+    if rows:
+        # la copia .npy se compacta en lugar de reconstruirse en el próximo arranque
+        EMBEDDING_CACHES["intrusos"].remove_many([r["id"] for r in rows], len(rows))
+    if remove_files:
+        file_remover.remove(os.path.join("data", "intrusos", name)
+                            for r in rows for name in (r["filename"], r["thumb"], r["rostro"]) if name)
+    return rows
+
+class FileRemover:
+    # Hilo que borra archivos por lotes: ni la web ni la retención esperan al disco
+    def __init__(self, batch=200, pause=0.05):
+        self.batch = batch
+        self.pause = pause
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.removed = 0
+
+    def remove(self, paths):
+        paths = list(paths)
+        if not paths:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="file-remover")
+                self._thread.start()
+        for i in range(0, len(paths), self.batch):
+            self._queue.put(paths[i:i + self.batch])
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _run(self):
+        while True:
+            paths = self._queue.get()
+            try:
+                for path in paths:
+                    _remove_file(path)
+                self.removed += len(paths)
+            finally:
+                self._queue.task_done()
+            time.sleep(self.pause)
+
+file_remover = FileRemover()
+atexit.register(file_remover.flush, 5.0)
+
+# ---- Retención ----
+def uso_intrusos():
+    # (filas, bytes conocidos, filas sin tamaño)
+    conn = get_connection()
+    row = conn.execute("SELECT COUNT(*), COALESCE(SUM(tamano), 0), SUM(tamano IS NULL) FROM intrusos").fetchone()
+    conn.close()
+    return row[0], row[1], row[2] or 0
+
+def intrusos_mas_antiguos(limit=1000, after=None, antes_de=None):
+    # orden cronológico; after = (fecha_hora, id) de la última fila vista
+    sql = "SELECT id, fecha_hora, filename, thumb, rostro, tamano FROM intrusos"
+    where, params = [], []
+    if after:
+        where.append("(fecha_hora, id) > (?, ?)")
+        params += list(after)
+    if antes_de:
+        where.append("fecha_hora < ?")
+        params.append(antes_de)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    conn = get_connection()
+    rows = conn.execute(sql + " ORDER BY fecha_hora, id LIMIT ?", params + [limit]).fetchall()
+    conn.close()
+    return rows
+
+def intrusos_sin_tamano(limit=500):
+    conn = get_connection()
+    rows = conn.execute("SELECT id, filename, thumb, rostro FROM intrusos WHERE tamano IS NULL LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    return rows
+
+def update_tamanos(pairs):
+    conn = get_connection()
+    with conn:
+        conn.executemany("UPDATE intrusos SET tamano = ? WHERE id = ?", [(t, i) for i, t in pairs])
+    conn.close()
+
+def optimizar_bd(paginas=0, completo=False):
+    # ANALYZE vía PRAGMA optimize y devolución de páginas libres al disco. Con
+    # auto_vacuum=INCREMENTAL se liberan como mucho `paginas` por llamada (bloqueos
+    # cortos); el VACUUM completo (necesario una vez para activar ese modo) solo con
+    # completo=True, porque bloquea la BD mientras dura.
+    conn = get_connection()
+    try:
+        conn.execute("PRAGMA optimize")
+        if completo:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        elif paginas and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # cada fila del resultado es un paso: hay que consumirlas todas
+            conn.execute(f"PRAGMA incremental_vacuum({int(paginas)})").fetchall()
+        return {"paginas": conn.execute("PRAGMA page_count").fetchone()[0],
+                "libres": conn.execute("PRAGMA freelist_count").fetchone()[0],
+                "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0]}
+    finally:
+        conn.close()
+
+class IntrusoWriter:
+    # Cola de escritura diferida: el bucle de video encola y un hilo confirma en lotes
+    # (una transacción por lote) en vez de un connect+commit por intruso.
+    def __init__(self, batch=WRITE_BATCH, delay=WRITE_DELAY, maxsize=WRITE_QUEUE_MAX):
+        self.batch = batch
+        self.delay = delay
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        # ids insertados por este proceso: su caché ya los tiene, CacheSync los salta
+        self._propios = set()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="intrusos-writer")
+                self._thread.start()
+
+    def put(self, filename, fecha_hora, embedding=None, ts=None, callback=None, thumb=None, rostro=None, tamano=None,
+            on_error=None):
+        self._ensure_started()
         try:
-            if os.path.exists(path):
-                os.remove(path)
-        except:
-            pass
+            self._queue.put_nowait((filename, fecha_hora, embedding, ts, callback, thumb, rostro, tamano, on_error))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout=None):
+        # espera a que todo lo encolado esté confirmado
+        if self._thread is not None and self._thread.is_alive():
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._queue.unfinished_tasks:
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+                time.sleep(0.01)
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.delay
+            while len(items) < self.batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            except Exception as e:
+                print(f"[database] Error guardando lote de intrusos: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _write(self, items):
+        t0 = time.perf_counter()
+        conn = get_connection()
+        ids = []
+        try:
+            with conn:
+                for filename, fecha_hora, embedding, ts, _, thumb, rostro, tamano, _ in items:
+                    cur = conn.execute("INSERT INTO intrusos (filename, fecha_hora, embedding, thumb, rostro, tamano) "
+                                       "VALUES (?, ?, ?, ?, ?, ?)",
+                                       (filename, fecha_hora, embedding_to_blob(embedding), thumb, rostro, tamano))
+                    ids.append(cur.lastrowid)
+                with self._lock:
+                    self._propios.update(ids)
+        except Exception:
+            # el lote no se confirmó: ninguna de sus filas existe
+            for item in items:
+                if item[8] is not None:
+                    try:
+                        item[8]()
+                    except Exception:
+                        pass
+            raise
+        finally:
+            conn.close()
+        metricas.db_escritura_segundos.observe(time.perf_counter() - t0, operacion="lote_intrusos")
+        self.written += len(items)
+        self.batches += 1
+        EMBEDDING_CACHES["intrusos"].append_many(
+            [(iid, it[2], it[3]) for iid, it in zip(ids, items) if it[2] is not None], len(items))
+        for iid, item in zip(ids, items):
+            if item[4] is not None:
+                try:
+                    item[4](iid)
+                except Exception:
+                    pass
+
+    def es_propio(self, iid):
+        with self._lock:
+            if iid in self._propios:
+                self._propios.discard(iid)
+                return True
+            return False
+
+intruso_writer = IntrusoWriter()
+atexit.register(intruso_writer.flush, 5.0)
+
+def queue_intruso(filename, fecha_hora, embedding=None, ts=None, callback=None, thumb=None, rostro=None, tamano=None,
+                  on_error=None):
+    # no bloquea; callback(id) se llama tras confirmar el lote y on_error() si el lote falla.
+    # Devuelve False (sin llamar a on_error) si la cola está llena.
+    return intruso_writer.put(filename, fecha_hora, embedding, ts, callback, thumb, rostro, tamano, on_error)
+
+def intrusos_por_id(ids):
+    # (id, timestamp, embedding) de las filas indicadas que tengan embedding
+    conn = get_connection()
+    rows = []
+    ids = list(ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        rows.extend(conn.execute(f"SELECT id, CAST(strftime('%s', fecha_hora, 'utc') AS REAL), embedding FROM intrusos "
+                                 f"WHERE id IN ({marks}) AND embedding IS NOT NULL", chunk).fetchall())
+    conn.close()
+    return rows
+
+# ---- Registro de cambios ----
+def ultimo_cambio():
+    conn = get_connection()
+    row = conn.execute("SELECT MAX(id) FROM cambios").fetchone()
+    conn.close()
+    return row[0] or 0
+
+def cambios_desde(last_id, limit=1000):
+    conn = get_connection()
+    rows = conn.execute("SELECT id, tabla, operacion, fila, persona_id FROM cambios WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, limit)).fetchall()
+    conn.close()
+    return rows
+
+def podar_cambios(keep=CAMBIOS_MAX):
+    conn = get_connection()
+    conn.execute("DELETE FROM cambios WHERE id <= (SELECT MAX(id) FROM cambios) - ?", (keep,))
+    conn.commit()
+    conn.close()
+
+class DataVersion:
+    # PRAGMA data_version cambia cuando otra conexión (de este u otro proceso) confirma
+    # algo; consultarlo no lee ninguna tabla, así que sirve para sondear barato.
+    def __init__(self):
+        self._conn = None
+        self._db_file = None
+        self._version = None
+
+    def changed(self):
+        if self._db_file != DB_FILE:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = _connect()
+            self._db_file = DB_FILE
+            self._version = None
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self._version
+        self._version = version
+        return changed
+
+# ---- Cámaras ----
+def add_camara(nombre, url, activa=1):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO camaras (nombre, url, activa) VALUES (?, ?, ?)",
+                (nombre, url, activa))
+    conn.commit()
+    lastid = cur.lastrowid
+    conn.close()
+    return lastid
+
+def list_camaras(solo_activas=False):
+    conn = get_connection()
+    if solo_activas:
+        rows = conn.execute("SELECT * FROM camaras WHERE activa = 1 ORDER BY id").fetchall()
+    else:
+        rows = conn.execute("SELECT * FROM camaras ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+def get_camara(cid):
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM camaras WHERE id = ?", (cid,)).fetchone()
+    conn.close()
+    return row
+
+def update_camara(cid, nombre, url, activa):
     conn = get_connection()
-    conn.execute("DELETE FROM intrusos WHERE id = ?", (iid,))
+    conn.execute("UPDATE camaras SET nombre = ?, url = ?, activa = ? WHERE id = ?",
+                 (nombre, url, activa, cid))
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+def update_camara_detector(cid, detector, objetivo_ms):
+    conn = get_connection()
+    conn.execute("UPDATE camaras SET detector = ?, objetivo_ms = ? WHERE id = ?",
+                 (detector, objetivo_ms, cid))
+    conn.commit()
+    conn.close()
+
+def delete_camara(cid):
+    conn = get_connection()
+    conn.execute("DELETE FROM camaras WHERE id = ?", (cid,))
+    conn.commit()
+    conn.close()
+
+# ---- Copia .npy de embeddings ----
+def get_embedding_generation(tabla):
+    conn = get_connection()
+    row = conn.execute("SELECT generation FROM embedding_gen WHERE tabla = ?", (tabla,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+class EmbeddingCache:
+    # Matriz float32 (capacidad x 128) en un .npy mapeado en memoria, con ids y
+    # timestamps en paralelo. Si la generación guardada coincide con la de la BD
+    # se carga sin recorrer filas; si no, se reconstruye desde la tabla.
+    def __init__(self, tabla, directory=None):
+        self.tabla = tabla
+        self.directory = directory or CACHE_DIR
+        # escritor de intrusos y retención modifican la copia desde hilos distintos
+        self._lock = threading.Lock()
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, f"{self.tabla}{suffix}")
+
+    def _read_meta(self):
+        try:
+            with open(self._path(".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta):
+        tmp = self._path(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(".json"))
+
+    def load(self):
+        # devuelve (ids int64, matriz float32 N x 128, timestamps float64), mapeados desde disco
+        meta = self._read_meta()
+        if meta is None or meta.get("generation") != get_embedding_generation(self.tabla):
+            return self.rebuild()
+        n = meta["count"]
+        try:
+            ids = np.load(self._path("_ids.npy"), mmap_mode="r")[:n]
+            matrix = np.load(self._path(".npy"), mmap_mode="r")[:n]
+            ts = np.load(self._path("_ts.npy"), mmap_mode="r")[:n]
+        except (OSError, ValueError):
+            return self.rebuild()
+        return ids, matrix, ts
+
+    def rebuild(self):
+        with self._lock:
+            return self._rebuild()
+
+    def _rebuild(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.tabla == "intrusos":
+            ts_sql = "CAST(strftime('%s', fecha_hora, 'utc') AS REAL)"
+        else:
+            ts_sql = "0.0"
+        conn = get_connection()
+        try:
+            # generación y filas de la misma instantánea: un INSERT entre las dos lecturas
+            # quedaría en la copia y append_many lo volvería a añadir
+            conn.execute("BEGIN")
+            generation = conn.execute("SELECT generation FROM embedding_gen WHERE tabla = ?", (self.tabla,)).fetchone()
+            rows = conn.execute(f"SELECT id, {ts_sql}, embedding FROM {self.tabla} "
+                                f"WHERE embedding IS NOT NULL ORDER BY id").fetchall()
+            conn.commit()
+        finally:
+            conn.close()
+        n = len(rows)
+        capacity = max(1024, 2 * n)
+        matrix = open_memmap(self._path(".npy"), mode="w+", dtype=np.float32, shape=(capacity, EMBEDDING_DIM))
+        ids = open_memmap(self._path("_ids.npy"), mode="w+", dtype=np.int64, shape=(capacity,))
+        ts = open_memmap(self._path("_ts.npy"), mode="w+", dtype=np.float64, shape=(capacity,))
+        if n:
+            matrix[:n] = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32).reshape(n, EMBEDDING_DIM)
+            ids[:n] = [r[0] for r in rows]
+            ts[:n] = [r[1] or 0.0 for r in rows]
+        for arr in (matrix, ids, ts):
+            arr.flush()
+        self._write_meta({"generation": generation[0] if generation else 0, "count": n, "capacity": capacity})
+        return ids[:n], matrix[:n], ts[:n]
+
+    def append(self, row_id, embedding, ts=None):
+        return self.append_many([(row_id, embedding, ts)])
+
+    def append_many(self, items, inserted=None):
+        # Cada INSERT sube la generación en 1 vía trigger: si la copia estaba al día
+        # antes de estos `inserted` inserts se añaden las filas en su sitio; si no, se
+        # deja para reconstruir en la próxima carga.
+        inserted = len(items) if inserted is None else inserted
+        with self._lock:
+            return self._append_many(items, inserted)
+
+    def _append_many(self, items, inserted):
+        meta = self._read_meta()
+        if meta is None:
+            return False
+        generation = get_embedding_generation(self.tabla)
+        n = meta["count"]
+        if meta["generation"] != generation - inserted or n + len(items) > meta["capacity"]:
+            return False
+        try:
+            matrix = np.load(self._path(".npy"), mmap_mode="r+")
+            ids = np.load(self._path("_ids.npy"), mmap_mode="r+")
+            tss = np.load(self._path("_ts.npy"), mmap_mode="r+")
+        except (OSError, ValueError):
+            return False
+        for i, (row_id, embedding, ts) in enumerate(items):
+            matrix[n + i] = np.asarray(embedding, dtype=np.float32).reshape(EMBEDDING_DIM)
+            ids[n + i] = row_id
+            tss[n + i] = ts or 0.0
+        for arr in (matrix, ids, tss):
+            arr.flush()
+        self._write_meta({"generation": generation, "count": n + len(items), "capacity": meta["capacity"]})
+        return True
+
+    def remove_many(self, row_ids, deleted):
+        # Borrado en bloque (retención, borrado manual): cada DELETE sube la generación en
+        # 1. Si la copia estaba al día antes de esos `deleted` borrados se compacta en su
+        # sitio: las filas vivas del final ocupan los huecos (el orden no importa, las
+        # cachés se ordenan al cargar) y solo se escriben tantas filas como se borran.
+        with self._lock:
+            meta = self._read_meta()
+            if meta is None:
+                return False
+            generation = get_embedding_generation(self.tabla)
+            if meta["generation"] != generation - deleted:
+                return False
+            n = meta["count"]
+            try:
+                matrix = np.load(self._path(".npy"), mmap_mode="r+")
+                ids = np.load(self._path("_ids.npy"), mmap_mode="r+")
+                tss = np.load(self._path("_ts.npy"), mmap_mode="r+")
+            except (OSError, ValueError):
+                return False
+            pos = np.flatnonzero(np.isin(ids[:n], np.fromiter(row_ids, dtype=np.int64)))
+            new_n = n - len(pos)
+            holes = pos[pos < new_n]
+            tail = np.setdiff1d(np.arange(new_n, n), pos, assume_unique=True)
+            if len(holes):
+                matrix[holes] = matrix[tail]
+                ids[holes] = ids[tail]
+                tss[holes] = tss[tail]
+                for arr in (matrix, ids, tss):
+                    arr.flush()
+            self._write_meta({"generation": generation, "count": new_n, "capacity": meta["capacity"]})
+            return True
+
+EMBEDDING_CACHES = {
+    "autorizados": EmbeddingCache("autorizados"),
+    "intrusos": EmbeddingCache("intrusos"),
+}
+
+def load_embeddings(tabla):
+    return EMBEDDING_CACHES[tabla].load()
\ No newline at end of file
@@ -0,0 +1,392 @@
+# fuentes.py
+# Fuentes de video para los CameraWorker. Además del stream de la ESP32 (o cualquier
+# URL de red) se puede reproducir material grabado:
+#   - un archivo de video:       grabacion.mp4?fps=10&loop=1
+#   - una carpeta de JPEGs:      capturas/?fps=5
+# Las URL http(s) se leen con MjpegClient (multipart propio, reconexión con backoff);
+# el resto de URL de red pasa a cv2.VideoCapture. Una grabación se puede servir
+# como si fuera una ESP32-CAM, para probar sin hardware:
+#   python fuentes.py grabacion.mp4 --port 8081 --loop
+#   ESP32_STREAM_URL=http://127.0.0.1:8081/stream python app.py
+import os
+import re
+import time
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+# mismo boundary que el firmware CameraWebServer de la ESP32-CAM
+MJPEG_BOUNDARY = "123456789000000000000987654321"
+MJPEG_TIMEOUT = float(os.environ.get("MJPEG_TIMEOUT", "5"))
+# 1, 2, 4 u 8: decodificar a 1/n de resolución (IMREAD_REDUCED_COLOR_n) ahorra CPU
+# en cámaras de alta resolución; afecta a todo el pipeline, también a las capturas
+MJPEG_DECODE_REDUCE = int(os.environ.get("MJPEG_DECODE_REDUCE", "1"))
+MJPEG_MAX_PART = 8 * 1024 * 1024
+
+_REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                  4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def decode_jpeg(data, reduce=1):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), _REDUCED_FLAGS.get(reduce, cv2.IMREAD_COLOR))
+
+class _Pacer:
+    # Respeta los fps de la grabación (realtime) para que la reproducción se
+    # comporte como una cámara; sin fps se entrega tan rápido como se lea.
+    def __init__(self, fps):
+        self.period = 1.0 / fps if fps else 0.0
+        self._next = None
+
+    def wait(self):
+        if not self.period:
+            return
+        now = time.monotonic()
+        if self._next is None:
+            self._next = now
+        elif self._next > now:
+            time.sleep(self._next - now)
+        self._next = max(self._next + self.period, time.monotonic() - self.period)
+
+class VideoFileSource:
+    # Interfaz de cv2.VideoCapture (isOpened/read/release) sobre un archivo de video
+    def __init__(self, path, fps=None, loop=False, realtime=True):
+        self.path = path
+        self.loop = loop
+        self._cap = cv2.VideoCapture(path)
+        native = self._cap.get(cv2.CAP_PROP_FPS) if self._cap.isOpened() else 0
+        self.fps = fps or (native if native and native < 240 else 25.0)
+        self._pacer = _Pacer(self.fps if realtime else None)
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def read(self):
+        self._pacer.wait()
+        ret, frame = self._cap.read()
+        if not ret and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        return ret, frame
+
+    def release(self):
+        self._cap.release()
+
+class ImageDirSource:
+    # Carpeta de imágenes en orden alfabético (p. ej. capturas exportadas de la ESP32)
+    def __init__(self, path, fps=5.0, loop=False, realtime=True):
+        self.path = path
+        self.loop = loop
+        self.fps = fps or 5.0
+        self.files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS))
+        self._pos = 0
+        self._pacer = _Pacer(self.fps if realtime else None)
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def read_bytes(self):
+        if self._pos >= len(self.files):
+            if not self.loop or not self.files:
+                return None
+            self._pos = 0
+        self._pacer.wait()
+        path = self.files[self._pos]
+        self._pos += 1
+        with open(path, "rb") as f:
+            return f.read()
+
+    def read(self):
+        data = self.read_bytes()
+        if data is None:
+            return False, None
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        return frame is not None, frame
+
+    def release(self):
+        self.files = []
+
+class MjpegClient:
+    # Cliente MJPEG-over-HTTP para la ESP32-CAM. read_jpeg() devuelve los bytes de cada
+    # parte sin decodificar (solo se decodifican los frames que se llegan a procesar).
+    # Si la cámara se cae, reconecta con backoff exponencial en lugar de terminar;
+    # `health` resume el estado de la conexión para /api/pipeline: `reconexiones` cuenta
+    # las que llegaron a conectar y `fallos` los intentos seguidos sin conseguirlo.
+    def __init__(self, url, timeout=MJPEG_TIMEOUT, reduce=MJPEG_DECODE_REDUCE, stop_event=None,
+                 backoff_min=0.5, backoff_max=10.0):
+        self.url = url
+        self.timeout = timeout
+        self.reduce = reduce
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self._stop_event = stop_event or threading.Event()
+        self._conn = None
+        self._resp = None
+        self._boundary = None
+        self._at_part = False
+        self.health = {"estado": "desconectado", "reconexiones": 0, "fallos": 0, "ultimo_error": None,
+                       "frames": 0, "bytes": 0, "ultimo_frame": None, "conectado_desde": None}
+
+    def isOpened(self):
+        return not self._stop_event.is_set()
+
+    def _connect(self):
+        parts = urlsplit(self.url)
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        conn = cls(parts.hostname, parts.port, timeout=self.timeout)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        try:
+            conn.request("GET", path, headers={"Accept": "multipart/x-mixed-replace"})
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise IOError(f"HTTP {resp.status}")
+            match = re.search(r'boundary="?([^";]+)"?', resp.getheader("Content-Type", ""))
+            if not match:
+                raise IOError("la respuesta no es multipart")
+        except Exception:
+            conn.close()
+            raise
+        # algunos servidores incluyen los "--" en el header y otros no
+        self._boundary = match.group(1).strip().lstrip("-").encode()
+        self._conn, self._resp = conn, resp
+        self._at_part = False
+        if self.health["conectado_desde"] is not None:
+            self.health["reconexiones"] += 1
+        if self.health["fallos"]:
+            print(f"[fuentes] Stream {self.url} recuperado tras {self.health['fallos']} intentos")
+        self.health.update(estado="conectado", conectado_desde=time.time(), ultimo_error=None, fallos=0)
+
+    def _disconnect(self, error=None):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+        self._conn = self._resp = None
+        if error is not None:
+            self.health.update(estado="reconectando", ultimo_error=str(error) or type(error).__name__)
+
+    def _is_boundary(self, line):
+        line = line.strip()
+        return bool(line) and line.lstrip(b"-").rstrip(b"-") == self._boundary
+
+    def _next_part(self):
+        fp = self._resp
+        if not self._at_part:
+            while True:
+                line = fp.readline(4096)
+                if not line:
+                    raise IOError("fin del stream")
+                if self._is_boundary(line):
+                    break
+        self._at_part = False
+        headers = {}
+        while True:
+            line = fp.readline(4096)
+            if not line:
+                raise IOError("fin del stream")
+            line = line.strip()
+            if not line:
+                break
+            key, _, value = line.partition(b":")
+            headers[key.strip().lower()] = value.strip()
+        length = headers.get(b"content-length")
+        if length is not None:
+            length = int(length)
+            if length > MJPEG_MAX_PART:
+                raise IOError(f"parte demasiado grande ({length} bytes)")
+            data = fp.read(length)
+            if len(data) < length:
+                raise IOError("parte incompleta")
+            return data
+        # sin Content-Length: se acumula hasta el siguiente boundary
+        chunks, size = [], 0
+        while True:
+            line = fp.readline(65536)
+            if not line:
+                raise IOError("fin del stream")
+            if self._is_boundary(line):
+                self._at_part = True
+                break
+            chunks.append(line)
+            size += len(line)
+            if size > MJPEG_MAX_PART:
+                raise IOError("parte demasiado grande")
+        data = b"".join(chunks)
+        return data[:-2] if data.endswith(b"\r\n") else data
+
+    def read_jpeg(self):
+        # bloquea hasta tener un frame; solo devuelve None al detener la cámara
+        delay = self.backoff_min
+        while not self._stop_event.is_set():
+            try:
+                if self._resp is None:
+                    self._connect()
+                data = self._next_part()
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                self._disconnect(e)
+                self.health["fallos"] += 1
+                # solo el primer fallo de cada caída; con la cámara apagada no se llena el log
+                if self.health["fallos"] == 1:
+                    print(f"[fuentes] Stream {self.url} caído ({e}); reintentando con backoff")
+                # jitter para que varias cámaras no reconecten a la vez
+                if self._stop_event.wait(delay * random.uniform(0.8, 1.2)):
+                    break
+                delay = min(delay * 2, self.backoff_max)
+                continue
+            if not data:
+                continue
+            self.health["frames"] += 1
+            self.health["bytes"] += len(data)
+            self.health["ultimo_frame"] = time.time()
+            return data
+        return None
+
+    def read(self):
+        data = self.read_jpeg()
+        if data is None:
+            return False, None
+        frame = decode_jpeg(data, self.reduce)
+        return frame is not None, frame
+
+    def release(self):
+        self._stop_event.set()
+        self._disconnect()
+        self.health["estado"] = "desconectado"
+
+def open_source(url, realtime=True, stop_event=None):
+    # http(s) -> MjpegClient; otras URL de red -> cv2.VideoCapture;
+    # ruta local -> reproducción con opciones ?fps=&loop=
+    if url.startswith(("http://", "https://")):
+        return MjpegClient(url, stop_event=stop_event)
+    if "://" in url:
+        return cv2.VideoCapture(url)
+    path, opts = url, {}
+    if "?" in url:
+        parts = urlsplit(url)
+        path = parts.path
+        opts = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+    fps = float(opts["fps"]) if "fps" in opts else None
+    loop = opts.get("loop", "0") in ("1", "true", "si")
+    if os.path.isdir(path):
+        return ImageDirSource(path, fps, loop, realtime)
+    return VideoFileSource(path, fps, loop, realtime)
+
+class MjpegServer:
+    # Servidor HTTP que emite una fuente como multipart/x-mixed-replace en /stream,
+    # igual que la ESP32-CAM. Un solo hilo lee la fuente; cada cliente recibe el
+    # último JPEG disponible.
+    def __init__(self, source, host="0.0.0.0", port=8081, quality=80):
+        self.source = source
+        self.quality = quality
+        self._cond = threading.Condition()
+        self._jpeg = None
+        self._seq = 0
+        self._stop_event = threading.Event()
+        self._producer = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/stream", "/"):
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/x-mixed-replace;boundary={MJPEG_BOUNDARY}")
+                self.end_headers()
+                seq = 0
+                try:
+                    while not server._stop_event.is_set():
+                        seq, jpeg = server.wait(seq)
+                        if jpeg is None:
+                            continue
+                        self.wfile.write(f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                         f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def wait(self, last_seq, timeout=1.0):
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != last_seq or self._stop_event.is_set(), timeout)
+            return self._seq, self._jpeg
+
+    def _produce(self):
+        # la fuente es de este hilo: solo él la lee y la libera al terminar, así stop()
+        # nunca la vacía mientras read_bytes/read la está usando
+        try:
+            while not self._stop_event.is_set():
+                if hasattr(self.source, "read_bytes"):
+                    # los JPEGs de una carpeta se envían tal cual, sin recodificar
+                    jpeg = self.source.read_bytes()
+                    if jpeg is None:
+                        break
+                else:
+                    ret, frame = self.source.read()
+                    if not ret:
+                        break
+                    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                    if not ok:
+                        continue
+                    jpeg = buf.tobytes()
+                with self._cond:
+                    self._seq += 1
+                    self._jpeg = jpeg
+                    self._cond.notify_all()
+        finally:
+            self.source.release()
+        print("[fuentes] Fin de la fuente.")
+
+    def start(self):
+        self._producer = threading.Thread(target=self._produce, daemon=True, name="mjpeg:fuente")
+        self._producer.start()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="mjpeg:http").start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._producer is not None:
+            # shutdown() espera a serve_forever: solo si se llegó a arrancar
+            self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._producer is not None:
+            # la fuente la libera el productor al salir del bucle
+            self._producer.join(timeout)
+        else:
+            self.source.release()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor MJPEG que simula una ESP32-CAM a partir de una grabación")
+    parser.add_argument("fuente", help="Archivo de video o carpeta de imágenes")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fps", type=float, default=None)
+    parser.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+    cls = ImageDirSource if os.path.isdir(args.fuente) else VideoFileSource
+    source = cls(args.fuente, args.fps, args.loop)
+    if not source.isOpened():
+        parser.error(f"no se pudo abrir {args.fuente}")
+    server = MjpegServer(source, port=args.port).start()
+    print(f"[fuentes] Sirviendo {args.fuente} en http://127.0.0.1:{server.port}/stream")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
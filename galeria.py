@@ -0,0 +1,453 @@
+# galeria.py
+import time
+import threading
+from collections import deque
+import numpy as np
+
+EMBEDDING_DIM = 128
+# prototipos por persona además del centroide
+TEMPLATE_PROTOTYPES = 3
+
+def person_template(embeddings, prototypes=TEMPLATE_PROTOTYPES, iters=5):
+    # Plantilla compacta de una persona: centroide de todas sus muestras más hasta
+    # `prototypes` centros k-means (capturan luz o pose distintas). Con pocas muestras
+    # se usan las muestras tal cual.
+    data = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    if len(data) <= 1:
+        return data.copy()
+    centroid = data.mean(axis=0, keepdims=True)
+    if len(data) <= prototypes:
+        return np.vstack([centroid, data])
+    # inicialización por punto más lejano y unas pocas iteraciones de Lloyd
+    chosen = [int(np.argmax(np.linalg.norm(data - centroid, axis=1)))]
+    dist = np.linalg.norm(data - data[chosen[0]], axis=1)
+    for _ in range(prototypes - 1):
+        chosen.append(int(np.argmax(dist)))
+        dist = np.minimum(dist, np.linalg.norm(data - data[chosen[-1]], axis=1))
+    centers = data[chosen].copy()
+    for _ in range(iters):
+        assign = np.argmin(((data[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1)
+        for k in range(len(centers)):
+            members = data[assign == k]
+            if len(members):
+                centers[k] = members.mean(axis=0)
+    return np.vstack([centroid, centers])
+
+class Match:
+    __slots__ = ("key", "name", "distance", "margin")
+
+    def __init__(self, key, name, distance, margin):
+        self.key = key
+        self.name = name
+        self.distance = distance
+        self.margin = margin
+
+    def __repr__(self):
+        return f"Match({self.name!r}, d={self.distance:.3f}, margen={self.margin:.3f})"
+
+class Gallery:
+    # Galería de autorizados en una única matriz float32 (N x 128) contigua con las
+    # normas al cuadrado precalculadas: d^2 = |q|^2 + |g|^2 - 2 q.g para todos los
+    # rostros de un frame en una sola multiplicación de matrices.
+    # Con set_person cada persona ocupa las filas de su plantilla, con claves
+    # (persona, 0..k-1), así N crece con las personas y no con las fotos.
+    # El margen se mide contra la mejor identidad distinta: la persona, o el nombre si
+    # las filas se cargan sin persona. El nombre solo se muestra.
+    def __init__(self, dim=EMBEDDING_DIM, capacity=64):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sqnorms = np.zeros(capacity, dtype=np.float32)
+        self._labels = np.zeros(capacity, dtype=np.int64)
+        self._clear()
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _label(self, identity, name):
+        # un label por identidad; los que se quedan sin filas se reutilizan
+        label = self._label_ids.get(identity)
+        if label is None:
+            if self._free_labels:
+                label = self._free_labels.pop()
+                self._identities[label] = identity
+            else:
+                label = len(self._identities)
+                self._identities.append(identity)
+                self._names.append(name)
+                self._label_rows.append(0)
+            self._label_ids[identity] = label
+        self._names[label] = name
+        self._label_rows[label] += 1
+        return label
+
+    def _unlabel(self, label):
+        self._label_rows[label] -= 1
+        if self._label_rows[label] == 0:
+            del self._label_ids[self._identities[label]]
+            self._identities[label] = self._names[label] = None
+            self._free_labels.append(label)
+
+    def _reserve(self, n):
+        cap = self._matrix.shape[0]
+        if n <= cap:
+            return
+        while cap < n:
+            cap *= 2
+        matrix = np.zeros((cap, self.dim), dtype=np.float32)
+        matrix[:self.n] = self._matrix[:self.n]
+        sqnorms = np.zeros(cap, dtype=np.float32)
+        sqnorms[:self.n] = self._sqnorms[:self.n]
+        labels = np.zeros(cap, dtype=np.int64)
+        labels[:self.n] = self._labels[:self.n]
+        self._matrix, self._sqnorms, self._labels = matrix, sqnorms, labels
+
+    def load(self, keys, names, matrix, persons=None):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._clear()
+            self._add_many(keys, names, matrix, persons)
+
+    def _clear(self):
+        self._keys = []
+        self._rows = {}
+        self._names = []
+        self._identities = []
+        self._label_ids = {}
+        self._label_rows = []
+        self._free_labels = []
+        self.n = 0
+
+    def add(self, key, name, embedding, person=None):
+        self.add_many([key], [name], np.asarray(embedding, dtype=np.float32).reshape(1, self.dim),
+                      None if person is None else [person])
+
+    def add_many(self, keys, names, matrix, persons=None):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._add_many(keys, names, matrix, persons)
+
+    def _add_many(self, keys, names, matrix, persons=None):
+        for key in keys:
+            if key in self._rows:
+                self._remove(key)
+        count = len(keys)
+        self._reserve(self.n + count)
+        start, end = self.n, self.n + count
+        self._matrix[start:end] = matrix
+        self._sqnorms[start:end] = np.einsum("ij,ij->i", matrix, matrix)
+        identities = names if persons is None else persons
+        self._labels[start:end] = [self._label(identity, name) for identity, name in zip(identities, names)]
+        for i, key in enumerate(keys):
+            self._rows[key] = start + i
+            self._keys.append(key)
+        self.n = end
+
+    def remove(self, key):
+        with self._lock:
+            return self._remove(key)
+
+    def set_person(self, person, name, template):
+        self.set_people([(person, name, template)])
+
+    def set_people(self, people, replace_all=False):
+        # people: [(persona, nombre, plantilla)]; reemplaza las filas de cada persona
+        # (o toda la galería con replace_all)
+        with self._lock:
+            if replace_all:
+                self._clear()
+            for person, name, template in people:
+                template = np.asarray(template, dtype=np.float32).reshape(-1, self.dim)
+                self._remove_person(person)
+                k = len(template)
+                self._add_many([(person, i) for i in range(k)], [name] * k, template, [person] * k)
+
+    def remove_person(self, person):
+        with self._lock:
+            return self._remove_person(person)
+
+    def _remove_person(self, person):
+        i = 0
+        while self._remove((person, i)):
+            i += 1
+        return i > 0
+
+    def _remove(self, key):
+        # borrado O(1): la última fila ocupa el hueco
+        row = self._rows.pop(key, None)
+        if row is None:
+            return False
+        self._unlabel(int(self._labels[row]))
+        last = self.n - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._sqnorms[row] = self._sqnorms[last]
+            self._labels[row] = self._labels[last]
+            moved = self._keys[last]
+            self._keys[row] = moved
+            self._rows[moved] = row
+        self._keys.pop()
+        self.n = last
+        return True
+
+    def match(self, embeddings, tolerance):
+        # Devuelve, por cada embedding, el Match más cercano dentro de la tolerancia
+        # (o None) con su margen respecto a la mejor identidad distinta.
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        results = [None] * len(queries)
+        if not len(queries):
+            return results
+        with self._lock:
+            n = self.n
+            if n == 0:
+                return results
+            matrix = self._matrix[:n]
+            d2 = self._sqnorms[:n][None, :] + np.einsum("ij,ij->i", queries, queries)[:, None]
+            d2 -= 2.0 * (queries @ matrix.T)
+            np.maximum(d2, 0.0, out=d2)
+            labels = self._labels[:n]
+            best = np.argmin(d2, axis=1)
+            rows = np.arange(len(queries))
+            best_d = np.sqrt(d2[rows, best])
+            same = labels[None, :] == labels[best][:, None]
+            d2[same] = np.inf
+            runner_d = np.sqrt(d2.min(axis=1))
+            keys = [self._keys[b] for b in best]
+            names = [self._names[labels[b]] for b in best]
+        for i in range(len(queries)):
+            if best_d[i] <= tolerance:
+                results[i] = Match(keys[i], names[i], float(best_d[i]), float(runner_d[i] - best_d[i]))
+        return results
+
+class IntrusoIndex:
+    # Índice aproximado (IVF) para la deduplicación de intrusos: centroides k-means en
+    # NumPy, listas invertidas y re-ranking exacto dentro de las `nprobe` listas más
+    # cercanas. Por debajo de `train_min` entradas se hace búsqueda exhaustiva.
+    # Con `retention_seconds` solo se conservan los intrusos de esa ventana de tiempo,
+    # así el coste por consulta no crece con el histórico.
+    def __init__(self, dim=EMBEDDING_DIM, retention_seconds=None, nprobe=4, train_min=2048, capacity=256):
+        self.dim = dim
+        self.retention_seconds = retention_seconds
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self._lock = threading.Lock()
+        # generación de cada alta: las filas libres se reutilizan y un token viejo no debe
+        # tocar a su nuevo ocupante
+        self._gen = 0
+        self._reset(capacity)
+
+    def _reset(self, capacity):
+        dim = self.dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sqnorms = np.zeros(capacity, dtype=np.float32)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._assign = np.full(capacity, -1, dtype=np.int64)
+        self._gens = np.zeros(capacity, dtype=np.int64)
+        self._keys = [None] * capacity
+        self._rows = {}
+        self._free = []
+        self._hwm = 0
+        self._order = deque()
+        self.n = 0
+        self._centroids = None
+        self._lists = []
+        self._list_cache = []
+        self._trained_at = 0
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._rows
+
+    def _reserve(self):
+        cap = self._matrix.shape[0]
+        if self._hwm < cap:
+            return
+        cap *= 2
+        for name in ("_matrix", "_sqnorms", "_times", "_alive", "_assign", "_gens"):
+            old = getattr(self, name)
+            fill = -1 if name == "_assign" else 0
+            new = np.full((cap,) + old.shape[1:], fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self._keys.extend([None] * (cap - len(self._keys)))
+
+    def load(self, keys, matrix, times):
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, self.dim)
+        times = np.asarray(times, dtype=np.float64)
+        n = len(matrix)
+        with self._lock:
+            self._reset(max(256, n))
+            self._matrix[:n] = matrix
+            self._sqnorms[:n] = np.einsum("ij,ij->i", matrix, matrix)
+            self._times[:n] = times
+            self._alive[:n] = True
+            self._keys[:n] = list(keys)
+            self._rows = {key: i for i, key in enumerate(keys) if key is not None}
+            order = np.argsort(times, kind="stable")
+            self._order = deque(zip(times[order].tolist(), order.tolist()))
+            self._hwm = self.n = n
+            self._expire(time.time())
+            self._maybe_train()
+
+    def add(self, embedding, ts=None, key=None):
+        # devuelve un token (fila, generación); `key` puede fijarse después con set_key()
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            row = self._add(np.asarray(embedding, dtype=np.float32).reshape(self.dim), ts, key)
+            self._expire(ts)
+            self._maybe_train()
+            return row, int(self._gens[row])
+
+    def _add(self, emb, ts, key):
+        if self._free:
+            row = self._free.pop()
+        else:
+            self._reserve()
+            row = self._hwm
+            self._hwm += 1
+        self._matrix[row] = emb
+        self._sqnorms[row] = float(emb @ emb)
+        self._times[row] = ts
+        self._alive[row] = True
+        self._gen += 1
+        self._gens[row] = self._gen
+        self._keys[row] = key
+        if key is not None:
+            self._rows[key] = row
+        self._order.append((ts, row))
+        self.n += 1
+        if self._centroids is not None:
+            self._assign_rows(np.array([row]))
+        return row
+
+    def _owns(self, token):
+        row, gen = token
+        return self._alive[row] and self._gens[row] == gen
+
+    def set_key(self, token, key):
+        # si la fila caducó o se borró (y quizá ya es de otro intruso) no se toca
+        with self._lock:
+            if self._owns(token):
+                row = token[0]
+                self._keys[row] = key
+                self._rows[key] = row
+
+    def remove(self, key):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return False
+            self._drop(row)
+            return True
+
+    def remove_row(self, token):
+        with self._lock:
+            if self._owns(token):
+                self._drop(token[0])
+
+    def _drop(self, row):
+        key = self._keys[row]
+        if key is not None and self._rows.get(key) == row:
+            del self._rows[key]
+        self._keys[row] = None
+        self._alive[row] = False
+        lst = self._assign[row]
+        if lst >= 0:
+            self._lists[lst].discard(row)
+            self._list_cache[lst] = None
+            self._assign[row] = -1
+        self._free.append(row)
+        self.n -= 1
+
+    def _expire(self, now):
+        if not self.retention_seconds:
+            return
+        limit = now - self.retention_seconds
+        while self._order and self._order[0][0] < limit:
+            ts, row = self._order.popleft()
+            # la fila pudo borrarse y reutilizarse después
+            if self._alive[row] and self._times[row] == ts:
+                self._drop(row)
+
+    def _maybe_train(self):
+        if self.n < self.train_min:
+            if self._centroids is not None and self.n < self.train_min // 2:
+                self._centroids = None
+                self._assign[:] = -1
+            return
+        if self._centroids is None or self.n >= 2 * self._trained_at:
+            self._train()
+
+    def _train(self, iters=8, sample=20000):
+        rows = np.flatnonzero(self._alive[:self._hwm])
+        rng = np.random.default_rng(len(rows))
+        sample_rows = rows if len(rows) <= sample else rng.choice(rows, sample, replace=False)
+        data = self._matrix[sample_rows]
+        k = int(min(1024, len(data), max(8, np.sqrt(len(rows)))))
+        centroids = data[rng.choice(len(data), k, replace=False)].copy()
+        for _ in range(iters):
+            labels = _nearest_rows(data, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            counts = np.bincount(labels, minlength=k)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        self._centroids = centroids
+        self._lists = [set() for _ in range(k)]
+        self._list_cache = [None] * k
+        self._assign[:] = -1
+        self._assign_rows(rows)
+        self._trained_at = self.n
+
+    def _assign_rows(self, rows):
+        labels = _nearest_rows(self._matrix[rows], self._centroids)
+        self._assign[rows] = labels
+        for row, lst in zip(rows.tolist(), labels.tolist()):
+            self._lists[lst].add(row)
+            self._list_cache[lst] = None
+
+    def _list_rows(self, lst):
+        cached = self._list_cache[lst]
+        if cached is None:
+            cached = np.fromiter(self._lists[lst], dtype=np.int64, count=len(self._lists[lst]))
+            self._list_cache[lst] = cached
+        return cached
+
+    def nearest(self, embedding):
+        # (distancia, key) del intruso más cercano, o None si el índice está vacío
+        q = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            self._expire(time.time())
+            if self.n == 0:
+                return None
+            if self._centroids is None:
+                rows = np.flatnonzero(self._alive[:self._hwm])
+            else:
+                cd = ((self._centroids - q) ** 2).sum(axis=1)
+                probes = np.argpartition(cd, min(self.nprobe, len(cd) - 1))[:self.nprobe]
+                rows = np.concatenate([self._list_rows(p) for p in probes])
+                if not len(rows):
+                    return None
+            d2 = self._sqnorms[rows] + float(q @ q) - 2.0 * (self._matrix[rows] @ q)
+            i = int(np.argmin(d2))
+            row = int(rows[i])
+            return float(np.sqrt(max(d2[i], 0.0))), self._keys[row]
+
+    def contains_near(self, embedding, tolerance):
+        hit = self.nearest(embedding)
+        return hit is not None and hit[0] <= tolerance
+
+def _nearest_rows(data, centroids, chunk=8192):
+    out = np.empty(len(data), dtype=np.int64)
+    csq = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        out[start:start + chunk] = np.argmin(csq[None, :] - 2.0 * (block @ centroids.T), axis=1)
+    return out
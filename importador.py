@@ -0,0 +1,265 @@
+# importador.py
+# Alta masiva de autorizados desde una carpeta o un ZIP de fotos. Uso:
+#   python importador.py fotos/ [--csv nombres.csv] [--workers 4] [--reporte reporte.csv]
+#   python importador.py personal.zip --dry-run
+# El nombre de cada persona sale del CSV (columnas archivo,nombre; archivo es la ruta
+# dentro de la carpeta o del ZIP) o, si no hay CSV, del nombre del archivo:
+# "juan_perez_2.jpg" -> "juan perez".
+import os
+import re
+import io
+import csv
+import time
+import uuid
+import zipfile
+import posixpath
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import cv2
+import numpy as np
+from werkzeug.utils import secure_filename
+
+import database
+
+DATA_AUT = os.path.join("data", "autorizados")
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", str(os.cpu_count() or 2)))
+# spawn: el pool se puede crear en cualquier momento, también desde un servidor con hilos
+IMPORT_MP_CONTEXT = os.environ.get("IMPORT_MP_CONTEXT", "spawn")
+# lado máximo antes de detectar; las fotos de carnet a 4000px no aportan precisión
+IMPORT_MAX_SIDE = 1600
+# importaciones web terminadas que se conservan para consultar su reporte
+IMPORT_JOB_TTL = float(os.environ.get("IMPORT_JOB_TTL", "3600"))
+IMPORT_JOBS_MAX = int(os.environ.get("IMPORT_JOBS_MAX", "20"))
+
+def nombre_desde_archivo(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stem = re.sub(r"[_\-\s]*\d+$", "", stem)
+    return re.sub(r"[_\-]+", " ", stem).strip()
+
+def _clave_archivo(path):
+    # ruta relativa con "/" también en Windows, sin "./" ni barra inicial
+    return posixpath.normpath(path.replace("\\", "/")).lstrip("/")
+
+def leer_csv_nombres(data):
+    # data: texto del CSV. Se indexa por la ruta relativa a la raíz de la importación.
+    nombres = {}
+    for row in csv.DictReader(io.StringIO(data)):
+        archivo = (row.get("archivo") or "").strip()
+        nombre = (row.get("nombre") or "").strip()
+        if archivo and nombre:
+            nombres[_clave_archivo(archivo)] = nombre
+    return nombres
+
+def nombre_en_csv(nombres, archivo):
+    # primero la ruta completa y luego quitando carpetas por arriba: así valen un ZIP con
+    # carpeta raíz y un CSV con solo el nombre del archivo, pero "a/foto.jpg" no es "b/foto.jpg"
+    partes = _clave_archivo(archivo).split("/")
+    for i in range(len(partes)):
+        nombre = nombres.get("/".join(partes[i:]))
+        if nombre:
+            return nombre
+    return None
+
+def _es_imagen(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTS and not os.path.basename(name).startswith(".")
+
+def fuentes_carpeta(carpeta):
+    for root, _, files in os.walk(carpeta):
+        for f in sorted(files):
+            if _es_imagen(f):
+                path = os.path.join(root, f)
+                yield os.path.relpath(path, carpeta), lambda p=path: open(p, "rb").read()
+
+def fuentes_zip(zf):
+    for info in zf.infolist():
+        if not info.is_dir() and _es_imagen(info.filename):
+            yield info.filename, lambda i=info: zf.read(i)
+
+def codificar_imagen(data, destino):
+    # Se ejecuta en un proceso del pool: decodifica, detecta y, si hay exactamente
+    # un rostro, guarda la foto en `destino` y devuelve su embedding.
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return "ilegible", None
+    h, w = img.shape[:2]
+    if max(h, w) > IMPORT_MAX_SIDE:
+        f = IMPORT_MAX_SIDE / float(max(h, w))
+        img = cv2.resize(img, (int(w * f), int(h * f)), interpolation=cv2.INTER_AREA)
+    rgb = np.ascontiguousarray(img[:, :, ::-1])
+    import face_recognition  # solo en los procesos del pool; la web no carga los modelos
+    locs = face_recognition.face_locations(rgb)
+    if not locs:
+        return "sin_rostro", None
+    if len(locs) > 1:
+        return "varios_rostros", None
+    encs = face_recognition.face_encodings(rgb, locs)
+    if not encs:
+        return "sin_rostro", None
+    if destino and not cv2.imwrite(destino, img):
+        return "error_escritura", None
+    return "ok", np.asarray(encs[0], dtype=np.float64)
+
+class ImportJob:
+    # Estado de una importación; la web lo consulta mientras corre en segundo plano.
+    def __init__(self, origen):
+        self.id = uuid.uuid4().hex[:12]
+        self.origen = origen
+        self.total = 0
+        self.procesadas = 0
+        self.importados = 0
+        self.reporte = []
+        self.terminado = False
+        self.error = None
+        self.inicio = time.time()
+        self.duracion = None
+
+    def fallos(self):
+        return [r for r in self.reporte if r["estado"] != "ok"]
+
+def importar(fuentes, nombres=None, workers=IMPORT_WORKERS, job=None, dry_run=False, on_commit=None):
+    # fuentes: iterable de (archivo, leer_bytes). Codifica en paralelo con una ventana
+    # de tareas acotada (no se cargan miles de fotos en memoria), inserta todo en una
+    # transacción y llama a on_commit() una sola vez (las filas nuevas las trae la tabla cambios).
+    job = job or ImportJob("importación")
+    fuentes = list(fuentes)
+    job.total = len(fuentes)
+    nombres = nombres or {}
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    ok = []  # (archivo, nombre, filename, embedding)
+    ctx = multiprocessing.get_context(IMPORT_MP_CONTEXT)
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx) as pool:
+        pending = {}
+        it = iter(enumerate(fuentes))
+
+        def submit_next():
+            for i, (archivo, leer) in it:
+                nombre = nombre_en_csv(nombres, archivo) if nombres else nombre_desde_archivo(archivo)
+                if not nombre:
+                    job.reporte.append({"archivo": archivo, "nombre": "", "estado": "sin_nombre"})
+                    job.procesadas += 1
+                    continue
+                filename = secure_filename(f"{nombre}_{stamp}_{i}.jpg")
+                destino = None if dry_run else os.path.join(DATA_AUT, filename)
+                try:
+                    data = leer()
+                except OSError:
+                    job.reporte.append({"archivo": archivo, "nombre": nombre, "estado": "ilegible"})
+                    job.procesadas += 1
+                    continue
+                pending[pool.submit(codificar_imagen, data, destino)] = (archivo, nombre, filename)
+                return True
+            return False
+
+        for _ in range(max(1, workers) * 4):
+            if not submit_next():
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                archivo, nombre, filename = pending.pop(fut)
+                try:
+                    estado, emb = fut.result()
+                except Exception as e:
+                    estado, emb = f"error: {e}", None
+                job.reporte.append({"archivo": archivo, "nombre": nombre, "estado": estado})
+                job.procesadas += 1
+                if estado == "ok":
+                    ok.append((archivo, nombre, filename, emb))
+                submit_next()
+
+    if ok and not dry_run:
+        try:
+            ids = database.add_autorizados_bulk([(n, f, e) for _, n, f, e in ok])
+        except Exception:
+            for _, _, filename, _ in ok:
+                database._remove_file(os.path.join(DATA_AUT, filename))
+            raise
+        job.importados = len(ids)
+        if on_commit:
+            on_commit()
+    elif dry_run:
+        job.importados = len(ok)
+    job.reporte.sort(key=lambda r: r["archivo"])
+    job.duracion = time.time() - job.inicio
+    job.terminado = True
+    return job
+
+# importaciones lanzadas desde la web, por id
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _podar_jobs(now):
+    # las terminadas caducan a las IMPORT_JOB_TTL s y no se guardan más de IMPORT_JOBS_MAX;
+    # las que siguen en curso no se tocan
+    terminados = sorted((j for j in _jobs.values() if j.terminado), key=lambda j: j.inicio)
+    sobran = len(_jobs) - IMPORT_JOBS_MAX
+    for job in terminados:
+        if sobran > 0 or now - job.inicio - (job.duracion or 0) > IMPORT_JOB_TTL:
+            del _jobs[job.id]
+            sobran -= 1
+
+def importar_zip_en_segundo_plano(zip_path, csv_text=None, on_commit=None, workers=IMPORT_WORKERS):
+    job = ImportJob(os.path.basename(zip_path))
+    with _jobs_lock:
+        _podar_jobs(time.time())
+        _jobs[job.id] = job
+
+    def run():
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                nombres = leer_csv_nombres(csv_text) if csv_text else None
+                importar(fuentes_zip(zf), nombres, workers=workers, job=job, on_commit=on_commit)
+        except Exception as e:
+            job.error = str(e)
+            job.duracion = time.time() - job.inicio
+            job.terminado = True
+        finally:
+            database._remove_file(zip_path)
+
+    threading.Thread(target=run, daemon=True, name=f"importar:{job.id}").start()
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        _podar_jobs(time.time())
+        return _jobs.get(job_id)
+
+def main():
+    parser = argparse.ArgumentParser(description="Importación masiva de autorizados")
+    parser.add_argument("origen", help="Carpeta o archivo .zip con las fotos")
+    parser.add_argument("--csv", help="CSV con columnas archivo,nombre")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    parser.add_argument("--reporte", help="Guardar el reporte por imagen en este CSV")
+    parser.add_argument("--dry-run", action="store_true", help="Solo validar, sin escribir en la BD")
+    args = parser.parse_args()
+
+    database.init_db()
+    os.makedirs(DATA_AUT, exist_ok=True)
+    nombres = None
+    if args.csv:
+        with open(args.csv, encoding="utf-8-sig") as f:
+            nombres = leer_csv_nombres(f.read())
+
+    if zipfile.is_zipfile(args.origen):
+        with zipfile.ZipFile(args.origen) as zf:
+            job = importar(fuentes_zip(zf), nombres, args.workers, dry_run=args.dry_run)
+    else:
+        job = importar(fuentes_carpeta(args.origen), nombres, args.workers, dry_run=args.dry_run)
+
+    for r in job.fallos():
+        print(f"  {r['archivo']}: {r['estado']}")
+    print(f"{job.importados}/{job.total} importados en {job.duracion:.1f}s ({len(job.fallos())} con fallos)")
+    if not args.dry_run and job.importados:
+        print("La aplicación en ejecución los incorpora sola en un segundo (tabla cambios).")
+    if args.reporte:
+        with open(args.reporte, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=["archivo", "nombre", "estado"])
+            w.writeheader()
+            w.writerows(job.reporte)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# metricas.py
+# Métricas en memoria con salida en formato de texto de Prometheus (/metrics).
+# Pensadas para quedar activas en producción: observe/inc solo toman un lock por
+# métrica y hacen una búsqueda binaria en los buckets; lo caro (formatear) ocurre
+# únicamente cuando alguien consulta /metrics.
+import bisect
+import threading
+
+# segundos: de 0.5 ms a 5 s, cubre desde el resize hasta un HOG con upsample
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in pairs)
+    return "{" + body + "}"
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # para totales que ya cuenta otro objeto y se copian al consultar /metrics
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            yield self.name, _format_labels(self.labelnames, key), v
+
+class Gauge(Counter):
+    kind = "gauge"
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # conteos por bucket (el último es +Inf), suma y total
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q, **labels):
+        # estimación por interpolación lineal dentro del bucket, como histogram_quantile
+        with self._lock:
+            series = self._series.get(_label_key(self.labelnames, labels))
+            if series is None or not series[2]:
+                return None
+            counts, total = list(series[0]), series[2]
+        rank = q * total
+        acc = 0
+        for i, c in enumerate(counts):
+            if acc + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i >= len(self.buckets):
+                    return self.buckets[-1]
+                return lower + (self.buckets[i] - lower) * (rank - acc) / c
+            acc += c
+        return self.buckets[-1]
+
+    def label_values(self):
+        with self._lock:
+            return [dict(zip(self.labelnames, key)) for key in self._series]
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        for key, counts, total_sum, count in items:
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                yield self.name + "_bucket", _format_labels(self.labelnames, key, {"le": _format_value(bound)}), acc
+            yield self.name + "_sum", _format_labels(self.labelnames, key), total_sum
+            yield self.name + "_count", _format_labels(self.labelnames, key), count
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, fn):
+        # fn() se llama en cada consulta; actualiza gauges a partir del estado actual
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self):
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for fn in collectors:
+            try:
+                fn()
+            except Exception as e:
+                print(f"[metricas] Error en colector: {e}")
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# --- Métricas compartidas por los módulos del sistema ---
+etapa_segundos = REGISTRY.histogram(
+    "reconocimiento_etapa_segundos", "Duración de cada etapa del pipeline por frame", ("camara", "etapa"))
+db_escritura_segundos = REGISTRY.histogram(
+    "db_escritura_segundos", "Duración de las escrituras en la BD", ("operacion",))
+frames = REGISTRY.counter(
+    "reconocimiento_frames_total", "Frames por cámara y resultado", ("camara", "estado"))
+fps = REGISTRY.gauge("reconocimiento_fps", "Frames publicados por segundo (media móvil)", ("camara",))
+latencia = REGISTRY.gauge("reconocimiento_latencia_segundos", "Latencia captura -> JPEG publicado (media móvil)", ("camara",))
+conectada = REGISTRY.gauge("camara_conectada", "1 si el stream de la cámara está conectado", ("camara",))
+reconexiones = REGISTRY.counter("camara_reconexiones_total", "Reconexiones del stream de la cámara", ("camara",))
+visores = REGISTRY.gauge("reconocimiento_visores", "Visores conectados", ("camara",))
+colas = REGISTRY.gauge("cola_pendientes", "Elementos en cola", ("cola",))
+cache = REGISTRY.gauge("cache_tamano", "Filas en las cachés en memoria", ("cache",))
+eventos_clientes = REGISTRY.gauge("eventos_clientes", "Clientes conectados a /eventos")
+eventos = REGISTRY.counter("eventos_total", "Eventos del reconocimiento por resultado", ("estado",))
+servidor_clientes = REGISTRY.gauge("servidor_clientes", "Conexiones abiertas en servidor.py por tipo", ("tipo",))
+servidor_rechazos = REGISTRY.counter("servidor_rechazos_total", "Clientes rechazados o expulsados por servidor.py", ("motivo",))
+rostros = REGISTRY.counter("rostros_total", "Tomas de rostros por resultado del filtro de calidad", ("camara", "estado"))
+retencion = REGISTRY.counter("retencion_total", "Intrusos borrados por la retención", ("accion",))
+escrituras = REGISTRY.counter("escrituras_total", "Escrituras en segundo plano por resultado", ("escritor", "estado"))
+
+def resumen_etapas(camara, quantiles=(0.5, 0.95)):
+    # {etapa: {"p50": ms, "p95": ms}} para el panel de estado
+    out = {}
+    for labels in etapa_segundos.label_values():
+        if labels["camara"] != str(camara):
+            continue
+        out[labels["etapa"]] = {f"p{int(q * 100)}": round((etapa_segundos.quantile(q, **labels) or 0) * 1000.0, 2)
+                                for q in quantiles}
+    return out
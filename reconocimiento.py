@@ -1,160 +1,1381 @@
 # reconocimiento.py
 import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import cv2
 import numpy as np
-import face_recognition
 from datetime import datetime
 import database
+import metricas
+import calidad
+from capturas import snapshot_writer
+from fuentes import open_source, decode_jpeg
+from galeria import Gallery, IntrusoIndex, person_template
 
-# URL del stream del ESP32-CAM — editar según tu red
-ESP32_STREAM_URL = "http://192.168.18.33:81/stream"
+# URL del stream del ESP32-CAM por defecto — se registra como primera cámara en la BD
+ESP32_STREAM_URL = os.environ.get("ESP32_STREAM_URL", "http://192.168.18.33:81/stream")
 
 DATA_AUT = os.path.join("data", "autorizados")
 DATA_INT = os.path.join("data", "intrusos")
 
 AUTH_TOLERANCE = 0.5
 INTRUSO_TOLERANCE = 0.6
+# Ventana de deduplicación de intrusos en horas (0 = todo el histórico)
+INTRUSO_DEDUP_HORAS = float(os.environ.get("INTRUSO_DEDUP_HORAS", "168"))
 
-known_face_encodings = []
-known_face_names = []
-intruso_encodings = []
+# Cada cuánto se mira si otro proceso cambió autorizados o intrusos (segundos)
+CACHE_SYNC_INTERVAL = float(os.environ.get("CACHE_SYNC_INTERVAL", "1.0"))
+CACHE_PRUNE_EVERY = 300
 
-# Flag global para controlar la cámara
-camera_active = False
+# Hilos de reconocimiento por cámara (todos consumen el frame más reciente)
+RECOGNITION_WORKERS = int(os.environ.get("RECOGNITION_WORKERS", "1"))
+# Calidad JPEG de los frames que se recodifican (los que llevan cajas dibujadas)
+STREAM_JPEG_QUALITY = int(os.environ.get("STREAM_JPEG_QUALITY", "80"))
+VIEWER_MODES = ("anotado", "crudo")
+# Eventos por cliente en cola antes de descartar los más viejos, e historial para reconectar
+EVENT_QUEUE = int(os.environ.get("EVENT_QUEUE", "100"))
+EVENT_HISTORY = 200
+# Procesos para detección/encoding, compartidos por todas las cámaras
+RECOGNITION_PROCESSES = int(os.environ.get("RECOGNITION_PROCESSES", "0")) or (os.cpu_count() or 1)
+RECOGNITION_MP_CONTEXT = os.environ.get("RECOGNITION_MP_CONTEXT", "forkserver")
 
-def embedding_to_hex(arr: np.ndarray) -> str:
-    return arr.tobytes().hex()
+# Seguimiento de rostros entre frames
+TRACK_DETECT_EVERY = int(os.environ.get("TRACK_DETECT_EVERY", "5"))  # re-detectar cada K frames
+TRACK_REFRESH = int(os.environ.get("TRACK_REFRESH", "30"))  # re-encoding periódico de tracks estables
+TRACK_OPENCV = os.environ.get("TRACK_OPENCV", "1") == "1"  # mover cajas con KCF/MOSSE si están disponibles
+TRACK_IOU = 0.3
+TRACK_MAX_AGE = 3 * TRACK_DETECT_EVERY
+TRACK_VOTES = 7
+TRACK_MIN_VOTES = 3
+TRACK_CONFIDENCE = 0.7
 
-def hex_to_embedding(hexstr: str) -> np.ndarray:
-    return np.frombuffer(bytes.fromhex(hexstr), dtype=np.float64)
+# Compuerta de movimiento: sin cambios en la escena no se ejecuta la detección
+MOTION_ENABLED = os.environ.get("MOTION_ENABLED", "1") == "1"
+MOTION_THRESHOLD = int(os.environ.get("MOTION_THRESHOLD", "25"))  # diferencia de gris (0-255); menor = más sensible
+MOTION_MIN_AREA = float(os.environ.get("MOTION_MIN_AREA", "0.002"))  # fracción mínima del frame en movimiento
+MOTION_WIDTH = 160
+MOTION_ALPHA = 0.05
+MOTION_FULL_FRAME = 0.6  # si las ROIs cubren más que esto se detecta en todo el frame
+
+# Detector: backend por defecto y control adaptativo de escala/upsample
+MODELS_DIR = os.environ.get("MODELS_DIR", "models")
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "hog")  # hog, haar, lbp, ssd, yunet
+DETECTOR_TARGET_MS = float(os.environ.get("DETECTOR_TARGET_MS", "0"))  # 0 = escala fija
+DNN_CONFIDENCE = 0.6
+# Niveles (escala de entrada, upsample) ordenados de menor a mayor coste; el 3 = (0.5, 1) es el modo clásico
+DETECTOR_LEVELS = [(0.25, 0), (0.35, 0), (0.5, 0), (0.5, 1), (0.75, 1), (1.0, 1)]
+DETECTOR_DEFAULT_LEVEL = 3
+
+# Galería de autorizados (matriz float32): una plantilla por persona de la tabla personas
+gallery = Gallery()
+# Índice IVF de intrusos recientes, indexado por id de la tabla intrusos
+intrusos_index = IntrusoIndex(retention_seconds=INTRUSO_DEDUP_HORAS * 3600 or None)
+
+# Workers de captura compartidos por cámara y suscripciones de cada visor
+_workers = {}
+_workers_lock = threading.Lock()
+_viewers = {}
+_viewers_lock = threading.Lock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _plantillas(ids, matrix, personas):
+    # agrupa las muestras por persona y calcula la plantilla de cada una
+    pids = np.array([personas[int(i)][0] for i in ids], dtype=np.int64)
+    order = np.argsort(pids, kind="stable")
+    pids, matrix = pids[order], matrix[order]
+    bounds = np.flatnonzero(np.diff(pids)) + 1
+    people = []
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(pids)]):
+        if end > start:
+            pid = int(pids[start])
+            people.append((pid, personas[int(ids[order[start]])][1], person_template(matrix[start:end])))
+    return people
 
 def load_autorizados_cache():
-    global known_face_encodings, known_face_names
-    known_face_encodings = []
-    known_face_names = []
-    rows = database.list_autorizados()
-    for r in rows:
-        nombre = r["nombre"]
-        filename = r["filename"]
-        hx = r["embedding_hex"]
-        if hx:
-            try:
-                emb = hex_to_embedding(hx)
-                known_face_encodings.append(emb)
-                known_face_names.append(nombre)
-                continue
-            except Exception:
-                pass
-        path = os.path.join(DATA_AUT, filename)
-        if os.path.exists(path):
-            try:
-                img = face_recognition.load_image_file(path)
-                encs = face_recognition.face_encodings(img)
-                if encs:
-                    emb = np.array(encs[0], dtype=np.float64)
-                    known_face_encodings.append(emb)
-                    known_face_names.append(nombre)
-                    try:
-                        database.update_autorizado_embedding(r["id"], embedding_to_hex(emb))
-                    except:
-                        pass
-            except:
-                pass
+    # matriz desde la copia .npy de la BD; solo persona y nombre se leen por fila
+    ids, matrix, _ = database.load_embeddings("autorizados")
+    personas = database.autorizados_personas()
+    keep = np.isin(ids, np.fromiter(personas, dtype=np.int64, count=len(personas)))
+    people = _plantillas(ids[keep], matrix[keep], personas)
+    gallery.set_people(people, replace_all=True)
+
+def refresh_personas(pids):
+    # recalcula la plantilla de las personas con muestras nuevas o borradas
+    pids = {p for p in pids if p is not None}
+    if not pids:
+        return
+    grupos = database.personas_embeddings(pids)
+    gallery.set_people([(pid, nombre, person_template(m)) for pid, (nombre, m) in grupos.items()])
+    for pid in pids - set(grupos):
+        gallery.remove_person(pid)
+
+def backfill_autorizados_embeddings():
+    # filas antiguas sin embedding: se calculan en segundo plano, no al arrancar, y en el
+    # pool (este proceso no carga dlib). Sin filas pendientes no se arranca nada.
+    for r in database.list_autorizados_sin_embedding():
+        img = cv2.imread(os.path.join(DATA_AUT, r["filename"]))
+        if img is None:
+            continue
+        try:
+            enc = run_in_pool(encode_image, np.ascontiguousarray(img[:, :, ::-1]))
+        except Exception:
+            continue
+        if enc is not None:
+            database.update_autorizado_embedding(r["id"], enc)
+            sync_caches()
 
 def load_intrusos_cache():
-    global intruso_encodings
-    intruso_encodings = []
-    rows = database.list_intrusos()
-    for r in rows:
-        hx = r["embedding_hex"]
-        if hx:
+    ids, matrix, times = database.load_embeddings("intrusos")
+    if INTRUSO_DEDUP_HORAS:
+        # solo la ventana de deduplicación pasa a memoria; el resto queda en el .npy
+        keep = times >= time.time() - INTRUSO_DEDUP_HORAS * 3600
+        ids, matrix, times = ids[keep], matrix[keep], times[keep]
+    intrusos_index.load(ids.tolist(), matrix, times)
+
+class CacheSync:
+    # Mantiene galería e índice de intrusos al día aplicando la tabla cambios de la BD:
+    # altas y bajas de este proceso, de otros workers (gunicorn) o del importador CLI
+    # se aplican como deltas, sin recargar las tablas.
+    def __init__(self, interval=CACHE_SYNC_INTERVAL):
+        self.interval = interval
+        self.last_id = 0
+        self.applied = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def reload(self):
+        # carga completa; el id se lee antes para no perder cambios que lleguen durante la carga
+        with self._lock:
+            last_id = database.ultimo_cambio()
+            load_autorizados_cache()
+            load_intrusos_cache()
+            self.last_id = last_id
+            self.reloads += 1
+
+    def apply(self):
+        with self._lock:
+            total = 0
+            while True:
+                rows = database.cambios_desde(self.last_id)
+                if not rows:
+                    return total
+                if rows[0]["id"] > self.last_id + 1 and self.last_id:
+                    # el registro se podó por delante de este proceso
+                    break
+                self._apply(rows)
+                self.last_id = rows[-1]["id"]
+                total += len(rows)
+                self.applied += len(rows)
+        print("[reconocimiento] Registro de cambios incompleto: recarga completa de cachés")
+        self.reload()
+        return total
+
+    def _apply(self, rows):
+        pids = set()
+        altas = {}
+        for r in rows:
+            if r["tabla"] != "intrusos":
+                pids.add(r["persona_id"])
+            elif r["operacion"] == "alta":
+                # las capturas de este proceso ya están en el índice desde antes de guardarse
+                if not database.intruso_writer.es_propio(r["fila"]) and r["fila"] not in intrusos_index:
+                    altas[r["fila"]] = True
+            else:
+                altas.pop(r["fila"], None)
+                intrusos_index.remove(r["fila"])
+        refresh_personas(pids)
+        for iid, ts, blob in database.intrusos_por_id(list(altas)):
+            intrusos_index.add(database.blob_to_embedding(blob), ts, key=iid)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._watch, daemon=True, name="cache-sync")
+            self._thread.start()
+
+    def _watch(self):
+        version = database.DataVersion()
+        last_prune = time.monotonic()
+        while True:
+            time.sleep(self.interval)
             try:
-                emb = hex_to_embedding(hx)
-                intruso_encodings.append(emb)
-            except:
-                pass
+                if version.changed():
+                    self.apply()
+                if time.monotonic() - last_prune > CACHE_PRUNE_EVERY:
+                    database.podar_cambios()
+                    last_prune = time.monotonic()
+            except Exception as e:
+                print(f"[reconocimiento] Error sincronizando cachés: {e}")
+
+cache_sync = CacheSync()
+
+def sync_caches():
+    # tras una escritura propia: aplica ya los cambios en lugar de esperar al sondeo.
+    # Antes de la primera carga (arranque en curso o APP_MODO=admin) no hay nada que
+    # actualizar: la carga ya incluirá el cambio.
+    if not cache_sync.reloads:
+        return 0
+    return cache_sync.apply()
 
 def initialize_caches():
     os.makedirs(DATA_AUT, exist_ok=True)
     os.makedirs(DATA_INT, exist_ok=True)
-    load_autorizados_cache()
-    load_intrusos_cache()
+    cache_sync.reload()
+    cache_sync.start()
+    threading.Thread(target=backfill_autorizados_embeddings, daemon=True, name="backfill-embeddings").start()
 
-def save_intruso_if_new(frame, enc):
-    global intruso_encodings
-    if intruso_encodings:
-        try:
-            dists = face_recognition.face_distance(intruso_encodings, enc)
-            if any(d <= INTRUSO_TOLERANCE for d in dists):
-                return None
-        except Exception:
-            pass
-    fname = f"intruso_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-    path = os.path.join(DATA_INT, fname)
-    cv2.imwrite(path, frame)
-    emb_hex = embedding_to_hex(np.array(enc, dtype=np.float64))
-    try:
-        database.add_intruso(fname, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), emb_hex)
-    except Exception:
-        pass
-    intruso_encodings.append(np.array(enc, dtype=np.float64))
+def save_intruso_if_new(frame, enc, box=None):
+    # box: caja del rostro (top, right, bottom, left) en coordenadas de `frame`
+    if intrusos_index.contains_near(enc, INTRUSO_TOLERANCE):
+        return None
+    # se indexa antes de guardar para que el frame siguiente ya lo vea como repetido
+    ts = time.time()
+    token = intrusos_index.add(enc, ts)
+    # JPEGs y fila en la BD se escriben en segundo plano; el id llega al confirmar el lote
+    # si la captura se pierde en cualquier punto se saca del índice: si no, ese intruso
+    # quedaría deduplicado durante INTRUSO_DEDUP_HORAS sin foto ni fila en la BD
+    fname = snapshot_writer.submit(frame.copy(), box, enc, ts,
+                                   callback=lambda iid: intrusos_index.set_key(token, iid),
+                                   on_error=lambda: intrusos_index.remove_row(token))
+    if fname is None:
+        # captura descartada por la cola llena: que se pueda volver a intentar
+        intrusos_index.remove_row(token)
     return fname
 
-def stop_camera():
-    global camera_active
-    camera_active = False
+def start_pool():
+    # forkserver: un proceso limpio importa face_recognition (carga los modelos de dlib)
+    # una vez y los workers se bifurcan de él compartiendo esas páginas. Todo lo que usa
+    # dlib (detección HOG, encodings, landmarks) corre en esos workers: este proceso no
+    # importa face_recognition. A diferencia de fork, se puede crear desde cualquier
+    # hilo (el arranque en segundo plano).
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context(RECOGNITION_MP_CONTEXT)
+            if RECOGNITION_MP_CONTEXT == "forkserver":
+                ctx.set_forkserver_preload(["face_recognition", "reconocimiento"])
+            _pool = ProcessPoolExecutor(max_workers=RECOGNITION_PROCESSES, mp_context=ctx)
+            _pool.submit(int).result()
+        return _pool
 
-def gen_frames():
-    global camera_active
-    initialize_caches()
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
 
-    cap = cv2.VideoCapture(ESP32_STREAM_URL)
-    if not cap.isOpened():
-        print(f"[reconocimiento] No se pudo abrir el stream: {ESP32_STREAM_URL}")
-        return
+class HogDetector:
+    name = "hog"
+
+    def detect(self, rgb, upsample):
+        import face_recognition
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=upsample, model="hog")
+
+def _model_files(backend):
+    # archivos que necesita cada backend; hog usa los modelos de face_recognition
+    return {
+        "haar": [os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")],
+        "lbp": [os.path.join(MODELS_DIR, "lbpcascade_frontalface_improved.xml")],
+        "ssd": [os.path.join(MODELS_DIR, "deploy.prototxt"),
+                os.path.join(MODELS_DIR, "res10_300x300_ssd_iter_140000.caffemodel")],
+        "yunet": [os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx")],
+    }.get(backend, [])
+
+class CascadeDetector:
+    # Haar viene con opencv-python; LBP requiere el XML en MODELS_DIR
+    def __init__(self, kind="haar"):
+        self.name = kind
+        (path,) = _model_files(kind)
+        self.cascade = cv2.CascadeClassifier(path)
+        if self.cascade.empty():
+            raise RuntimeError(f"No se pudo cargar la cascada: {path}")
+
+    def detect(self, rgb, upsample):
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        min_side = max(12, 40 >> upsample)
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side))
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in faces]
+
+class DnnDetector:
+    # ResNet-SSD (Caffe) o YuNet (ONNX) desde archivos locales en MODELS_DIR
+    def __init__(self, kind="ssd"):
+        self.name = kind
+        files = _model_files(kind)
+        for path in files:
+            if not os.path.exists(path):
+                raise RuntimeError(f"Modelo no encontrado: {path}")
+        if kind == "yunet":
+            self.net = cv2.FaceDetectorYN.create(files[0], "", (320, 320), DNN_CONFIDENCE)
+        else:
+            self.net = cv2.dnn.readNetFromCaffe(*files)
+
+    def detect(self, rgb, upsample):
+        h, w = rgb.shape[:2]
+        bgr = np.ascontiguousarray(rgb[:, :, ::-1])
+        boxes = []
+        if self.name == "yunet":
+            self.net.setInputSize((w, h))
+            _, faces = self.net.detect(bgr)
+            for f in (faces if faces is not None else []):
+                x, y, fw, fh = [int(v) for v in f[:4]]
+                boxes.append((max(0, y), min(w, x + fw), min(h, y + fh), max(0, x)))
+            return boxes
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        out = self.net.forward()
+        for i in range(out.shape[2]):
+            if out[0, 0, i, 2] < DNN_CONFIDENCE:
+                continue
+            x1, y1, x2, y2 = (out[0, 0, i, 3:7] * np.array([w, h, w, h])).astype(int)
+            boxes.append((max(0, y1), min(w, x2), min(h, y2), max(0, x1)))
+        return boxes
+
+DETECTOR_BACKENDS = {
+    "hog": HogDetector,
+    "haar": lambda: CascadeDetector("haar"),
+    "lbp": lambda: CascadeDetector("lbp"),
+    "ssd": lambda: DnnDetector("ssd"),
+    "yunet": lambda: DnnDetector("yunet"),
+}
 
-    camera_active = True
+def available_backends():
+    # backends con sus modelos presentes; solo estos se ofrecen y se aceptan al configurar
+    return sorted(b for b in DETECTOR_BACKENDS
+                  if all(os.path.exists(p) for p in _model_files(b))
+                  and (b != "yunet" or hasattr(cv2, "FaceDetectorYN")))
+
+# instancias por proceso del pool (los modelos no se envían entre procesos)
+_detectors = {}
+
+def get_detector(backend):
+    detector = _detectors.get(backend)
+    if detector is None:
+        try:
+            detector = DETECTOR_BACKENDS[backend]()
+        except Exception as e:
+            # sin modelos no se corta la detección: hog y queda cacheado para no reintentar
+            print(f"[reconocimiento] Detector {backend} no disponible ({e}), se usa hog.")
+            detector = _detectors.get("hog") or HogDetector()
+        _detectors[backend] = detector
+    return detector
+
+def _detect(rgb_small, backend="hog", upsample=1):
+    # se ejecuta en un proceso del pool
+    return get_detector(backend).detect(rgb_small, upsample)
+
+def _detect_rois(rgb_small, rois, backend="hog", upsample=1):
+    # se ejecuta en un proceso del pool; rois en coordenadas de rgb_small (top, right, bottom, left)
+    detector = get_detector(backend)
+    boxes = []
+    for top, right, bottom, left in rois:
+        crop = np.ascontiguousarray(rgb_small[top:bottom, left:right])
+        for t, r, b, l in detector.detect(crop, upsample):
+            boxes.append((t + top, r + left, b + top, l + left))
+    return boxes
+
+class DetectorController:
+    # Elige backend, escala y upsample de una cámara. Con target_ms > 0 baja o sube de
+    # nivel según la media móvil de la latencia de detección para respetar el presupuesto.
+    def __init__(self, backend=None, target_ms=None, level=DETECTOR_DEFAULT_LEVEL):
+        self.backend = backend or DETECTOR_BACKEND
+        if self.backend not in available_backends():
+            print(f"[reconocimiento] Detector {self.backend} no disponible, se usa hog.")
+            self.backend = "hog"
+        self.target_ms = DETECTOR_TARGET_MS if target_ms is None else target_ms
+        self.level = level
+        self.latency_ms = None
+        self._since_change = 0
+        self._lock = threading.Lock()
+
+    @property
+    def scale(self):
+        return DETECTOR_LEVELS[self.level][0]
+
+    @property
+    def upsample(self):
+        return DETECTOR_LEVELS[self.level][1]
+
+    def configure(self, backend=None, target_ms=None, level=None):
+        with self._lock:
+            if backend is not None:
+                if backend not in DETECTOR_BACKENDS:
+                    raise ValueError(f"Backend desconocido: {backend}")
+                if backend not in available_backends():
+                    raise ValueError(f"Faltan los modelos del backend {backend} en {MODELS_DIR}")
+                self.backend = backend
+            if target_ms is not None:
+                self.target_ms = float(target_ms)
+            if level is not None:
+                self.level = max(0, min(len(DETECTOR_LEVELS) - 1, int(level)))
+            self.latency_ms = None
+            self._since_change = 0
+
+    def detect(self, rgb_small, rois=None):
+        backend, upsample = self.backend, self.upsample
+        t0 = time.perf_counter()
+        if rois is None:
+            boxes = run_in_pool(_detect, rgb_small, backend, upsample)
+        else:
+            boxes = run_in_pool(_detect_rois, rgb_small, rois, backend, upsample)
+        self.observe((time.perf_counter() - t0) * 1000.0)
+        return boxes
+
+    def observe(self, ms):
+        with self._lock:
+            self.latency_ms = ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * ms
+            self._since_change += 1
+            if self.target_ms <= 0 or self._since_change < 10:
+                return
+            if self.latency_ms > self.target_ms * 1.1 and self.level > 0:
+                self.level -= 1
+            elif self.latency_ms < self.target_ms * 0.5 and self.level < len(DETECTOR_LEVELS) - 1:
+                self.level += 1
+            else:
+                return
+            self.latency_ms = None
+            self._since_change = 0
+
+    def state(self):
+        return {"backend": self.backend, "objetivo_ms": self.target_ms, "nivel": self.level,
+                "escala": self.scale, "upsample": self.upsample,
+                "latencia_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None}
+
+def _encode_crops(crops):
+    # se ejecuta en un proceso del pool: un encoding por recorte (rgb, caja relativa); solo viaja el rostro
+    import face_recognition
+    out = []
+    for rgb, box in crops:
+        encs = face_recognition.face_encodings(rgb, [box])
+        out.append(encs[0] if encs else None)
+    return out
+
+def encode_image(rgb):
+    # en el pool: embedding del primer rostro de una foto de registro, o None
+    import face_recognition
+    encs = face_recognition.face_encodings(rgb)
+    return np.array(encs[0], dtype=np.float64) if encs else None
+
+def run_in_pool(fn, *args):
+    pool = start_pool()
     try:
-        while camera_active:
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                print("[reconocimiento] No se pudo leer frame del stream.")
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        print("[reconocimiento] Pool de procesos caído, recreando.")
+        shutdown_pool()
+        return start_pool().submit(fn, *args).result()
+
+def iou(a, b):
+    # cajas en formato de face_recognition: (top, right, bottom, left)
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+def _create_cv_tracker():
+    # KCF/MOSSE solo existen con opencv-contrib; sin ellos la caja se mantiene hasta la próxima detección
+    for factory in ("TrackerKCF_create", "TrackerMOSSE_create"):
+        for module in (getattr(cv2, "legacy", None), cv2):
+            if module is not None and hasattr(module, factory):
+                return getattr(module, factory)()
+    return None
+
+class MotionDetector:
+    # Diferencia contra un fondo de media móvil sobre una imagen gris muy reducida.
+    # Devuelve las regiones con movimiento en coordenadas del frame de detección.
+    def __init__(self, threshold=None, min_area=None):
+        self.threshold = MOTION_THRESHOLD if threshold is None else threshold
+        self.min_area = MOTION_MIN_AREA if min_area is None else min_area
+        self._background = None
+        self._lock = threading.Lock()
+        self.evaluated = 0
+        self.gated = 0
+
+    def regions(self, small):
+        with self._lock:
+            return self._regions(small)
+
+    def _regions(self, small):
+        h, w = small.shape[:2]
+        scale = MOTION_WIDTH / float(w)
+        gray = cv2.cvtColor(cv2.resize(small, (MOTION_WIDTH, max(1, int(h * scale)))), cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        self.evaluated += 1
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return [(0, w, h, 0)]
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(gray, self._background, MOTION_ALPHA)
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_px = self.min_area * mask.shape[0] * mask.shape[1]
+        rois = []
+        for c in contours:
+            if cv2.contourArea(c) < min_px:
+                continue
+            x, y, cw, ch = cv2.boundingRect(c)
+            rois.append((int(y / scale), int((x + cw) / scale), int((y + ch) / scale), int(x / scale)))
+        if not rois:
+            self.gated += 1
+        return rois
+
+def _expand_rois(rois, shape, pad=0.25, min_side=80):
+    # agranda, recorta al frame y fusiona regiones solapadas
+    h, w = shape[:2]
+    boxes = []
+    for top, right, bottom, left in rois:
+        ph = max((bottom - top) * pad, (min_side - (bottom - top)) / 2.0, 0)
+        pw = max((right - left) * pad, (min_side - (right - left)) / 2.0, 0)
+        boxes.append([max(0, int(top - ph)), min(w, int(right + pw)), min(h, int(bottom + ph)), max(0, int(left - pw))])
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for b in boxes:
+            for o in out:
+                if b[0] < o[2] and o[0] < b[2] and b[3] < o[1] and o[3] < b[1]:
+                    o[0], o[1], o[2], o[3] = min(o[0], b[0]), max(o[1], b[1]), max(o[2], b[2]), min(o[3], b[3])
+                    merged = True
+                    break
+            else:
+                out.append(b)
+        boxes = out
+    return [tuple(b) for b in boxes]
+
+class Track:
+    def __init__(self, track_id, box, frame_idx):
+        self.id = track_id
+        self.box = box
+        self.votes = deque(maxlen=TRACK_VOTES)
+        self.distance = None
+        self.encoding = None
+        self.encoded_at = None
+        self.last_seen = frame_idx
+        self.intruso_guardado = False
+        self.anunciado = None  # identidad ya publicada en el bus de eventos
+        self.cv_tracker = None
+        self.calidad = None     # puntuación de la última toma evaluada
+        self.candidata = None   # mejor toma aún sin codificar (ventana del primer encoding)
+        self.tomas = 0
+        self.mejor = None       # mejor toma codificada: la que se guarda si es intruso
+
+    def vote(self, match, enc, frame_idx):
+        self.votes.append(match.name if match else None)
+        self.distance = match.distance if match else None
+        self.encoding = enc
+        self.encoded_at = frame_idx
+
+    @property
+    def label(self):
+        # voto mayoritario; None significa intruso
+        if not self.votes:
+            return None
+        counts = {}
+        for v in self.votes:
+            counts[v] = counts.get(v, 0) + 1
+        return max(counts, key=counts.get)
+
+    def uncertain(self):
+        if len(self.votes) < TRACK_MIN_VOTES:
+            return True
+        return self.votes.count(self.label) / len(self.votes) < TRACK_CONFIDENCE
+
+class Toma:
+    __slots__ = ("puntuacion", "crop", "crop_box", "frame", "box", "encoding")
+
+    def __init__(self, puntuacion, crop, crop_box, frame, box):
+        self.puntuacion = puntuacion
+        self.crop = crop
+        self.crop_box = crop_box
+        self.frame = frame
+        self.box = box  # en coordenadas del frame original
+        self.encoding = None
+
+def _select_shots(tracks, frame, rgb_small, scale, camera_id=None):
+    # Puntúa la toma actual de cada track pendiente y descarta las malas. Hasta su primer
+    # encoding un track espera QUALITY_WINDOW detecciones (o una toma >= QUALITY_GOOD) y
+    # codifica solo la mejor. Devuelve [(track, toma)] a codificar.
+    ready = []
+    puntuadas = []
+    for track in tracks:
+        box = tuple(int(v / scale) for v in track.box)
+        crop = calidad.recortar(rgb_small, track.box)
+        if not calidad.QUALITY_ENABLED:
+            ready.append((track, Toma(1.0, *crop, frame, box)))
+            continue
+        puntuadas.append([track, calidad.puntuar(frame, rgb_small, track.box, scale), crop, box])
+    # los landmarks son lo más caro y necesitan dlib: en el pool, una sola llamada por
+    # frame y solo para las tomas que ya pasan el mínimo con el resto de factores
+    con_pose = [p for p in puntuadas if calidad.QUALITY_POSE and not p[1].motivo]
+    if con_pose:
+        for p, pose in zip(con_pose, run_in_pool(calidad.poses, [p[2] for p in con_pose])):
+            p[1] = calidad.con_pose(p[1], pose)
+    for track, q, crop, box in puntuadas:
+        track.calidad = q.puntuacion
+        if q.motivo:
+            metricas.rostros.inc(camara=camera_id, estado=f"descartado_{q.motivo}")
+            continue
+        toma = Toma(q.puntuacion, *crop, frame, box)
+        if track.encoded_at is not None:
+            ready.append((track, toma))
+            continue
+        track.tomas += 1
+        if track.candidata is None or toma.puntuacion > track.candidata.puntuacion:
+            # el frame se sigue usando (se dibuja encima): la candidata guarda su copia
+            toma.frame = frame.copy()
+            track.candidata = toma
+        if track.tomas < calidad.QUALITY_WINDOW and toma.puntuacion < calidad.QUALITY_GOOD:
+            metricas.rostros.inc(camara=camera_id, estado="en_espera")
+            continue
+        ready.append((track, track.candidata))
+        track.candidata = None
+        track.tomas = 0
+    return ready
+
+class FaceTracker:
+    # Asociación por IoU entre detecciones; la detección completa solo corre cada
+    # TRACK_DETECT_EVERY frames y el encoding solo para tracks nuevos o dudosos.
+    def __init__(self):
+        self.tracks = []
+        self.scale = None
+        self.frame_idx = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _associate(self, boxes):
+        pairs = sorted(((iou(t.box, b), ti, bi) for ti, t in enumerate(self.tracks) for bi, b in enumerate(boxes)),
+                       reverse=True)
+        used_t, used_b, matched = set(), set(), []
+        for score, ti, bi in pairs:
+            if score < TRACK_IOU:
                 break
+            if ti in used_t or bi in used_b:
+                continue
+            used_t.add(ti); used_b.add(bi)
+            matched.append((self.tracks[ti], boxes[bi]))
+        unmatched = [b for bi, b in enumerate(boxes) if bi not in used_b]
+        return matched, unmatched
 
-            # process
-            small = cv2.resize(frame, (0,0), fx=0.5, fy=0.5)
-            rgb_small = small[:, :, ::-1]
-            face_locs = face_recognition.face_locations(rgb_small)
-            face_encs = face_recognition.face_encodings(rgb_small, face_locs)
-
-            for enc, loc in zip(face_encs, face_locs):
-                name = None
-                if known_face_encodings:
-                    matches = face_recognition.compare_faces(known_face_encodings, enc, tolerance=AUTH_TOLERANCE)
-                    if True in matches:
-                        idx = matches.index(True)
-                        name = known_face_names[idx]
-                if name:
-                    color = (0,255,0)
-                    label = name
+    def _start_cv_tracker(self, track, small):
+        if not TRACK_OPENCV:
+            return
+        tracker = _create_cv_tracker()
+        if tracker is None:
+            return
+        top, right, bottom, left = track.box
+        try:
+            tracker.init(small, (left, top, right - left, bottom - top))
+            track.cv_tracker = tracker
+        except Exception:
+            track.cv_tracker = None
+
+    def rescale(self, scale):
+        # el controlador cambió la escala de detección: se reescalan las cajas
+        with self._lock:
+            if self.scale and scale != self.scale:
+                ratio = scale / self.scale
+                for track in self.tracks:
+                    track.box = tuple(int(v * ratio) for v in track.box)
+                    track.cv_tracker = None
+            self.scale = scale
+
+    def update(self, small, rgb_small, motion_rois=None, detector=None):
+        # motion_rois: None = sin compuerta; [] = frame sin movimiento
+        detector = detector or DetectorController()
+        with self._lock:
+            self.frame_idx += 1
+            idx = self.frame_idx
+            if motion_rois is not None and not motion_rois:
+                # escena quieta: no se detecta nada. Los tracks conservan su caja pero no se
+                # renuevan: solo una detección los mantiene vivos, y si la persona se fue
+                # justo antes de que cesara el movimiento caducan con TRACK_MAX_AGE.
+                self.tracks = [t for t in self.tracks if idx - t.last_seen <= TRACK_MAX_AGE]
+                return idx, list(self.tracks), []
+            detect = not self.tracks or idx % TRACK_DETECT_EVERY == 0
+            if detect:
+                if motion_rois is None:
+                    boxes = detector.detect(rgb_small)
                 else:
-                    color = (0,0,255)
-                    label = "Intruso"
-                    save_intruso_if_new(frame, enc)
+                    # se incluyen las cajas de los tracks para no perder rostros quietos
+                    rois = _expand_rois(list(motion_rois) + [t.box for t in self.tracks], rgb_small.shape)
+                    area = sum((b - t) * (r - l) for t, r, b, l in rois)
+                    if area > MOTION_FULL_FRAME * rgb_small.shape[0] * rgb_small.shape[1]:
+                        boxes = detector.detect(rgb_small)
+                    else:
+                        boxes = detector.detect(rgb_small, rois)
+                matched, unmatched = self._associate(boxes)
+                for track, box in matched:
+                    track.box = box
+                    track.last_seen = idx
+                    self._start_cv_tracker(track, small)
+                for box in unmatched:
+                    track = Track(self._next_id, box, idx)
+                    self._next_id += 1
+                    self.tracks.append(track)
+                    self._start_cv_tracker(track, small)
+                self.tracks = [t for t in self.tracks if idx - t.last_seen <= TRACK_MAX_AGE]
+            else:
+                for track in self.tracks:
+                    if track.cv_tracker is None:
+                        continue
+                    ok, (x, y, w, h) = track.cv_tracker.update(small)
+                    if ok:
+                        track.box = (int(y), int(x + w), int(y + h), int(x))
+            pending = []
+            if detect:
+                pending = [t for t in self.tracks if t.last_seen == idx and
+                           (t.encoded_at is None or t.uncertain() or idx - t.encoded_at >= TRACK_REFRESH)]
+            return idx, list(self.tracks), pending
+
+def _lap(timings, stage, t0):
+    # acumula el tiempo de una etapa en `timings` (si se pidió) y devuelve el nuevo origen
+    t = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (t - t0)
+    return t
 
-                top, right, bottom, left = loc
-                top *= 2; right *= 2; bottom *= 2; left *= 2
-                cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                cv2.putText(frame, label, (left, top-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+def draw_annotations(frame, annotations):
+    for a in annotations:
+        color = (0,255,0) if a["autorizado"] else (0,0,255)
+        top, right, bottom, left = a["box"]
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+        cv2.putText(frame, a["label"], (left, top-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+    return frame
 
-            ret2, buffer = cv2.imencode('.jpg', frame)
-            if not ret2:
+class EventSubscription:
+    # Cola acotada de un cliente: si no consume a tiempo se descartan sus eventos más
+    # viejos; nunca se bloquea a quien publica
+    def __init__(self, maxsize, camara=None):
+        self._cond = threading.Condition()
+        self._items = deque(maxlen=maxsize)
+        self.camara = camara
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(event)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        # devuelve todos los pendientes (lista vacía si venció el timeout)
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self.closed, timeout)
+            items = list(self._items)
+            self._items.clear()
+            return items
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+class EventBus:
+    # Publicación/suscripción de resultados del reconocimiento (intruso, autorizado).
+    # Cada evento lleva un id creciente; el historial corto permite a un cliente SSE
+    # reconectar con Last-Event-ID sin perder lo ocurrido mientras tanto.
+    def __init__(self, maxsize=EVENT_QUEUE, history=EVENT_HISTORY):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._subs = set()
+        self._history = deque(maxlen=history)
+        self._next_id = 1
+        self.published = 0
+        self._dropped_closed = 0
+
+    def publish(self, tipo, **data):
+        with self._lock:
+            event = dict(data, id=self._next_id, tipo=tipo)
+            self._next_id += 1
+            self.published += 1
+            self._history.append(event)
+            subs = list(self._subs)
+        for sub in subs:
+            if sub.camara is None or sub.camara == event.get("camara"):
+                sub.put(event)
+        return event
+
+    def subscribe(self, camara=None, last_id=None, sub=None):
+        # sub: otra cola con la misma interfaz (put, camara, dropped, close), p. ej. la
+        # de servidor.py que despierta al bucle asyncio
+        sub = sub or EventSubscription(self.maxsize, camara)
+        with self._lock:
+            self._subs.add(sub)
+            if last_id is not None:
+                for event in self._history:
+                    if event["id"] > last_id and (camara is None or camara == event.get("camara")):
+                        sub.put(event)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.discard(sub)
+                self._dropped_closed += sub.dropped
+        sub.close()
+
+    def stats(self):
+        with self._lock:
+            subs = list(self._subs)
+            dropped = self._dropped_closed
+        return {"clientes": len(subs), "publicados": self.published,
+                "descartados": dropped + sum(s.dropped for s in subs)}
+
+event_bus = EventBus()
+
+def _publish_track(camera_id, track, tipo, captura=None):
+    ts = time.time()
+    event_bus.publish(tipo, camara=camera_id, track=track.id, nombre=track.label,
+                      distancia=None if track.distance is None else round(float(track.distance), 4),
+                      captura=captura, ts=ts, fecha=datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"))
+
+def process_frame(frame, tracker, motion=None, detector=None, timings=None, on_intruso=None,
+                  annotations=None, draw=True, camera_id=None):
+    # timings: dict opcional que recibe los segundos por etapa (redimension, movimiento,
+    # deteccion, codificacion, comparacion, intruso, anotacion) para benchmark.py.
+    # on_intruso: reemplaza a save_intruso_if_new (el benchmark no escribe en disco).
+    # annotations: lista que recibe las cajas/etiquetas en coordenadas de `frame`;
+    # con draw=False no se dibuja nada (el visor las pinta en el navegador).
+    # camera_id: con cámara se publican en event_bus los intrusos y autorizados nuevos.
+    detector = detector or DetectorController()
+    on_intruso = on_intruso or save_intruso_if_new
+    tic = time.perf_counter()
+    scale = detector.scale
+    tracker.rescale(scale)
+    small = cv2.resize(frame, (0,0), fx=scale, fy=scale)
+    tic = _lap(timings, "redimension", tic)
+    motion_rois = motion.regions(small) if motion is not None else None
+    tic = _lap(timings, "movimiento", tic)
+    if motion_rois is not None and not motion_rois and not tracker.tracks:
+        # frame vacío: pasa directo al codificador
+        tracker.update(small, None, motion_rois, detector)
+        return frame
+    rgb_small = np.ascontiguousarray(small[:, :, ::-1])
+    tic = _lap(timings, "redimension", tic)
+    idx, tracks, pending = tracker.update(small, rgb_small, motion_rois, detector)
+    tic = _lap(timings, "deteccion", tic)
+
+    if pending:
+        shots = _select_shots(pending, frame, rgb_small, scale, camera_id)
+        tic = _lap(timings, "calidad", tic)
+        if shots:
+            face_encs = run_in_pool(_encode_crops, [(s.crop, s.crop_box) for _, s in shots])
+            tic = _lap(timings, "codificacion", tic)
+            shots = [(t, s, e) for (t, s), e in zip(shots, face_encs) if e is not None]
+            matches = gallery.match([e for _, _, e in shots], AUTH_TOLERANCE) if shots else []
+            for (track, shot, enc), match in zip(shots, matches):
+                track.vote(match, enc, idx)
+                metricas.rostros.inc(camara=camera_id, estado="codificado")
+                if track.mejor is None or shot.puntuacion > track.mejor.puntuacion:
+                    shot.encoding = enc
+                    shot.crop = None
+                    if shot.frame is frame:
+                        shot.frame = frame.copy()
+                    track.mejor = shot
+            tic = _lap(timings, "comparacion", tic)
+
+    tracks = [t for t in tracks if t.encoded_at is not None]
+    # las capturas se toman antes de dibujar cualquier anotación
+    for track in tracks:
+        if track.uncertain():
+            continue
+        if track.label is None and not track.intruso_guardado:
+            # se guarda la mejor toma del track, no necesariamente la del frame actual
+            best = track.mejor
+            if best is not None:
+                captura = on_intruso(best.frame, best.encoding, best.box)
+            else:
+                captura = on_intruso(frame, track.encoding, tuple(int(v / scale) for v in track.box))
+            track.intruso_guardado = True
+            if camera_id is not None:
+                _publish_track(camera_id, track, "intruso", captura)
+        elif track.label is not None and track.anunciado != track.label and camera_id is not None:
+            _publish_track(camera_id, track, "autorizado")
+        track.anunciado = track.label
+    tic = _lap(timings, "intruso", tic)
+
+    found = [{"box": [int(v / scale) for v in track.box], "label": track.label or "Intruso",
+              "autorizado": track.label is not None} for track in tracks]
+    if annotations is not None:
+        annotations.extend(found)
+    if draw:
+        draw_annotations(frame, found)
+    _lap(timings, "anotacion", tic)
+    return frame
+
+class FrameBuffer:
+    # Último frame publicado de una cámara; los visores solo leen de aquí.
+    #   jpeg: para visores "anotado" (cajas dibujadas en el servidor si hacía falta)
+    #   raw:  para visores "crudo" (JPEG original de la cámara, sin recodificar)
+    #   meta: cajas y etiquetas del frame, para el canal de metadatos
+    # Las versiones a otra calidad se codifican bajo demanda una vez por frame.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.seq = 0
+        self.jpeg = None
+        self.raw = None
+        self.meta = None
+        self._frames = {}
+        self._encoded = {}
+        self._encode_lock = threading.Lock()
+        self.closed = False
+
+    def publish(self, jpeg, raw=None, frames=None, meta=None):
+        with self._cond:
+            self.seq += 1
+            self.jpeg = jpeg
+            self.raw = raw if raw is not None else jpeg
+            self.meta = meta
+            self._frames = frames or {}
+            self._encoded = {}
+            self._cond.notify_all()
+
+    def get(self, modo="anotado", calidad=None):
+        with self._cond:
+            seq, frames, encoded = self.seq, self._frames, self._encoded
+            default = self.raw if modo == "crudo" else self.jpeg
+        frame = frames.get(modo)
+        if not calidad or frame is None:
+            return seq, default
+        key = (modo, calidad)
+        with self._encode_lock:
+            if key not in encoded:
+                ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(calidad)])
+                encoded[key] = buf.tobytes() if ok else default
+            return seq, encoded[key]
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait(self, last_seq, timeout=1.0):
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq != last_seq or self.closed, timeout)
+            return self.seq, self.jpeg
+
+class LatestQueue:
+    # Cola acotada de un solo elemento: siempre guarda el más nuevo y descarta el anterior
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=0.5):
+        with self._cond:
+            self._cond.wait_for(lambda: self._item is not None or self.closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+class CameraWorker:
+    # Pipeline por cámara: captura -> cola latest-only -> reconocimiento -> codificación JPEG.
+    # Cada etapa se queda solo con el frame más reciente para priorizar la latencia.
+    def __init__(self, camera_id, url, backend=None, target_ms=None):
+        self.camera_id = camera_id
+        self.url = url
+        self.buffer = FrameBuffer()
+        self.subscribers = 0
+        self._stop_event = threading.Event()
+        self._frames = LatestQueue()
+        self._results = LatestQueue()
+        self._lock = threading.Lock()
+        self._last_encoded = 0
+        self.tracker = FaceTracker()
+        self.detector = DetectorController(backend, target_ms)
+        self.motion = MotionDetector() if MOTION_ENABLED else None
+        self.stats = {
+            "capturados": 0, "procesados": 0, "publicados": 0,
+            "descartados_codificacion": 0, "descartados_visor": 0, "jpeg_invalidos": 0,
+            "sin_recodificar": 0, "errores_reconocimiento": 0, "latencia_ms": 0.0, "fps": 0.0,
+        }
+        # visores por modo: "anotado" (cajas en el video) o "crudo" (cajas en el navegador)
+        self.modes = {"anotado": 0, "crudo": 0}
+        self.source = None
+        self._last_publish = None
+        self._threads = [threading.Thread(target=self._grab, daemon=True, name=f"captura:{url}")]
+        for i in range(RECOGNITION_WORKERS):
+            self._threads.append(threading.Thread(target=self._recognize, daemon=True, name=f"reconocimiento:{url}:{i}"))
+        self._threads.append(threading.Thread(target=self._encode, daemon=True, name=f"codificacion:{url}"))
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def is_alive(self):
+        # basta con que muera una etapa para que el stream se congele: subscribe() lo reemplaza
+        return all(t.is_alive() for t in self._threads)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _grab(self):
+        # el stream HTTP reconecta solo; el resto de fuentes termina al fallar la lectura
+        cap = self.source = open_source(self.url, stop_event=self._stop_event)
+        if not cap.isOpened():
+            print(f"[reconocimiento] No se pudo abrir el stream: {self.url}")
+            self._stop_event.set()
+        try:
+            seq = 0
+            while not self._stop_event.is_set():
+                t0 = time.perf_counter()
+                if hasattr(cap, "read_jpeg"):
+                    # solo bytes: se decodifica en _recognize y únicamente si no se descarta
+                    frame = cap.read_jpeg()
+                    ret = frame is not None
+                else:
+                    ret, frame = cap.read()
+                if not ret or frame is None:
+                    if not self._stop_event.is_set():
+                        print("[reconocimiento] No se pudo leer frame del stream.")
+                    break
+                metricas.etapa_segundos.observe(time.perf_counter() - t0, camara=self.camera_id, etapa="captura")
+                seq += 1
+                self._count("capturados")
+                self._frames.put((seq, time.monotonic(), frame))
+        finally:
+            try:
+                cap.release()
+            except:
+                pass
+            self._stop_event.set()
+            self._frames.close()
+
+    def _recognize(self):
+        while not self._stop_event.is_set():
+            item = self._frames.get()
+            if item is None:
                 continue
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    finally:
+            try:
+                self._recognize_one(*item)
+            except Exception as e:
+                # un fallo del pool o del detector pierde este frame, no el hilo
+                self._count("errores_reconocimiento")
+                n = self.stats["errores_reconocimiento"]
+                if n == 1 or n % 100 == 0:
+                    print(f"[reconocimiento] Error procesando frame de {self.url} ({n} errores): {e}")
+        self._results.close()
+
+    def _recognize_one(self, seq, t0, frame):
+        timings = {}
+        raw = None
+        if isinstance(frame, bytes):
+            # decodificado a menor tamaño, el JPEG original no se reenvía: el stream cambiaría
+            # de resolución según el frame tenga cajas o no
+            raw = frame if self.source.reduce <= 1 else None
+            t1 = time.perf_counter()
+            frame = decode_jpeg(frame, self.source.reduce)
+            timings["decodificacion"] = time.perf_counter() - t1
+            if frame is None:
+                self._count("jpeg_invalidos")
+                return
+        annotations = []
+        frame = process_frame(frame, self.tracker, self.motion, self.detector, timings,
+                              annotations=annotations, draw=False, camera_id=self.camera_id)
+        for etapa, segundos in timings.items():
+            metricas.etapa_segundos.observe(segundos, camara=self.camera_id, etapa=etapa)
+        self._count("procesados")
+        self._results.put((seq, t0, frame, raw, annotations))
+
+    def _encode(self):
         try:
-            cap.release()
-        except:
-            pass
-        camera_active = False
\ No newline at end of file
+            while not (self._stop_event.is_set() and self._results.closed):
+                item = self._results.get()
+                if item is None:
+                    continue
+                seq, t0, frame, raw, annotations = item
+                # con varios workers de reconocimiento un resultado puede llegar tarde
+                if seq <= self._last_encoded:
+                    self._count("descartados_codificacion")
+                    continue
+                self._last_encoded = seq
+                with self._lock:
+                    anotados, crudos = self.modes["anotado"], self.modes["crudo"]
+                if annotations and anotados:
+                    # solo se dibuja y recodifica si hay cajas y algún visor las quiere en el video
+                    drawn = draw_annotations(frame.copy() if crudos else frame, annotations)
+                    frames = {"anotado": drawn, "crudo": frame} if crudos else {"anotado": drawn}
+                    jpeg = self._jpeg(drawn)
+                    if raw is None and crudos:
+                        raw = self._jpeg(frame)
+                else:
+                    # sin cajas que dibujar se reenvía el JPEG original de la cámara
+                    frames = {"anotado": frame, "crudo": frame}
+                    jpeg = raw if raw is not None else self._jpeg(frame)
+                    if raw is not None:
+                        self._count("sin_recodificar")
+                if jpeg is None:
+                    continue
+                h, w = frame.shape[:2]
+                meta = {"seq": seq, "w": w, "h": h, "anotaciones": annotations}
+                self.buffer.publish(jpeg, raw, frames, meta)
+                now = time.monotonic()
+                with self._lock:
+                    self.stats["publicados"] += 1
+                    latency = (now - t0) * 1000.0
+                    self.stats["latencia_ms"] = 0.9 * self.stats["latencia_ms"] + 0.1 * latency
+                    if self._last_publish is not None and now > self._last_publish:
+                        self.stats["fps"] = 0.9 * self.stats["fps"] + 0.1 / (now - self._last_publish)
+                    self._last_publish = now
+        finally:
+            self.buffer.close()
+
+    def _jpeg(self, frame):
+        t1 = time.perf_counter()
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, STREAM_JPEG_QUALITY])
+        metricas.etapa_segundos.observe(time.perf_counter() - t1, camara=self.camera_id, etapa="jpeg")
+        return buffer.tobytes() if ret else None
+
+    def add_viewer_mode(self, modo, delta):
+        with self._lock:
+            self.modes[modo] = max(0, self.modes[modo] + delta)
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["modos"] = dict(self.modes)
+        stats["descartados_captura"] = self._frames.dropped
+        stats["descartados_reconocimiento"] = self._results.dropped
+        stats["visores"] = self.subscribers
+        if self.motion is not None:
+            stats["evaluados_movimiento"] = self.motion.evaluated
+            stats["sin_movimiento"] = self.motion.gated
+        stats["detector"] = self.detector.state()
+        stats["fps"] = round(stats["fps"], 1)
+        health = getattr(self.source, "health", None)
+        if health is not None:
+            stats["conexion"] = dict(health)
+        stats["etapas_ms"] = metricas.resumen_etapas(self.camera_id)
+        return stats
+
+def resolve_camera(camera_id=None):
+    # sin id se usa la primera cámara activa del registro
+    if camera_id is None:
+        rows = database.list_camaras(solo_activas=True)
+        if not rows:
+            return {"id": 0, "url": ESP32_STREAM_URL, "detector": None, "objetivo_ms": None}
+        return dict(rows[0])
+    row = database.get_camara(camera_id)
+    if row is None or not row["activa"]:
+        return None
+    return dict(row)
+
+def subscribe(camera_id=None):
+    camara = resolve_camera(camera_id)
+    if camara is None:
+        return None
+    camera_id = camara["id"]
+    with _workers_lock:
+        worker = _workers.get(camera_id)
+        if worker is None or not worker.is_alive() or worker.buffer.closed:
+            if worker is not None:
+                # una etapa murió: se detienen las demás antes de abrir otra conexión
+                worker.stop()
+            worker = CameraWorker(camera_id, camara["url"], camara["detector"], camara["objetivo_ms"])
+            _workers[camera_id] = worker
+            worker.start()
+        worker.subscribers += 1
+        return worker
+
+def unsubscribe(worker):
+    with _workers_lock:
+        worker.subscribers -= 1
+        if worker.subscribers <= 0:
+            worker.stop()
+            if _workers.get(worker.camera_id) is worker:
+                del _workers[worker.camera_id]
+
+def get_worker(camera_id=None):
+    # worker en marcha de la cámara, sin suscribirse (None si nadie la está viendo)
+    if camera_id is None:
+        camera_id = resolve_camera()["id"]
+    with _workers_lock:
+        return _workers.get(camera_id)
+
+def restart_camera(camera_id):
+    # tras editar o borrar una cámara; los visores actuales ven cerrarse su stream
+    with _workers_lock:
+        worker = _workers.pop(camera_id, None)
+    if worker is not None:
+        worker.stop()
+
+def configure_detector(camera_id, backend=None, target_ms=None, level=None):
+    # aplica en caliente al worker en marcha; la persistencia la hace quien llama
+    with _workers_lock:
+        worker = _workers.get(camera_id)
+    if worker is not None:
+        worker.detector.configure(backend, target_ms, level)
+        return worker.detector.state()
+    return None
+
+def active_cameras():
+    with _workers_lock:
+        return {cid: w.subscribers for cid, w in _workers.items()}
+
+def pipeline_stats():
+    with _workers_lock:
+        workers = list(_workers.values())
+    return {w.camera_id: dict(w.snapshot_stats(), url=w.url) for w in workers}
+
+_FRAME_ESTADOS = ("capturados", "procesados", "publicados", "descartados_captura",
+                  "descartados_reconocimiento", "descartados_codificacion", "descartados_visor",
+                  "jpeg_invalidos", "sin_recodificar", "errores_reconocimiento")
+
+def collect_metrics():
+    # se ejecuta solo al consultar /metrics: copia el estado actual a los gauges
+    for camera_id, stats in pipeline_stats().items():
+        for estado in _FRAME_ESTADOS:
+            metricas.frames.set(stats.get(estado, 0), camara=camera_id, estado=estado)
+        metricas.fps.set(stats["fps"], camara=camera_id)
+        metricas.latencia.set(stats["latencia_ms"] / 1000.0, camara=camera_id)
+        metricas.visores.set(stats["visores"], camara=camera_id)
+        conexion = stats.get("conexion")
+        if conexion is not None:
+            metricas.conectada.set(int(conexion["estado"] == "conectado"), camara=camera_id)
+            metricas.reconexiones.set(conexion["reconexiones"], camara=camera_id)
+    eventos = event_bus.stats()
+    metricas.eventos_clientes.set(eventos["clientes"])
+    metricas.eventos.set(eventos["publicados"], estado="publicados")
+    metricas.eventos.set(eventos["descartados"], estado="descartados")
+    metricas.colas.set(snapshot_writer.pending(), cola="capturas")
+    metricas.colas.set(database.intruso_writer.pending(), cola="intrusos_bd")
+    metricas.colas.set(database.file_remover.pending(), cola="borrado_archivos")
+    metricas.cache.set(len(gallery), cache="galeria_filas")
+    metricas.cache.set(len(intrusos_index), cache="intrusos")
+    metricas.cache.set(cache_sync.last_id, cache="ultimo_cambio")
+    for estado in ("saved", "dropped", "errors"):
+        metricas.escrituras.set(getattr(snapshot_writer, estado), escritor="capturas", estado=estado)
+    for estado in ("written", "dropped", "batches"):
+        metricas.escrituras.set(getattr(database.intruso_writer, estado), escritor="intrusos_bd", estado=estado)
+
+metricas.REGISTRY.add_collector(collect_metrics)
+
+def stop_camera(viewer_id=None):
+    # Solo corta los streams de este visor; la cámara sigue mientras haya otros suscritos
+    with _viewers_lock:
+        events = list(_viewers.get(viewer_id, ()))
+    for ev in events:
+        ev.set()
+
+def add_viewer(viewer_id):
+    stop = threading.Event()
+    with _viewers_lock:
+        _viewers.setdefault(viewer_id, set()).add(stop)
+    return stop
+
+def remove_viewer(viewer_id, stop):
+    with _viewers_lock:
+        events = _viewers.get(viewer_id)
+        if events is not None:
+            events.discard(stop)
+            if not events:
+                del _viewers[viewer_id]
+
+def gen_frames(viewer_id=None, camera_id=None, modo="anotado", calidad=None, fps=None):
+    # modo "anotado": cajas dibujadas en el servidor; "crudo": JPEG de la cámara tal cual,
+    # las cajas llegan aparte por gen_metadata. calidad/fps son propios de este visor.
+    modo = modo if modo in VIEWER_MODES else "anotado"
+    worker = subscribe(camera_id)
+    if worker is None:
+        return
+    worker.add_viewer_mode(modo, 1)
+    stop = add_viewer(viewer_id)
+    min_interval = 1.0 / fps if fps else 0.0
+    try:
+        seq = 0
+        last_sent = 0.0
+        while not stop.is_set():
+            new_seq, _ = worker.buffer.wait(seq)
+            if worker.buffer.closed:
+                break
+            if new_seq == seq:
+                continue
+            if min_interval:
+                # el visor pidió menos fps: se espera y se envía el más reciente
+                delay = last_sent + min_interval - time.monotonic()
+                if delay > 0 and stop.wait(delay):
+                    break
+            new_seq, jpeg = worker.buffer.get(modo, calidad)
+            if jpeg is None:
+                continue
+            if seq and new_seq > seq + 1:
+                worker._count("descartados_visor", new_seq - seq - 1)
+            seq = new_seq
+            last_sent = time.monotonic()
+            t0 = time.perf_counter()
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+            # lo que tarda el servidor en entregar el frame a este visor
+            metricas.etapa_segundos.observe(time.perf_counter() - t0, camara=worker.camera_id, etapa="envio")
+    finally:
+        remove_viewer(viewer_id, stop)
+        worker.add_viewer_mode(modo, -1)
+        unsubscribe(worker)
+
+def gen_metadata(viewer_id=None, camera_id=None):
+    # Server-Sent Events con las cajas de cada frame, para dibujarlas en el navegador
+    # sobre el stream "crudo". No suscribe la cámara: solo acompaña a un gen_frames.
+    worker = get_worker(camera_id)
+    if worker is None:
+        yield "retry: 1000\n\n"
+        return
+    stop = add_viewer(viewer_id)
+    try:
+        seq = 0
+        while not stop.is_set():
+            new_seq, _ = worker.buffer.wait(seq, timeout=15.0)
+            if worker.buffer.closed:
+                break
+            if new_seq == seq:
+                yield ": ping\n\n"
+                continue
+            seq = new_seq
+            meta = worker.buffer.meta
+            if meta is not None:
+                yield f"data: {json.dumps(meta)}\n\n"
+    finally:
+        remove_viewer(viewer_id, stop)
+
+def gen_events(camara=None, last_id=None):
+    # Server-Sent Events del bus: "event: intruso|autorizado" con el evento en JSON.
+    # No abre ningún stream de video; un comentario cada 15 s detecta clientes caídos.
+    sub = event_bus.subscribe(camara, last_id)
+    try:
+        yield "retry: 3000\n\n"
+        while not sub.closed:
+            events = sub.get(timeout=15.0)
+            if not events:
+                yield ": ping\n\n"
+                continue
+            yield "".join(f"id: {e['id']}\nevent: {e['tipo']}\ndata: {json.dumps(e)}\n\n" for e in events)
+    finally:
+        event_bus.unsubscribe(sub)
@@ -0,0 +1,193 @@
+# retencion.py
+# Retención del historial de intrusos: límite por antigüedad (RETENCION_DIAS) y por
+# tamaño en disco (RETENCION_MAX_MB). Borra en lotes, cada uno en una transacción corta
+# para no frenar al escritor de intrusos. Los archivos se borran en segundo plano
+# (database.file_remover), y las cachés se actualizan solas por la tabla cambios.
+# Opcionalmente archiva cada día en data/archivo/intrusos_AAAA-MM-DD.zip antes de borrar.
+#   python retencion.py --dias 30 --max-mb 2000 --dry-run
+#   python retencion.py --archivar --vacuum
+import os
+import io
+import csv
+import time
+import zipfile
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import database
+import metricas
+
+RETENCION_DIAS = float(os.environ.get("RETENCION_DIAS", "0"))      # 0 = sin límite
+RETENCION_MAX_MB = float(os.environ.get("RETENCION_MAX_MB", "0"))  # 0 = sin límite
+RETENCION_ARCHIVAR = os.environ.get("RETENCION_ARCHIVAR", "0") == "1"
+RETENCION_INTERVALO_HORAS = float(os.environ.get("RETENCION_INTERVALO_HORAS", "6"))
+RETENCION_LOTE = 2000       # filas por transacción
+RETENCION_PAUSA = 0.05      # s entre lotes: deja pasar al escritor de intrusos
+VACUUM_PAGINAS = 5000       # páginas devueltas al disco por ejecución (auto_vacuum incremental)
+DATA_INT = os.path.join("data", "intrusos")
+DATA_ARCHIVO = os.path.join("data", "archivo")
+
+_lock = threading.Lock()
+
+def _archivos(row):
+    return [n for n in (row["filename"], row["thumb"], row["rostro"]) if n]
+
+def _tamano(row):
+    total = 0
+    for name in _archivos(row):
+        try:
+            total += os.path.getsize(os.path.join(DATA_INT, name))
+        except OSError:
+            pass
+    return total
+
+def completar_tamanos():
+    # filas anteriores a la columna tamano: se miden una vez
+    total = 0
+    while True:
+        rows = database.intrusos_sin_tamano(500)
+        if not rows:
+            return total
+        database.update_tamanos([(r["id"], _tamano(r)) for r in rows])
+        total += len(rows)
+
+def candidatos(dias=RETENCION_DIAS, max_mb=RETENCION_MAX_MB, ahora=None):
+    # lotes de filas a borrar, de la más antigua a la más nueva: todas las anteriores
+    # al corte por antigüedad y, después, las necesarias para bajar de max_mb
+    corte = None
+    if dias:
+        corte = ((ahora or datetime.now()) - timedelta(days=dias)).strftime("%Y-%m-%d %H:%M:%S")
+    exceso = 0
+    if max_mb:
+        exceso = database.uso_intrusos()[1] - int(max_mb * 1024 * 1024)
+    if corte is None and exceso <= 0:
+        return
+    after = None
+    while True:
+        rows = database.intrusos_mas_antiguos(RETENCION_LOTE, after)
+        lote = []
+        for r in rows:
+            if (corte is None or r["fecha_hora"] >= corte) and exceso <= 0:
+                break
+            lote.append(r)
+            exceso -= r["tamano"] or 0
+        if lote:
+            yield lote
+        if len(lote) < len(rows) or len(rows) < RETENCION_LOTE:
+            return
+        after = (rows[-1]["fecha_hora"], rows[-1]["id"])
+
+def archivar(rows, destino=DATA_ARCHIVO):
+    # agrega las capturas a un zip por día. Los JPEG se guardan sin comprimir (ya lo
+    # están); el manifiesto CSV sí se comprime. Devuelve los bytes archivados.
+    os.makedirs(destino, exist_ok=True)
+    por_dia = {}
+    for r in rows:
+        por_dia.setdefault(r["fecha_hora"][:10], []).append(r)
+    total = 0
+    for dia, filas in por_dia.items():
+        path = os.path.join(destino, f"intrusos_{dia}.zip")
+        with zipfile.ZipFile(path, "a", compression=zipfile.ZIP_STORED) as zf:
+            presentes = set(zf.namelist())
+            manifiesto = io.StringIO()
+            w = csv.writer(manifiesto)
+            w.writerow(["id", "fecha_hora", "filename", "rostro", "thumb"])
+            for r in filas:
+                w.writerow([r["id"], r["fecha_hora"], r["filename"], r["rostro"] or "", r["thumb"] or ""])
+                for name in _archivos(r):
+                    src = os.path.join(DATA_INT, name)
+                    if name in presentes or not os.path.exists(src):
+                        continue
+                    zf.write(src, name)
+                    total += os.path.getsize(src)
+            zf.writestr(f"manifiesto_{filas[0]['id']}-{filas[-1]['id']}.csv", manifiesto.getvalue(),
+                        compress_type=zipfile.ZIP_DEFLATED)
+    return total
+
+def ejecutar(dias=RETENCION_DIAS, max_mb=RETENCION_MAX_MB, archivar_antes=RETENCION_ARCHIVAR,
+             dry_run=False, vacuum=False):
+    # devuelve el informe; con dry_run no modifica nada (salvo medir filas sin tamaño)
+    if not _lock.acquire(blocking=False):
+        return {"error": "ya hay una ejecución en curso"}
+    try:
+        t0 = time.perf_counter()
+        medidas = completar_tamanos()
+        informe = {"dry_run": dry_run, "filas": 0, "bytes": 0, "archivado": 0, "dias": {},
+                   "desde": None, "hasta": None, "medidas": medidas}
+        for lote in candidatos(dias, max_mb):
+            informe["filas"] += len(lote)
+            informe["bytes"] += sum(r["tamano"] or 0 for r in lote)
+            for r in lote:
+                dia = r["fecha_hora"][:10]
+                informe["dias"][dia] = informe["dias"].get(dia, 0) + 1
+            informe["desde"] = informe["desde"] or lote[0]["fecha_hora"]
+            informe["hasta"] = lote[-1]["fecha_hora"]
+            if dry_run:
+                continue
+            if archivar_antes:
+                informe["archivado"] += archivar(lote)
+            database.delete_intrusos([r["id"] for r in lote])
+            metricas.retencion.inc(len(lote), accion="borradas")
+            time.sleep(RETENCION_PAUSA)
+        if not dry_run:
+            informe["bd"] = database.optimizar_bd(VACUUM_PAGINAS, completo=vacuum)
+        informe["filas_restantes"], informe["bytes_restantes"], _ = database.uso_intrusos()
+        informe["duracion"] = round(time.perf_counter() - t0, 2)
+        return informe
+    finally:
+        _lock.release()
+
+def _programa(intervalo):
+    time.sleep(60)  # que el arranque (modelos, cámaras) vaya primero
+    while True:
+        try:
+            informe = ejecutar()
+            if informe.get("filas"):
+                print(f"[retencion] {informe['filas']} intrusos borrados ({informe['bytes'] / 1e6:.1f} MB) "
+                      f"en {informe['duracion']}s")
+        except Exception as e:
+            print(f"[retencion] Error: {e}")
+        time.sleep(intervalo)
+
+def iniciar(intervalo_horas=RETENCION_INTERVALO_HORAS):
+    # hilo en segundo plano; no hace nada si no hay ningún límite configurado
+    if not (RETENCION_DIAS or RETENCION_MAX_MB) or intervalo_horas <= 0:
+        return None
+    t = threading.Thread(target=_programa, args=(intervalo_horas * 3600,), daemon=True, name="retencion")
+    t.start()
+    return t
+
+def main():
+    parser = argparse.ArgumentParser(description="Retención del historial de intrusos")
+    parser.add_argument("--dias", type=float, default=RETENCION_DIAS, help="Borrar intrusos más antiguos (0 = sin límite)")
+    parser.add_argument("--max-mb", type=float, default=RETENCION_MAX_MB, help="Tamaño máximo en disco (0 = sin límite)")
+    parser.add_argument("--archivar", action="store_true", default=RETENCION_ARCHIVAR,
+                        help=f"Guardar lo borrado en zips diarios en {DATA_ARCHIVO}")
+    parser.add_argument("--dry-run", action="store_true", help="Solo informar, sin borrar")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="VACUUM completo (bloquea la BD; activa auto_vacuum incremental)")
+    args = parser.parse_args()
+
+    database.init_db()
+    informe = ejecutar(args.dias, args.max_mb, args.archivar, args.dry_run, args.vacuum)
+    if "error" in informe:
+        print(informe["error"])
+        return
+    accion = "se borrarían" if args.dry_run else "borrados"
+    print(f"{informe['filas']} intrusos {accion} ({informe['bytes'] / 1e6:.1f} MB)"
+          + (f", del {informe['desde']} al {informe['hasta']}" if informe["filas"] else ""))
+    for dia, n in sorted(informe["dias"].items()):
+        print(f"  {dia}: {n}")
+    if informe["archivado"]:
+        print(f"Archivados {informe['archivado'] / 1e6:.1f} MB en {DATA_ARCHIVO}")
+    print(f"Quedan {informe['filas_restantes']} intrusos ({informe['bytes_restantes'] / 1e6:.1f} MB)")
+    if "bd" in informe:
+        bd = informe["bd"]
+        print(f"BD: {bd['paginas']} páginas, {bd['libres']} libres"
+              + ("" if bd["auto_vacuum"] == 2 else " (usar --vacuum una vez para activar la compactación incremental)"))
+    if not database.file_remover.flush(60):
+        print(f"Quedan {database.file_remover.pending()} lotes de archivos por borrar")
+
+if __name__ == "__main__":
+    main()
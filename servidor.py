@@ -0,0 +1,483 @@
+# servidor.py
+# Servidor de producción. Uso:
+#   python servidor.py [--host 0.0.0.0] [--port 5000] [--hilos 16]
+# Los streams largos (/video_feed, /video_meta, /eventos) se sirven desde un bucle
+# asyncio: cada visor es una corrutina que lee del FrameBuffer compartido, no un hilo
+# bloqueado. El resto de rutas pasa a la app Flask (WSGI) en un pool de hilos.
+# Los modelos se cargan en segundo plano (arranque.py): se aceptan conexiones desde el
+# primer momento y /readyz indica cuándo el reconocimiento está listo.
+import os
+import re
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import reconocimiento as rc
+import arranque
+import metricas
+
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "16"))
+# Límite por IP: peticiones por segundo (con ráfaga) y streams abiertos a la vez
+RATE_LIMIT = float(os.environ.get("RATE_LIMIT", "20"))
+RATE_BURST = float(os.environ.get("RATE_BURST", "40"))
+MAX_STREAMS_PER_IP = int(os.environ.get("MAX_STREAMS_PER_IP", "8"))
+MAX_STREAMS = int(os.environ.get("MAX_STREAMS", "500"))
+MAX_STREAM_FPS = float(os.environ.get("MAX_STREAM_FPS", "30"))
+# Visor lento: si su búfer de salida supera HIGH_WATER se espera a que baje; si no baja
+# en SLOW_CLIENT_TIMEOUT segundos se le desconecta. Mientras tanto no se le encolan frames.
+STREAM_HIGH_WATER = int(os.environ.get("STREAM_HIGH_WATER", str(512 * 1024)))
+SLOW_CLIENT_TIMEOUT = float(os.environ.get("SLOW_CLIENT_TIMEOUT", "10"))
+KEEPALIVE_TIMEOUT = 15.0
+MAX_HEADER_LINES = 100
+MAX_BODY = int(os.environ.get("MAX_BODY", str(512 * 1024 * 1024)))
+BODY_CHUNK = 64 * 1024
+
+STREAM_ROUTES = [
+    ("video", re.compile(r"^/video_feed(?:/(\d+))?$")),
+    ("meta", re.compile(r"^/video_meta(?:/(\d+))?$")),
+    ("eventos", re.compile(r"^/eventos$")),
+]
+
+class ClienteLento(Exception):
+    pass
+
+class _Feed:
+    # Un hilo por cámara espera frames nuevos del FrameBuffer y despierta a todas las
+    # corrutinas de sus visores con un asyncio.Event que se renueva en cada frame.
+    def __init__(self, worker, loop):
+        self.worker = worker
+        self.loop = loop
+        self.seq = 0
+        self.clients = 0
+        self.closed = False
+        self._event = asyncio.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"feed:{worker.camera_id}")
+        self._thread.start()
+
+    def _run(self):
+        seq = 0
+        while not self.closed:
+            seq, _ = self.worker.buffer.wait(seq, timeout=1.0)
+            if self.worker.buffer.closed:
+                break
+            self.loop.call_soon_threadsafe(self._wake, seq)
+        self.loop.call_soon_threadsafe(self._wake, seq)
+
+    def _wake(self, seq):
+        self.seq = seq
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait(self, seq, timeout=1.0):
+        if self.seq != seq:
+            return
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+class _EventQueue:
+    # Cola de un cliente de /eventos con la interfaz de rc.EventSubscription; la llama el
+    # hilo que publica y entrega en el bucle asyncio. Acotada: descarta lo más viejo.
+    def __init__(self, loop, camara=None, maxsize=rc.EVENT_QUEUE):
+        self.loop = loop
+        self.camara = camara
+        self.items = deque(maxlen=maxsize)
+        self.dropped = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if len(self.items) == self.items.maxlen:
+            self.dropped += 1
+        self.items.append(event)
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+
+class Servidor:
+    def __init__(self, flask_app, host="0.0.0.0", port=5000, threads=SERVER_THREADS):
+        self.app = flask_app
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+        self.loop = None
+        self._server = None
+        self._feeds = {}
+        self._buckets = {}
+        self._streams_ip = {}
+        self.clientes = {"video": 0, "meta": 0, "eventos": 0, "http": 0}
+
+    # --- límites por cliente ---
+    def _permitir(self, ip):
+        # token bucket por IP
+        now = time.monotonic()
+        tokens, last = self._buckets.get(ip, (RATE_BURST, now))
+        tokens = min(RATE_BURST, tokens + (now - last) * RATE_LIMIT)
+        if tokens < 1.0:
+            self._buckets[ip] = (tokens, now)
+            return False
+        self._buckets[ip] = (tokens - 1.0, now)
+        if len(self._buckets) > 10000:
+            # IPs que ya recuperaron la ráfaga completa no aportan nada
+            self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < RATE_BURST / RATE_LIMIT}
+        return True
+
+    def _abrir_stream(self, ip, tipo):
+        if sum(self.clientes[t] for t in ("video", "meta", "eventos")) >= MAX_STREAMS:
+            return "servidor_lleno"
+        if self._streams_ip.get(ip, 0) >= MAX_STREAMS_PER_IP:
+            return "streams_por_ip"
+        self._streams_ip[ip] = self._streams_ip.get(ip, 0) + 1
+        self._cliente(tipo, 1)
+        return None
+
+    def _cerrar_stream(self, ip, tipo):
+        n = self._streams_ip.get(ip, 1) - 1
+        if n > 0:
+            self._streams_ip[ip] = n
+        else:
+            self._streams_ip.pop(ip, None)
+        self._cliente(tipo, -1)
+
+    def _cliente(self, tipo, delta):
+        self.clientes[tipo] += delta
+        metricas.servidor_clientes.set(self.clientes[tipo], tipo=tipo)
+
+    # --- conexiones ---
+    async def _handle(self, reader, writer):
+        ip = (writer.get_extra_info("peername") or ("?",))[0]
+        self._cliente("http", 1)
+        try:
+            while True:
+                environ = await self._leer_peticion(reader, writer, ip)
+                if environ is None:
+                    break
+                if not self._permitir(ip):
+                    metricas.servidor_rechazos.inc(motivo="limite_peticiones")
+                    await self._responder(writer, "429 Too Many Requests", [("Retry-After", "1")],
+                                          b"Demasiadas peticiones", False)
+                    break
+                stream = self._ruta_stream(environ)
+                if stream is not None:
+                    await self._stream(reader, writer, ip, *stream)
+                    break
+                if not await self._wsgi(environ, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except ClienteLento:
+            metricas.servidor_rechazos.inc(motivo="cliente_lento")
+        except Exception as e:
+            print(f"[servidor] Error atendiendo a {ip}: {e}")
+        finally:
+            self._cliente("http", -1)
+            writer.close()
+
+    async def _leer_peticion(self, reader, writer, ip):
+        try:
+            line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        if not line.strip():
+            return None
+        method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        path, _, query = target.partition("?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": ip,
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            key = name.strip().upper().replace("-", "_")
+            value = value.strip()
+            if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                key = "HTTP_" + key
+                environ[key] = environ[key] + "," + value if key in environ else value
+        else:
+            raise ValueError("demasiadas cabeceras")
+        if "HTTP_TRANSFER_ENCODING" in environ:
+            # no se decodifica chunked: leer ese cuerpo como Content-Length dejaría sus bytes
+            # como si fueran la siguiente petición de la conexión
+            await self._responder(writer, "501 Not Implemented", [], b"Transfer-Encoding no soportado", False)
+            return None
+        length = environ.get("CONTENT_LENGTH") or "0"
+        if not length.isdigit():
+            await self._responder(writer, "400 Bad Request", [], b"Content-Length incorrecto", False)
+            return None
+        length = int(length)
+        if length > MAX_BODY:
+            await self._responder(writer, "413 Request Entity Too Large", [], b"Archivo demasiado grande", False)
+            return None
+        if environ.get("HTTP_EXPECT", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        # cuerpos grandes (ZIP de importación) van a disco en lugar de a memoria
+        body = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        while length > 0:
+            chunk = await reader.readexactly(min(BODY_CHUNK, length))
+            body.write(chunk)
+            length -= len(chunk)
+        body.seek(0)
+        environ["wsgi.input"] = body
+        return environ
+
+    def _keep_alive(self, environ):
+        conn = environ.get("HTTP_CONNECTION", "").lower()
+        if environ["SERVER_PROTOCOL"] == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+    async def _responder(self, writer, status, headers, body, keep_alive):
+        names = {k.lower() for k, _ in headers}
+        headers = list(headers)
+        if "content-length" not in names:
+            headers.append(("Content-Length", str(len(body))))
+        headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+        head = f"HTTP/1.1 {status}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers) + "\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await self._drain(writer)
+
+    async def _drain(self, writer):
+        try:
+            await asyncio.wait_for(writer.drain(), SLOW_CLIENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ClienteLento()
+
+    # --- WSGI ---
+    def _llamar_app(self, environ):
+        # en un hilo del pool: la app y la lectura del cuerpo de la respuesta
+        result = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            result["status"], result["headers"] = status, headers
+            return chunks.append
+
+        it = self.app(environ, start_response)
+        try:
+            for chunk in it:
+                chunks.append(chunk)
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+            environ["wsgi.input"].close()
+        return result["status"], result["headers"], b"".join(chunks)
+
+    async def _wsgi(self, environ, writer):
+        status, headers, body = await self.loop.run_in_executor(self.executor, self._llamar_app, environ)
+        if environ["REQUEST_METHOD"] == "HEAD":
+            body = b""
+        keep_alive = self._keep_alive(environ)
+        await self._responder(writer, status, headers, body, keep_alive)
+        return keep_alive
+
+    # --- streams nativos ---
+    def _ruta_stream(self, environ):
+        # solo con sesión iniciada; sin ella la app Flask responde (redirect o 401)
+        if environ["REQUEST_METHOD"] != "GET" or not arranque.estado.completo:
+            return None
+        for tipo, pattern in STREAM_ROUTES:
+            m = pattern.match(environ["PATH_INFO"])
+            if m:
+                break
+        else:
+            return None
+        from flask import session, request
+        import app as web
+        with self.app.request_context(dict(environ)):
+            if "usuario" not in session:
+                return None
+            args = {"viewer": request.args.get("viewer"),
+                    "camara": int(m.group(1)) if m.lastindex else request.args.get("camara", type=int),
+                    "last_id": request.headers.get("Last-Event-ID", type=int)}
+            if tipo == "video":
+                args["modo"], args["calidad"], args["fps"] = web.stream_args()
+        return tipo, args
+
+    async def _stream(self, reader, writer, ip, tipo, args):
+        motivo = self._abrir_stream(ip, tipo)
+        if motivo:
+            metricas.servidor_rechazos.inc(motivo=motivo)
+            await self._responder(writer, "429 Too Many Requests", [("Retry-After", "5")], motivo.encode(), False)
+            return
+        handler = {"video": self._mjpeg, "meta": self._meta, "eventos": self._eventos}[tipo]
+        task = asyncio.ensure_future(handler(writer, args))
+        # el cliente no envía nada más: EOF en la lectura = se desconectó, aunque el
+        # stream esté esperando el próximo frame o evento
+        closed = asyncio.ensure_future(reader.read())
+        try:
+            await asyncio.wait({task, closed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for t in (task, closed):
+                t.cancel()
+            await asyncio.gather(task, closed, return_exceptions=True)
+            self._cerrar_stream(ip, tipo)
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+
+    def _feed(self, worker):
+        feed = self._feeds.get(worker)
+        if feed is None or feed.closed or not feed._thread.is_alive():
+            feed = self._feeds[worker] = _Feed(worker, self.loop)
+        feed.clients += 1
+        return feed
+
+    def _soltar_feed(self, feed):
+        feed.clients -= 1
+        if feed.clients <= 0:
+            feed.closed = True
+            if self._feeds.get(feed.worker) is feed:
+                del self._feeds[feed.worker]
+
+    def _cabecera_stream(self, writer, content_type):
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nCache-Control: no-cache\r\n"
+                     "X-Accel-Buffering: no\r\nConnection: close\r\n\r\n".encode("latin-1"))
+
+    async def _enviar(self, writer, data):
+        # no bloquea: si el cliente no consume, se espera un tiempo acotado y se le expulsa
+        if writer.is_closing():
+            raise ConnectionResetError()
+        writer.write(data)
+        if writer.transport.get_write_buffer_size() > STREAM_HIGH_WATER:
+            await self._drain(writer)
+
+    async def _mjpeg(self, writer, args):
+        modo = args["modo"] if args["modo"] in rc.VIEWER_MODES else "anotado"
+        worker = await self.loop.run_in_executor(self.executor, rc.subscribe, args["camara"])
+        if worker is None:
+            await self._responder(writer, "404 Not Found", [], b"Camara no encontrada", False)
+            return
+        worker.add_viewer_mode(modo, 1)
+        stop = rc.add_viewer(args["viewer"])
+        feed = self._feed(worker)
+        interval = 1.0 / min(args["fps"] or MAX_STREAM_FPS, MAX_STREAM_FPS)
+        try:
+            self._cabecera_stream(writer, "multipart/x-mixed-replace; boundary=frame")
+            seq, last_sent = 0, 0.0
+            while not stop.is_set() and not worker.buffer.closed:
+                await feed.wait(seq)
+                if feed.seq == seq:
+                    continue
+                delay = last_sent + interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if args["calidad"]:
+                    new_seq, jpeg = await self.loop.run_in_executor(self.executor, worker.buffer.get, modo, args["calidad"])
+                else:
+                    new_seq, jpeg = worker.buffer.get(modo)
+                if jpeg is None or new_seq == seq:
+                    continue
+                if seq and new_seq > seq + 1:
+                    worker._count("descartados_visor", new_seq - seq - 1)
+                seq = new_seq
+                last_sent = time.monotonic()
+                await self._enviar(writer, b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg + b"\r\n")
+                metricas.etapa_segundos.observe(time.monotonic() - last_sent, camara=worker.camera_id, etapa="envio")
+        finally:
+            self._soltar_feed(feed)
+            rc.remove_viewer(args["viewer"], stop)
+            worker.add_viewer_mode(modo, -1)
+            rc.unsubscribe(worker)
+
+    async def _meta(self, writer, args):
+        worker = rc.get_worker(args["camara"])
+        self._cabecera_stream(writer, "text/event-stream")
+        if worker is None:
+            await self._enviar(writer, b"retry: 1000\n\n")
+            return
+        stop = rc.add_viewer(args["viewer"])
+        feed = self._feed(worker)
+        try:
+            seq = 0
+            while not stop.is_set() and not worker.buffer.closed:
+                await feed.wait(seq, timeout=15.0)
+                if feed.seq == seq:
+                    await self._enviar(writer, b": ping\n\n")
+                    continue
+                seq = feed.seq
+                meta = worker.buffer.meta
+                if meta is not None:
+                    await self._enviar(writer, f"data: {json.dumps(meta)}\n\n".encode())
+        finally:
+            self._soltar_feed(feed)
+            rc.remove_viewer(args["viewer"], stop)
+
+    async def _eventos(self, writer, args):
+        sub = rc.event_bus.subscribe(args["camara"], args["last_id"], sub=_EventQueue(self.loop, args["camara"]))
+        try:
+            self._cabecera_stream(writer, "text/event-stream")
+            await self._enviar(writer, b"retry: 3000\n\n")
+            while True:
+                try:
+                    await asyncio.wait_for(sub.ready.wait(), 15.0)
+                except asyncio.TimeoutError:
+                    await self._enviar(writer, b": ping\n\n")
+                    continue
+                sub.ready.clear()
+                events, sub.items = list(sub.items), deque(maxlen=sub.items.maxlen)
+                await self._enviar(writer, "".join(f"id: {e['id']}\nevent: {e['tipo']}\ndata: {json.dumps(e)}\n\n"
+                                                   for e in events).encode())
+        finally:
+            rc.event_bus.unsubscribe(sub)
+
+    # --- ciclo de vida ---
+    async def serve(self, ready=None):
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=64 * 1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        print(f"[servidor] Escuchando en http://{self.host}:{self.port}")
+        if ready is not None:
+            ready.set()
+        async with self._server:
+            await stop.wait()
+        print("[servidor] Deteniendo...")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción (streams asyncio + app WSGI)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument("--hilos", type=int, default=SERVER_THREADS, help="Hilos para las rutas WSGI")
+    args = parser.parse_args()
+
+    # importar la app lanza el arranque (BD, cachés, modelos, pool) en segundo plano
+    import app as web
+    asyncio.run(Servidor(web.app, args.host, args.port, args.hilos).serve())
+
+if __name__ == "__main__":
+    main()
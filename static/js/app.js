@@ -13,6 +13,16 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // aviso de arranque: se consulta /readyz hasta que los modelos están cargados
+  const aviso = document.getElementById("avisoArranque");
+  if(aviso){
+    const revisar = () => fetch(aviso.dataset.url).then(r => {
+      if(r.ok){ aviso.remove(); return; }
+      setTimeout(revisar, 2000);
+    }).catch(() => setTimeout(revisar, 5000));
+    setTimeout(revisar, 2000);
+  }
+
   function showToast(text, time=3500){
     const t = document.createElement("div");
     t.className = "toast";
@@ -22,6 +32,39 @@ document.addEventListener("DOMContentLoaded", () => {
     setTimeout(()=> { t.classList.remove("visible"); setTimeout(()=> t.remove(), 200); }, time);
   }
 
+  // "Cargar más": pide la página siguiente a la API y clona la plantilla por cada fila
+  function fillCard(node, item){
+    node.querySelectorAll("[data-campo]").forEach(el => {
+      const value = item[el.dataset.campo];
+      if(value === null || value === undefined){ el.remove(); return; }
+      if(el.tagName === "IMG") el.src = value;
+      else if(el.tagName === "A") el.href = value;
+      else if(el.tagName === "FORM") el.action = value;
+      else el.innerText = value;
+    });
+    return node;
+  }
+
+  document.querySelectorAll(".load-more").forEach(btn => {
+    btn.addEventListener("click", async ()=>{
+      btn.disabled = true;
+      const url = new URL(btn.dataset.api, window.location.origin);
+      url.searchParams.set("cursor", btn.dataset.cursor);
+      try{
+        const r = await fetch(url);
+        const data = await r.json();
+        const grid = document.getElementById(btn.dataset.grid);
+        const tpl = document.getElementById(btn.dataset.template);
+        data.items.forEach(item => grid.appendChild(fillCard(tpl.content.firstElementChild.cloneNode(true), item)));
+        if(data.siguiente){ btn.dataset.cursor = data.siguiente; btn.disabled = false; }
+        else btn.remove();
+      }catch(e){
+        showToast("No se pudo cargar la página siguiente");
+        btn.disabled = false;
+      }
+    });
+  });
+
   const flashArea = document.querySelector(".flash-area");
   if(flashArea){
     const flashes = flashArea.querySelectorAll(".flash");
@@ -0,0 +1,18 @@
+# conftest.py
+# Los módulos del proyecto están en la raíz del repositorio (sin paquete).
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def bd(tmp_path, monkeypatch):
+    # base de datos nueva en un directorio temporal; las rutas data/... son relativas
+    import database
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "database.db"))
+    database.init_db()
+    yield database
+    database._pool.clear()
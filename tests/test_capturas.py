@@ -0,0 +1,76 @@
+# test_capturas.py
+# SnapshotWriter: archivos que escribe por intruso y políticas de descarte con la cola llena.
+import os
+
+import numpy as np
+import pytest
+
+import capturas
+from capturas import SnapshotWriter
+
+CAJA = (20, 60, 80, 20)
+
+def _frame():
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    frame[20:80, 20:60] = 200
+    return frame
+
+@pytest.fixture
+def encoladas(monkeypatch):
+    filas = []
+    monkeypatch.setattr(capturas.database, "queue_intruso",
+                        lambda filename, fecha_hora, *args, **kwargs: filas.append((filename, kwargs)) or True)
+    return filas
+
+def test_guarda_frame_rostro_y_miniatura(tmp_path, encoladas):
+    writer = SnapshotWriter(workers=1, maxsize=4, directory=str(tmp_path))
+    full = writer.submit(_frame(), CAJA, np.zeros(128), 1_700_000_000.0)
+    assert writer.flush(5)
+    assert writer.saved == 1 and writer.errors == 0
+    ((filename, kwargs),) = encoladas
+    assert filename == full
+    nombres = {full, kwargs["rostro"], kwargs["thumb"]}
+    assert sorted(os.listdir(tmp_path)) == sorted(nombres)
+
+def test_sin_caja_no_hay_recorte(tmp_path, encoladas):
+    writer = SnapshotWriter(workers=1, maxsize=4, directory=str(tmp_path))
+    writer.submit(_frame(), None, np.zeros(128), 1_700_000_000.0)
+    assert writer.flush(5)
+    ((_, kwargs),) = encoladas
+    assert kwargs["rostro"] is None and kwargs["thumb"]
+
+def test_nombres_unicos_en_el_mismo_instante():
+    assert len({capturas.snapshot_names()[0] for _ in range(100)}) == 100
+
+def test_politica_nuevo_descarta_la_entrante(tmp_path):
+    # sin hilos la cola no avanza
+    writer = SnapshotWriter(workers=0, maxsize=2, policy="nuevo", directory=str(tmp_path))
+    primera = writer.submit(_frame(), CAJA, None, 1.0)
+    assert writer.submit(_frame(), CAJA, None, 2.0)
+    assert writer.submit(_frame(), CAJA, None, 3.0) is None
+    assert writer.dropped == 1 and writer.pending() == 2
+    assert writer._queue.queue[0][5][0] == primera
+
+def test_politica_antiguo_desaloja_la_mas_vieja(tmp_path):
+    writer = SnapshotWriter(workers=0, maxsize=2, policy="antiguo", directory=str(tmp_path))
+    writer.submit(_frame(), CAJA, None, 1.0)
+    segunda = writer.submit(_frame(), CAJA, None, 2.0)
+    tercera = writer.submit(_frame(), CAJA, None, 3.0)
+    assert tercera is not None
+    assert writer.dropped == 1 and writer.pending() == 2
+    assert [job[5][0] for job in writer._queue.queue] == [segunda, tercera]
+
+def test_on_error_al_desalojar(tmp_path):
+    perdidas = []
+    writer = SnapshotWriter(workers=0, maxsize=1, policy="antiguo", directory=str(tmp_path))
+    writer.submit(_frame(), CAJA, None, 1.0, on_error=lambda: perdidas.append(1))
+    writer.submit(_frame(), CAJA, None, 2.0, on_error=lambda: perdidas.append(2))
+    assert perdidas == [1]
+
+def test_error_de_disco_se_cuenta(tmp_path, encoladas):
+    perdidas = []
+    writer = SnapshotWriter(workers=1, maxsize=4, directory=str(tmp_path / "no_existe"))
+    writer.submit(_frame(), CAJA, None, 1.0, on_error=lambda: perdidas.append(1))
+    assert writer.flush(5)
+    assert writer.errors == 1 and writer.saved == 0
+    assert encoladas == [] and perdidas == [1]
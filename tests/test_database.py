@@ -0,0 +1,71 @@
+# test_database.py
+# Escritor diferido de intrusos: lotes confirmados y lotes que fallan.
+import numpy as np
+
+def test_lote_confirmado_llama_al_callback(bd):
+    writer = bd.IntrusoWriter(delay=0.05)
+    ids, errores = [], []
+    for i in range(3):
+        assert writer.put(f"intruso_{i}.jpg", "2026-01-01 10:00:00", np.full(128, i / 10), 1.0,
+                          callback=ids.append, on_error=lambda: errores.append(1))
+    assert writer.flush(5)
+    assert errores == [] and writer.written == 3
+    assert sorted(ids) == sorted(r["id"] for r in bd.list_intrusos())
+
+def test_lote_fallido_llama_a_on_error(bd, monkeypatch):
+    writer = bd.IntrusoWriter(delay=0.05)
+    ids, errores = [], []
+
+    def falla(embedding):
+        raise ValueError("embedding inválido")
+
+    monkeypatch.setattr(bd, "embedding_to_blob", falla)
+    for i in range(2):
+        writer.put(f"intruso_{i}.jpg", "2026-01-01 10:00:00", np.zeros(128), 1.0,
+                   callback=ids.append, on_error=lambda i=i: errores.append(i))
+    assert writer.flush(5)
+    assert ids == [] and sorted(errores) == [0, 1]
+    assert bd.list_intrusos() == []
+
+def test_cola_llena_no_encola(bd):
+    writer = bd.IntrusoWriter(maxsize=1)
+    writer._ensure_started = lambda: None
+    assert writer.put("a.jpg", "2026-01-01 10:00:00")
+    assert not writer.put("b.jpg", "2026-01-01 10:00:00")
+    assert writer.dropped == 1
+
+def _ids_en_bd(bd):
+    return sorted(r["id"] for r in bd.list_intrusos())
+
+def test_cache_de_embeddings_sigue_a_la_bd(bd):
+    cache = bd.EMBEDDING_CACHES["intrusos"]
+    bd.add_intruso("a.jpg", "2026-01-01 10:00:00", np.full(128, 0.1), 1.0)
+    ids, matriz, _ = cache.rebuild()
+    assert list(ids) == _ids_en_bd(bd)
+    # los altas posteriores se añaden en su sitio, sin reconstruir
+    nuevo = bd.add_intruso("b.jpg", "2026-01-01 10:00:01", np.full(128, 0.2), 2.0)
+    ids, matriz, _ = cache.load()
+    assert list(ids) == _ids_en_bd(bd)
+    assert np.allclose(matriz[list(ids).index(nuevo)], 0.2)
+
+def test_borrado_en_bloque_compacta_la_cache(bd, monkeypatch):
+    cache = bd.EMBEDDING_CACHES["intrusos"]
+    ids = [bd.add_intruso(f"{i}.jpg", "2026-01-01 10:00:00", np.full(128, i / 100), 1.0) for i in range(20)]
+    cache.rebuild()
+    reconstrucciones = []
+    monkeypatch.setattr(cache, "rebuild", lambda: reconstrucciones.append(1))
+    bd.delete_intrusos(ids[:5] + ids[12:14], remove_files=False)
+    en_cache, matriz, _ = cache.load()
+    assert reconstrucciones == []
+    assert sorted(en_cache) == _ids_en_bd(bd)
+    for iid, fila in zip(en_cache, matriz):
+        assert np.allclose(fila, ids.index(iid) / 100)
+
+def test_muestras_de_una_persona_inexistente(bd):
+    pid, ids = bd.add_persona_muestras("ana", [("ana_1.jpg", np.full(128, 0.1))])
+    assert pid is not None and len(ids) == 1
+    assert bd.get_persona(pid)["id"] == pid
+    pid2, ids2 = bd.add_persona_muestras("ana", [("ana_2.jpg", np.full(128, 0.2))], persona_id=pid)
+    assert pid2 == pid and len(ids2) == 1
+    assert bd.add_persona_muestras("luis", [("luis.jpg", np.full(128, 0.3))], persona_id=pid + 99) == (None, [])
+    assert sorted(r["filename"] for r in bd.list_autorizados()) == ["ana_1.jpg", "ana_2.jpg"]
@@ -0,0 +1,111 @@
+# test_fuentes.py
+# MjpegClient contra un MjpegServer local que sirve una carpeta de imágenes.
+import time
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from fuentes import ImageDirSource, MjpegClient, MjpegServer
+
+@pytest.fixture
+def carpeta(tmp_path):
+    for i in range(3):
+        frame = np.full((48, 64, 3), 60 * i, dtype=np.uint8)
+        cv2.imwrite(str(tmp_path / f"{i:03d}.jpg"), frame)
+    return str(tmp_path)
+
+def _servidor(carpeta, port=0):
+    return MjpegServer(ImageDirSource(carpeta, fps=50, loop=True), host="127.0.0.1", port=port).start()
+
+def test_lee_frames_del_servidor(carpeta):
+    server = _servidor(carpeta)
+    client = MjpegClient(f"http://127.0.0.1:{server.port}/stream", timeout=2)
+    try:
+        data = client.read_jpeg()
+        assert data.startswith(b"\xff\xd8")
+        ok, frame = client.read()
+        assert ok and frame.shape[2] == 3
+        assert client.health["estado"] == "conectado"
+        assert client.health["frames"] == 2
+        assert client.health["reconexiones"] == 0 and client.health["fallos"] == 0
+    finally:
+        client.release()
+        server.stop()
+    assert client.health["estado"] == "desconectado"
+
+def test_reconecta_cuando_el_servidor_vuelve(carpeta):
+    server = _servidor(carpeta)
+    port = server.port
+    client = MjpegClient(f"http://127.0.0.1:{port}/stream", timeout=2, backoff_min=0.05, backoff_max=0.2)
+    try:
+        assert client.read_jpeg() is not None
+        server.stop()
+        nuevo = []
+        # el servidor vuelve en el mismo puerto mientras el cliente reintenta
+        t = threading.Timer(0.5, lambda: nuevo.append(_servidor(carpeta, port)))
+        t.start()
+        # los frames que quedaron en el socket se leen antes de notar la caída
+        deadline = time.monotonic() + 5
+        while client.health["reconexiones"] == 0 and time.monotonic() < deadline:
+            data = client.read_jpeg()
+        t.join()
+        assert data is not None
+        assert client.health["reconexiones"] == 1
+        assert client.read_jpeg() is not None
+        assert client.health["estado"] == "conectado"
+        assert client.health["ultimo_error"] is None and client.health["fallos"] == 0
+    finally:
+        client.release()
+        for s in nuevo:
+            s.stop()
+
+def test_sin_servidor_informa_el_error_y_release_lo_detiene(carpeta):
+    server = _servidor(carpeta)
+    port = server.port
+    server.stop()
+    client = MjpegClient(f"http://127.0.0.1:{port}/stream", timeout=1, backoff_min=0.05, backoff_max=0.1)
+    result = []
+    t = threading.Thread(target=lambda: result.append(client.read_jpeg()))
+    t.start()
+    deadline = time.monotonic() + 5
+    while client.health["fallos"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert client.health["estado"] == "reconectando"
+    assert client.health["ultimo_error"]
+    # sin llegar a conectar no hay reconexiones
+    assert client.health["reconexiones"] == 0
+    client.release()
+    t.join(5)
+    assert not t.is_alive()
+    assert result == [None]
+
+class FuenteContada:
+    # fuente infinita que detecta lecturas después de liberarla
+    def __init__(self):
+        self.liberada = False
+        self.lecturas_tras_liberar = 0
+
+    def read_bytes(self):
+        if self.liberada:
+            self.lecturas_tras_liberar += 1
+        time.sleep(0.001)
+        return b"\xff\xd8jpeg"
+
+    def release(self):
+        self.liberada = True
+
+def test_stop_libera_la_fuente_cuando_el_productor_termina():
+    for _ in range(10):
+        fuente = FuenteContada()
+        server = MjpegServer(fuente, host="127.0.0.1", port=0).start()
+        server.stop()
+        assert fuente.liberada
+        assert not server._producer.is_alive()
+        assert fuente.lecturas_tras_liberar == 0
+
+def test_stop_sin_arrancar_libera_la_fuente():
+    fuente = FuenteContada()
+    MjpegServer(fuente, host="127.0.0.1", port=0).stop()
+    assert fuente.liberada
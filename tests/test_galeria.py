@@ -0,0 +1,188 @@
+# test_galeria.py
+# La galería vectorizada debe dar el mismo vecino y margen que una búsqueda por fuerza bruta.
+import time
+
+import numpy as np
+
+from galeria import EMBEDDING_DIM, Gallery, IntrusoIndex, person_template
+
+def _bruta(consulta, keys, names, matrix, tol, personas=None):
+    personas = names if personas is None else personas
+    d = np.linalg.norm(matrix.astype(np.float64) - consulta, axis=1)
+    best = int(np.argmin(d))
+    if d[best] > tol:
+        return None
+    otros = [d[i] for i in range(len(keys)) if personas[i] != personas[best]]
+    margen = (min(otros) if otros else np.inf) - d[best]
+    return keys[best], names[best], d[best], margen
+
+def _galeria(rng, personas=20, por_persona=4):
+    centros = rng.normal(0, 0.12, (personas, EMBEDDING_DIM))
+    keys, names, filas = [], [], []
+    for p in range(personas):
+        for i in range(por_persona):
+            keys.append(p * por_persona + i)
+            names.append(f"persona{p}")
+            filas.append(centros[p] + rng.normal(0, 0.02, EMBEDDING_DIM))
+    return centros, keys, names, np.array(filas, dtype=np.float32)
+
+def _comparar(g, consultas, keys, names, matrix, tol, personas=None):
+    for consulta, m in zip(consultas, g.match(consultas, tol)):
+        esperado = _bruta(consulta, keys, names, matrix, tol, personas)
+        if esperado is None:
+            assert m is None
+            continue
+        key, name, dist, margen = esperado
+        assert (m.key, m.name) == (key, name)
+        assert abs(m.distance - dist) < 1e-3
+        assert abs(m.margin - margen) < 1e-3
+
+def test_match_igual_que_fuerza_bruta():
+    rng = np.random.default_rng(0)
+    centros, keys, names, matrix = _galeria(rng)
+    g = Gallery()
+    g.load(keys, names, matrix)
+    consultas = np.vstack([centros + rng.normal(0, 0.03, centros.shape), rng.normal(0, 0.5, (5, EMBEDDING_DIM))])
+    _comparar(g, consultas, keys, names, matrix, 0.5)
+
+def test_match_tras_quitar_y_agregar_filas():
+    rng = np.random.default_rng(1)
+    centros, keys, names, matrix = _galeria(rng, personas=6)
+    g = Gallery(capacity=4)
+    g.load(keys, names, matrix)
+    for key in (0, 9, 23):
+        assert g.remove(key)
+    assert not g.remove(9)
+    nueva = (centros[2] + 0.5).astype(np.float32)
+    g.add(100, "persona9", nueva)
+    vivas = [i for i, k in enumerate(keys) if k not in (0, 9, 23)]
+    keys2 = [keys[i] for i in vivas] + [100]
+    names2 = [names[i] for i in vivas] + ["persona9"]
+    matrix2 = np.vstack([matrix[vivas], nueva[None, :]])
+    assert len(g) == len(keys2)
+    assert 9 not in g and 100 in g
+    _comparar(g, np.vstack([centros, nueva]), keys2, names2, matrix2, 0.6)
+
+def test_set_people_reemplaza_las_filas_de_cada_persona():
+    rng = np.random.default_rng(3)
+    centros = rng.normal(0, 0.12, (3, EMBEDDING_DIM)).astype(np.float32)
+    g = Gallery()
+    g.set_people([(p, f"persona{p}", person_template(centros[p] + rng.normal(0, 0.02, (6, EMBEDDING_DIM))))
+                  for p in range(3)])
+    assert g.match(centros, 0.5)[1].key[0] == 1
+    # la persona 1 cambia de plantilla: sus filas viejas desaparecen
+    g.set_people([(1, "persona1", centros[2:3] + 0.4)])
+    m0, m1, m2 = g.match(centros, 0.5)
+    assert m0.key[0] == 0 and m2.key[0] == 2 and m1 is None
+    assert (1, 1) not in g and (1, 0) in g
+    g.remove_person(1)
+    assert (1, 0) not in g
+
+def test_homonimos_son_identidades_distintas():
+    rng = np.random.default_rng(5)
+    # cada persona tiene cerca a un homónimo
+    centros = rng.normal(0, 0.12, (4, EMBEDDING_DIM)).astype(np.float32)
+    centros[1] = centros[0] + 0.03
+    centros[3] = centros[2] + 0.03
+    nombres = ["ana", "ana", "luis", "luis"]
+    g = Gallery()
+    g.set_people([(p, nombres[p], centros[p:p + 1]) for p in range(4)])
+    (m,) = g.match(centros[:1] + 0.001, 0.9)
+    assert m.key == (0, 0) and m.name == "ana"
+    # la otra "ana" cuenta como identidad distinta para el margen
+    keys = [(p, 0) for p in range(4)]
+    _comparar(g, centros + rng.normal(0, 0.01, centros.shape), keys, nombres, centros, 0.9, personas=[0, 1, 2, 3])
+
+def test_labels_de_personas_borradas_se_liberan():
+    g = Gallery()
+    emb = np.eye(3, EMBEDDING_DIM, dtype=np.float32)
+    for p in range(3):
+        g.set_person(p, f"persona{p}", emb[p:p + 1])
+    g.remove_person(0)
+    g.remove_person(1)
+    assert set(g._label_ids) == {2}
+    # un nombre nuevo para la misma persona se muestra en lugar del viejo
+    g.set_person(2, "renombrada", emb[2:3])
+    g.set_person(7, "otra", emb[0:1])
+    assert len(g._identities) == 3 and set(g._label_ids) == {2, 7}
+    assert [m.name for m in g.match(emb[[2, 0]], 0.1)] == ["renombrada", "otra"]
+
+def test_plantilla_de_persona():
+    rng = np.random.default_rng(4)
+    muestras = rng.normal(0, 0.1, (20, EMBEDDING_DIM))
+    plantilla = person_template(muestras)
+    assert plantilla.dtype == np.float32
+    # centroide más los prototipos
+    assert np.allclose(plantilla[0], muestras.mean(axis=0), atol=1e-5)
+    assert 2 <= len(plantilla) <= 20
+    assert person_template(muestras[:1]).shape == (1, EMBEDDING_DIM)
+    assert len(person_template(muestras[:2])) == 3
+
+def test_margen_infinito_con_una_sola_identidad():
+    g = Gallery()
+    emb = np.zeros((2, EMBEDDING_DIM), dtype=np.float32)
+    emb[1, 0] = 0.1
+    g.load([1, 2], ["ana", "ana"], emb)
+    (m,) = g.match(emb[:1], 0.5)
+    assert m.name == "ana" and m.distance < 1e-3
+    assert m.margin == np.inf
+
+def test_galeria_vacia():
+    g = Gallery()
+    assert g.match(np.zeros((3, EMBEDDING_DIM)), 0.5) == [None, None, None]
+    assert g.match(np.zeros((0, EMBEDDING_DIM)), 0.5) == []
+
+def test_indice_de_intrusos_igual_que_fuerza_bruta():
+    # con el IVF entrenado, un casi-duplicado cae en la lista de su original
+    rng = np.random.default_rng(2)
+    datos = rng.normal(0, 0.1, (3000, EMBEDDING_DIM)).astype(np.float32)
+    idx = IntrusoIndex(train_min=1024)
+    for i, e in enumerate(datos):
+        idx.add(e, key=i)
+    consultas = datos[:50] + rng.normal(0, 0.002, (50, EMBEDDING_DIM)).astype(np.float32)
+    for q in consultas:
+        d = np.linalg.norm(datos - q, axis=1)
+        dist, key = idx.nearest(q)
+        assert key == int(np.argmin(d))
+        assert abs(dist - d.min()) < 1e-3
+    lejos = np.full(EMBEDDING_DIM, 5.0, dtype=np.float32)
+    assert not idx.contains_near(lejos, 0.6)
+    assert idx.remove(0)
+    assert len(idx) == len(datos) - 1
+    dist, key = idx.nearest(datos[0])
+    assert key != 0 and dist > 0
+
+def test_indice_de_intrusos_descarta_fuera_de_la_ventana():
+    idx = IntrusoIndex(retention_seconds=3600)
+    ahora = time.time()
+    viejo, nuevo = np.zeros(EMBEDDING_DIM), np.full(EMBEDDING_DIM, 0.1)
+    idx.load([1, 2], [viejo, nuevo], [ahora - 7200, ahora - 60])
+    assert len(idx) == 1
+    assert not idx.contains_near(viejo, 0.1)
+    assert idx.nearest(nuevo) == (0.0, 2)
+    # el alta de otro intruso hace avanzar la ventana
+    idx.add(np.full(EMBEDDING_DIM, 0.3), ts=ahora + 3600, key=3)
+    assert len(idx) == 1 and idx.nearest(nuevo)[1] == 3
+
+def test_indice_de_intrusos_asigna_la_clave_despues():
+    idx = IntrusoIndex()
+    token = idx.add(np.zeros(EMBEDDING_DIM))
+    assert idx.nearest(np.zeros(EMBEDDING_DIM)) == (0.0, None)
+    idx.set_key(token, 42)
+    assert idx.nearest(np.zeros(EMBEDDING_DIM)) == (0.0, 42)
+    assert idx.remove(42) and len(idx) == 0
+    assert idx.nearest(np.zeros(EMBEDDING_DIM)) is None
+
+def test_token_viejo_no_toca_la_fila_reutilizada():
+    idx = IntrusoIndex(retention_seconds=3600)
+    ahora = time.time()
+    viejo = idx.add(np.zeros(EMBEDDING_DIM), ts=ahora - 7200)
+    # el alta siguiente hace caducar al primero y la otra ocupa su fila
+    idx.add(np.full(EMBEDDING_DIM, 0.5), ts=ahora)
+    nuevo = idx.add(np.full(EMBEDDING_DIM, 0.1), ts=ahora)
+    assert nuevo[0] == viejo[0] and len(idx) == 2
+    idx.set_key(viejo, 1)
+    idx.remove_row(viejo)
+    assert len(idx) == 2 and 1 not in idx
+    idx.set_key(nuevo, 2)
+    assert idx.nearest(np.full(EMBEDDING_DIM, 0.1))[1] == 2
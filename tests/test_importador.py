@@ -0,0 +1,103 @@
+# test_importador.py
+# Importación masiva: nombres desde archivo o CSV, recorrido de carpetas y ZIP, e
+# inserción en una sola transacción. La codificación se sustituye por una falsa
+# que corre en hilos (los procesos del pool no verían el monkeypatch).
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import importador
+
+class _Hilos(ThreadPoolExecutor):
+    def __init__(self, max_workers=None, mp_context=None):
+        super().__init__(max_workers)
+
+def _codificar(data, destino):
+    # "rostro" según el contenido del archivo de prueba
+    texto = data.decode()
+    if texto == "ok":
+        if destino:
+            with open(destino, "wb") as f:
+                f.write(data)
+        return "ok", np.full(128, 0.1)
+    return texto, None
+
+@pytest.fixture
+def falso(monkeypatch):
+    monkeypatch.setattr(importador, "ProcessPoolExecutor", _Hilos)
+    monkeypatch.setattr(importador, "codificar_imagen", _codificar)
+
+def _fuentes(contenidos):
+    return [(archivo, lambda d=data: d.encode()) for archivo, data in contenidos.items()]
+
+def test_nombre_desde_archivo():
+    assert importador.nombre_desde_archivo("fotos/juan_perez_2.jpg") == "juan perez"
+    assert importador.nombre_desde_archivo("ana-maria.png") == "ana maria"
+    assert importador.nombre_desde_archivo("luis 10.jpeg") == "luis"
+
+def test_csv_de_nombres():
+    nombres = importador.leer_csv_nombres("archivo,nombre\n./sub/a.jpg,Ana\nb.jpg,\n,Luis\nc.jpg,Carla\n")
+    assert nombres == {"sub/a.jpg": "Ana", "c.jpg": "Carla"}
+    assert importador.nombre_en_csv(nombres, os.path.join("sub", "a.jpg")) == "Ana"
+    # mismo archivo en otra carpeta: no es la misma persona
+    assert importador.nombre_en_csv(nombres, "otra/a.jpg") is None
+    # ZIP con carpeta raíz; CSV con solo el nombre del archivo
+    assert importador.nombre_en_csv(nombres, "personal/sub/a.jpg") == "Ana"
+    assert importador.nombre_en_csv(nombres, "x/y/c.jpg") == "Carla"
+
+def test_fuentes_de_carpeta_y_zip(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("a.jpg", "sub/b.PNG", "notas.txt", ".oculta.jpg"):
+        (tmp_path / name).write_bytes(name.encode())
+    fuentes = dict(importador.fuentes_carpeta(str(tmp_path)))
+    assert sorted(fuentes) == ["a.jpg", os.path.join("sub", "b.PNG")]
+    assert fuentes["a.jpg"]() == b"a.jpg"
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("x/c.jpg", b"c")
+        zf.writestr("x/", b"")
+        zf.writestr("leeme.md", b"")
+    with zipfile.ZipFile(buf) as zf:
+        assert [(n, leer()) for n, leer in importador.fuentes_zip(zf)] == [("x/c.jpg", b"c")]
+
+def test_dry_run_no_escribe(falso, bd):
+    job = importador.importar(_fuentes({"ana_1.jpg": "ok", "luis.jpg": "sin_rostro"}), workers=2, dry_run=True)
+    assert job.terminado and job.total == 2 and job.importados == 1
+    assert [r["estado"] for r in job.reporte] == ["ok", "sin_rostro"]
+    assert bd.list_autorizados() == []
+
+def test_importa_en_una_transaccion(falso, bd):
+    os.makedirs(importador.DATA_AUT)
+    commits = []
+    fuentes = _fuentes({"ana_1.jpg": "ok", "ana_2.jpg": "ok", "grupo.jpg": "varios_rostros", "luis.jpg": "ok"})
+    job = importador.importar(fuentes, workers=2, on_commit=lambda: commits.append(len(bd.list_autorizados())))
+    assert job.importados == 3 and len(job.fallos()) == 1
+    filas = bd.list_autorizados()
+    assert sorted(r["nombre"] for r in filas) == ["ana", "ana", "luis"]
+    assert all(os.path.exists(os.path.join(importador.DATA_AUT, r["filename"])) for r in filas)
+    # on_commit corre una sola vez, con las filas ya confirmadas
+    assert commits == [3]
+
+def test_csv_sin_nombre_no_se_codifica(falso, bd):
+    job = importador.importar(_fuentes({"a.jpg": "ok", "b.jpg": "ok"}), {"a.jpg": "Ana"}, workers=1, dry_run=True)
+    assert {r["archivo"]: r["estado"] for r in job.reporte} == {"a.jpg": "ok", "b.jpg": "sin_nombre"}
+
+def test_importaciones_terminadas_se_olvidan(monkeypatch):
+    monkeypatch.setattr(importador, "_jobs", {})
+    monkeypatch.setattr(importador, "IMPORT_JOBS_MAX", 2)
+    ahora = 1_000_000.0
+    jobs = []
+    for i, terminado in enumerate([True, True, False, True]):
+        job = importador.ImportJob("x.zip")
+        job.inicio, job.duracion, job.terminado = ahora - 100 + i, 1.0, terminado
+        importador._jobs[job.id] = job
+        jobs.append(job)
+    importador._podar_jobs(ahora)
+    # sobran dos: se van las terminadas más viejas, la que sigue en curso se queda
+    assert set(importador._jobs) == {jobs[2].id, jobs[3].id}
+    importador._podar_jobs(ahora + importador.IMPORT_JOB_TTL)
+    assert set(importador._jobs) == {jobs[2].id}
@@ -0,0 +1,397 @@
+# test_reconocimiento.py
+# Seguimiento de rostros entre frames (asociación por IoU y caducidad de los tracks),
+# compuerta de movimiento, controlador del detector, deduplicación de intrusos y bus de eventos.
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+import reconocimiento as rc
+import capturas
+from capturas import SnapshotWriter
+from galeria import EMBEDDING_DIM, IntrusoIndex
+
+CAJA = (20, 60, 80, 20)
+
+class DetectorFijo:
+    # devuelve las cajas de `cajas` (una lista por llamada; la última se repite)
+    def __init__(self, *cajas):
+        self.cajas = list(cajas)
+        self.llamadas = 0
+        self.rois = []
+
+    def detect(self, rgb, rois=None):
+        self.llamadas += 1
+        self.rois.append(rois)
+        return list(self.cajas[min(self.llamadas, len(self.cajas)) - 1])
+
+def _frame():
+    return np.zeros((120, 160, 3), dtype=np.uint8)
+
+@pytest.fixture(autouse=True)
+def sin_tracker_opencv(monkeypatch):
+    monkeypatch.setattr(rc, "TRACK_OPENCV", False)
+
+def test_importar_no_carga_los_modelos(tmp_path):
+    # dlib solo se importa en los procesos del pool
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", "import sys, reconocimiento, importador, calidad, servidor; "
+                          "print('face_recognition' in sys.modules)"],
+                         cwd=tmp_path, env=dict(os.environ, PYTHONPATH=raiz), capture_output=True, text=True,
+                         timeout=60)
+    assert out.stdout.strip().splitlines()[-1] == "False", out.stderr
+
+def _update(tracker, det, motion_rois=None):
+    return tracker.update(_frame(), _frame(), motion_rois, detector=det)
+
+def test_track_se_mantiene_mientras_se_detecta():
+    det = DetectorFijo([CAJA])
+    tracker = rc.FaceTracker()
+    ids = set()
+    for _ in range(4 * rc.TRACK_MAX_AGE):
+        _, tracks, _ = _update(tracker, det)
+        ids.update(t.id for t in tracks)
+        assert len(tracks) == 1
+    assert ids == {1}
+
+def test_solo_se_codifican_tracks_nuevos_o_dudosos():
+    det = DetectorFijo([CAJA])
+    tracker = rc.FaceTracker()
+    _, tracks, pending = _update(tracker, det)
+    assert pending == tracks
+    for _ in range(rc.TRACK_MIN_VOTES):
+        tracks[0].vote(None, np.zeros(128), tracker.frame_idx)
+    # en la detección siguiente el track ya tiene votos suficientes y coherentes
+    while det.llamadas < 2:
+        _, tracks, pending = _update(tracker, det)
+    assert tracks and pending == []
+
+def test_track_caduca_sin_detecciones():
+    det = DetectorFijo([CAJA], [])
+    tracker = rc.FaceTracker()
+    _update(tracker, det)
+    for _ in range(rc.TRACK_MAX_AGE):
+        _, tracks, _ = _update(tracker, det)
+        assert len(tracks) == 1
+    # se descarta en la siguiente detección pasado TRACK_MAX_AGE
+    for _ in range(rc.TRACK_DETECT_EVERY):
+        _, tracks, _ = _update(tracker, det)
+    assert tracks == []
+
+def test_caja_lejana_abre_un_track_nuevo():
+    det = DetectorFijo([CAJA], [CAJA, (20, 150, 80, 110)])
+    tracker = rc.FaceTracker()
+    _update(tracker, det)
+    while det.llamadas < 2:
+        _, tracks, pending = _update(tracker, det)
+    assert sorted(t.id for t in tracks) == [1, 2]
+    assert [t.id for t in pending] == [1, 2]
+
+def test_escena_quieta_no_detecta():
+    det = DetectorFijo([CAJA])
+    tracker = rc.FaceTracker()
+    _update(tracker, det)
+    for _ in range(rc.TRACK_MAX_AGE):
+        _, tracks, pending = _update(tracker, det, motion_rois=[])
+        assert len(tracks) == 1 and pending == []
+    assert det.llamadas == 1
+
+def test_track_caduca_con_la_escena_quieta():
+    # sin movimiento no se detecta nada: el track no se renueva y caduca igual
+    det = DetectorFijo([CAJA])
+    tracker = rc.FaceTracker()
+    _update(tracker, det)
+    for _ in range(rc.TRACK_MAX_AGE):
+        _update(tracker, det, motion_rois=[])
+    _, tracks, _ = _update(tracker, det, motion_rois=[])
+    assert tracks == []
+    assert det.llamadas == 1
+
+def test_detecta_solo_en_las_regiones_con_movimiento():
+    det = DetectorFijo([CAJA])
+    tracker = rc.FaceTracker()
+    _, tracks, _ = _update(tracker, det, motion_rois=[(30, 50, 50, 30)])
+    assert len(tracks) == 1
+    (rois,) = det.rois
+    # la región se agranda hasta el mínimo y queda dentro del frame
+    assert rois == [(0, 80, 80, 0)]
+
+def test_movimiento_en_casi_todo_el_frame_detecta_completo():
+    det = DetectorFijo([CAJA])
+    tracker = rc.FaceTracker()
+    _update(tracker, det, motion_rois=[(0, 160, 120, 0)])
+    assert det.rois == [None]
+
+def test_regiones_solapadas_se_fusionan():
+    rois = rc._expand_rois([(10, 50, 50, 10), (40, 90, 80, 45), (10, 400, 50, 360)], (480, 640, 3), min_side=0)
+    assert sorted(rois) == [(0, 101, 90, 0), (0, 410, 60, 350)]
+
+def test_motion_detector():
+    motion = rc.MotionDetector()
+    quieto = _frame()
+    # el primer frame inicializa el fondo y se analiza entero
+    assert motion.regions(quieto) == [(0, 160, 120, 0)]
+    assert motion.regions(quieto) == []
+    assert motion.gated == 1
+    movido = quieto.copy()
+    movido[40:80, 100:140] = 255
+    (roi,) = motion.regions(movido)
+    top, right, bottom, left = roi
+    assert top <= 40 and bottom >= 80 and left <= 100 and right >= 140
+
+def test_controlador_valida_la_configuracion():
+    ctl = rc.DetectorController(backend="hog", target_ms=0)
+    with pytest.raises(ValueError):
+        ctl.configure(backend="foo")
+    assert ctl.backend == "hog"
+    ctl.configure(backend="haar", target_ms="80", level=99)
+    assert ctl.state()["backend"] == "haar"
+    assert ctl.target_ms == 80.0
+    assert ctl.level == len(rc.DETECTOR_LEVELS) - 1
+    ctl.configure(level=-3)
+    assert ctl.level == 0
+
+def test_controlador_ajusta_el_nivel_a_la_latencia():
+    ctl = rc.DetectorController(target_ms=50)
+    nivel = ctl.level
+    for _ in range(10):
+        ctl.observe(200.0)
+    assert ctl.level == nivel - 1
+    for _ in range(10):
+        ctl.observe(5.0)
+    assert ctl.level == nivel
+    # dentro del presupuesto no cambia
+    for _ in range(30):
+        ctl.observe(40.0)
+    assert ctl.level == nivel
+
+def test_controlador_sin_objetivo_no_cambia_de_nivel():
+    ctl = rc.DetectorController(target_ms=0)
+    for _ in range(50):
+        ctl.observe(1000.0)
+    assert ctl.level == rc.DETECTOR_DEFAULT_LEVEL
+    assert ctl.state()["latencia_ms"] > 900
+
+def test_controlador_detecta_en_el_pool_con_su_backend(monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(rc, "run_in_pool", lambda fn, *args: llamadas.append((fn, args)) or [CAJA])
+    ctl = rc.DetectorController(backend="haar", target_ms=0, level=0)
+    rgb = _frame()
+    assert ctl.detect(rgb) == [CAJA]
+    assert ctl.detect(rgb, [(0, 80, 80, 0)]) == [CAJA]
+    assert llamadas[0] == (rc._detect, (rgb, "haar", 0))
+    assert llamadas[1] == (rc._detect_rois, (rgb, [(0, 80, 80, 0)], "haar", 0))
+    assert ctl.latency_ms is not None
+
+def test_detectar_por_regiones_devuelve_coordenadas_del_frame(monkeypatch):
+    class Fijo:
+        def detect(self, rgb, upsample):
+            return [(1, 11, 11, 1)]
+    monkeypatch.setitem(rc._detectors, "prueba", Fijo())
+    rgb = np.zeros((200, 200, 3), dtype=np.uint8)
+    boxes = rc._detect_rois(rgb, [(0, 100, 100, 0), (100, 200, 200, 120)], "prueba", 0)
+    assert boxes == [(1, 11, 11, 1), (101, 131, 111, 121)]
+
+def test_backends_sin_modelos_no_se_ofrecen(monkeypatch, tmp_path):
+    monkeypatch.setattr(rc, "MODELS_DIR", str(tmp_path))
+    assert rc.available_backends() == ["haar", "hog"]
+    ctl = rc.DetectorController(backend="ssd", target_ms=0)
+    assert ctl.backend == "hog"
+    with pytest.raises(ValueError):
+        ctl.configure(backend="yunet")
+    assert ctl.backend == "hog"
+    (tmp_path / "lbpcascade_frontalface_improved.xml").write_text("")
+    assert "lbp" in rc.available_backends()
+
+def test_backend_que_no_carga_usa_hog(monkeypatch, tmp_path):
+    monkeypatch.setattr(rc, "MODELS_DIR", str(tmp_path))
+    monkeypatch.setattr(rc, "_detectors", {})
+    det = rc.get_detector("ssd")
+    assert det.name == "hog"
+    assert rc.get_detector("ssd") is det
+
+def test_cascada_haar_sin_rostros():
+    det = rc.CascadeDetector("haar")
+    assert det.detect(np.zeros((120, 160, 3), dtype=np.uint8), 0) == []
+
+def _emb(valor):
+    e = np.zeros(EMBEDDING_DIM)
+    e[0] = valor
+    return e
+
+@pytest.fixture
+def indice(monkeypatch):
+    idx = IntrusoIndex()
+    monkeypatch.setattr(rc, "intrusos_index", idx)
+    return idx
+
+def _writer(monkeypatch, **kwargs):
+    writer = SnapshotWriter(**kwargs)
+    monkeypatch.setattr(rc, "snapshot_writer", writer)
+    return writer
+
+def test_intruso_repetido_no_se_vuelve_a_guardar(monkeypatch, indice, tmp_path):
+    writer = _writer(monkeypatch, workers=0, maxsize=4, directory=str(tmp_path))
+    assert rc.save_intruso_if_new(_frame(), _emb(0.0), CAJA)
+    assert rc.save_intruso_if_new(_frame(), _emb(0.1), CAJA) is None
+    assert writer.pending() == 1 and len(indice) == 1
+
+def test_descarte_de_la_entrante_no_la_deja_en_el_indice(monkeypatch, indice, tmp_path):
+    _writer(monkeypatch, workers=0, maxsize=1, policy="nuevo", directory=str(tmp_path))
+    assert rc.save_intruso_if_new(_frame(), _emb(0.0), CAJA)
+    assert rc.save_intruso_if_new(_frame(), _emb(5.0), CAJA) is None
+    assert len(indice) == 1
+    assert not indice.contains_near(_emb(5.0), rc.INTRUSO_TOLERANCE)
+
+def test_desalojo_saca_la_captura_del_indice(monkeypatch, indice, tmp_path):
+    # sin hilos la cola no avanza: la segunda captura desaloja a la primera
+    writer = _writer(monkeypatch, workers=0, maxsize=1, policy="antiguo", directory=str(tmp_path))
+    assert rc.save_intruso_if_new(_frame(), _emb(0.0), CAJA)
+    assert rc.save_intruso_if_new(_frame(), _emb(5.0), CAJA)
+    assert writer.dropped == 1
+    assert len(indice) == 1
+    assert not indice.contains_near(_emb(0.0), rc.INTRUSO_TOLERANCE)
+    assert indice.contains_near(_emb(5.0), rc.INTRUSO_TOLERANCE)
+    # el intruso desalojado se vuelve a capturar en vez de quedar deduplicado
+    assert rc.save_intruso_if_new(_frame(), _emb(0.0), CAJA)
+
+def test_error_de_disco_saca_la_captura_del_indice(monkeypatch, indice, tmp_path):
+    writer = _writer(monkeypatch, workers=1, maxsize=4, directory=str(tmp_path / "no_existe"))
+    assert rc.save_intruso_if_new(_frame(), _emb(0.0), CAJA)
+    assert writer.flush(5)
+    assert writer.errors == 1
+    assert len(indice) == 0
+
+def test_cola_de_bd_llena_saca_la_captura_y_sus_archivos(monkeypatch, indice, tmp_path):
+    monkeypatch.setattr(capturas.database, "queue_intruso", lambda *args, **kwargs: False)
+    writer = _writer(monkeypatch, workers=1, maxsize=4, directory=str(tmp_path))
+    assert rc.save_intruso_if_new(_frame(), _emb(0.0), CAJA)
+    assert writer.flush(5)
+    assert writer.dropped == 1 and writer.saved == 0
+    assert len(indice) == 0
+    assert capturas.database.file_remover.flush(5)
+    assert os.listdir(tmp_path) == []
+
+def test_bus_filtra_por_camara():
+    bus = rc.EventBus()
+    todas, cam2 = bus.subscribe(), bus.subscribe(camara=2)
+    bus.publish("intruso", camara=1)
+    bus.publish("autorizado", camara=2, nombre="ana")
+    assert [e["camara"] for e in todas.get(0)] == [1, 2]
+    (evento,) = cam2.get(0)
+    assert evento["tipo"] == "autorizado" and evento["nombre"] == "ana" and evento["id"] == 2
+
+def test_bus_repite_lo_perdido_al_reconectar():
+    bus = rc.EventBus(history=3)
+    for i in range(5):
+        bus.publish("intruso", camara=1, n=i)
+    sub = bus.subscribe(last_id=3)
+    assert [e["id"] for e in sub.get(0)] == [4, 5]
+    # más allá del historial solo queda lo que se conserva
+    assert [e["id"] for e in bus.subscribe(last_id=0).get(0)] == [3, 4, 5]
+
+def test_cliente_lento_pierde_los_eventos_mas_viejos():
+    bus = rc.EventBus(maxsize=2)
+    sub = bus.subscribe()
+    for i in range(5):
+        bus.publish("intruso", n=i)
+    assert [e["n"] for e in sub.get(0)] == [3, 4]
+    assert bus.stats() == {"clientes": 1, "publicados": 5, "descartados": 3}
+    bus.unsubscribe(sub)
+    assert bus.stats()["clientes"] == 0 and bus.stats()["descartados"] == 3
+
+def test_cerrar_despierta_al_que_espera():
+    bus = rc.EventBus()
+    sub = bus.subscribe()
+    resultado = []
+    t = threading.Thread(target=lambda: resultado.append(sub.get(10)))
+    t.start()
+    bus.unsubscribe(sub)
+    t.join(2)
+    assert not t.is_alive() and resultado == [[]] and sub.closed
+    assert sub.get(0.01) == []
+
+@pytest.fixture
+def carpeta(tmp_path):
+    for i in range(3):
+        cv2.imwrite(str(tmp_path / f"{i:03d}.jpg"), np.full((48, 64, 3), 60 * i, dtype=np.uint8))
+    return f"{tmp_path}?fps=100&loop=1"
+
+def _esperar(condicion, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+def test_un_error_de_reconocimiento_no_mata_al_worker(monkeypatch, carpeta):
+    llamadas = []
+
+    def process_frame(frame, *args, **kwargs):
+        llamadas.append(1)
+        if len(llamadas) % 2:
+            raise RuntimeError("pool caído")
+        return frame
+
+    monkeypatch.setattr(rc, "process_frame", process_frame)
+    worker = rc.CameraWorker(99, carpeta)
+    worker.start()
+    try:
+        assert _esperar(lambda: worker.stats["publicados"] >= 3)
+        assert worker.stats["errores_reconocimiento"] >= 2
+        assert worker.is_alive()
+    finally:
+        worker.stop()
+    assert _esperar(lambda: not any(t.is_alive() for t in worker._threads))
+
+def test_decodificacion_reducida_mantiene_la_resolucion(monkeypatch):
+    _, jpeg = cv2.imencode(".jpg", np.zeros((96, 128, 3), dtype=np.uint8))
+
+    class Fuente:
+        reduce = 2
+
+        def isOpened(self):
+            return True
+
+        def read_jpeg(self):
+            time.sleep(0.01)
+            return jpeg.tobytes()
+
+        def release(self):
+            pass
+
+    def process_frame(frame, *args, annotations=None, **kwargs):
+        # la mitad de los frames con una caja que dibujar
+        if len(publicados) % 2:
+            annotations.append({"autorizado": True, "box": CAJA, "label": "x"})
+        return frame
+
+    publicados = []
+    monkeypatch.setattr(rc, "open_source", lambda url, stop_event=None: Fuente())
+    monkeypatch.setattr(rc, "process_frame", process_frame)
+    worker = rc.CameraWorker(99, "http://camara")
+    worker.modes["anotado"] = 1
+    worker.buffer.publish = lambda jpeg, raw, frames, meta: publicados.append((jpeg, meta))
+    worker.start()
+    try:
+        assert _esperar(lambda: len(publicados) >= 6)
+    finally:
+        worker.stop()
+    assert any(meta["anotaciones"] for _, meta in publicados)
+    assert any(not meta["anotaciones"] for _, meta in publicados)
+    for jpeg_publicado, meta in publicados:
+        assert rc.decode_jpeg(jpeg_publicado).shape[:2] == (48, 64) == (meta["h"], meta["w"])
+
+def test_worker_con_una_etapa_muerta_no_esta_vivo(carpeta):
+    worker = rc.CameraWorker(99, carpeta)
+    worker._threads[1] = threading.Thread(target=lambda: None)
+    worker.start()
+    try:
+        assert _esperar(lambda: not worker._threads[1].is_alive())
+        assert not worker.is_alive()
+    finally:
+        worker.stop()
@@ -0,0 +1,78 @@
+# test_retencion.py
+# Retención del historial de intrusos: límites por antigüedad y por tamaño, archivado
+# en zips diarios y borrado de los archivos.
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import retencion
+
+TAMANO = 100_000
+
+@pytest.fixture
+def intrusos(bd, monkeypatch):
+    # 10 intrusos, uno por día hasta ayer, con 100 KB de archivos cada uno
+    monkeypatch.setattr(retencion, "RETENCION_PAUSA", 0)
+    os.makedirs(retencion.DATA_INT)
+    hoy = datetime.now().replace(microsecond=0)
+    ids = []
+    for i in range(10):
+        fecha = hoy - timedelta(days=10 - i)
+        nombre = f"intruso_{i}.jpg"
+        with open(os.path.join(retencion.DATA_INT, nombre), "wb") as f:
+            f.write(b"x" * TAMANO)
+        ids.append(bd.add_intruso(nombre, fecha.strftime("%Y-%m-%d %H:%M:%S")))
+    return ids
+
+def _archivos():
+    assert retencion.database.file_remover.flush(5)
+    return sorted(os.listdir(retencion.DATA_INT))
+
+def test_dry_run_no_borra(intrusos):
+    informe = retencion.ejecutar(dias=5.5, max_mb=0, dry_run=True)
+    assert informe["filas"] == 5 and informe["bytes"] == 5 * TAMANO
+    assert informe["medidas"] == 10
+    assert len(informe["dias"]) == 5
+    assert informe["filas_restantes"] == 10
+    assert len(_archivos()) == 10
+
+def test_borra_por_antiguedad(intrusos):
+    informe = retencion.ejecutar(dias=5.5, max_mb=0)
+    assert informe["filas"] == 5
+    assert informe["filas_restantes"] == 5
+    assert [r["id"] for r in retencion.database.intrusos_mas_antiguos(100)] == intrusos[5:]
+    assert _archivos() == [f"intruso_{i}.jpg" for i in range(5, 10)]
+
+def test_borra_los_mas_viejos_hasta_bajar_del_limite(intrusos):
+    informe = retencion.ejecutar(dias=0, max_mb=0.5)
+    assert informe["filas"] == 5
+    assert informe["bytes_restantes"] <= 0.5 * 1024 * 1024
+    assert _archivos() == [f"intruso_{i}.jpg" for i in range(5, 10)]
+
+def test_sin_limites_no_hace_nada(intrusos):
+    informe = retencion.ejecutar(dias=0, max_mb=0)
+    assert informe["filas"] == 0 and informe["filas_restantes"] == 10
+
+def test_lotes_encadenados(intrusos, monkeypatch):
+    monkeypatch.setattr(retencion, "RETENCION_LOTE", 3)
+    lotes = list(retencion.candidatos(dias=3.5, max_mb=0))
+    assert [len(l) for l in lotes] == [3, 3, 1]
+    assert [r["id"] for l in lotes for r in l] == intrusos[:7]
+
+def test_archiva_antes_de_borrar(intrusos):
+    informe = retencion.ejecutar(dias=7.5, max_mb=0, archivar_antes=True)
+    assert informe["filas"] == 3 and informe["archivado"] == 3 * TAMANO
+    zips = sorted(os.listdir(retencion.DATA_ARCHIVO))
+    assert len(zips) == 3
+    with zipfile.ZipFile(os.path.join(retencion.DATA_ARCHIVO, zips[0])) as zf:
+        nombres = zf.namelist()
+        assert "intruso_0.jpg" in nombres
+        manifiesto = [n for n in nombres if n.startswith("manifiesto_")]
+        assert len(manifiesto) == 1
+        assert b"intruso_0.jpg" in zf.read(manifiesto[0])
+
+def test_una_sola_ejecucion_a_la_vez(intrusos):
+    with retencion._lock:
+        assert retencion.ejecutar(dias=1) == {"error": "ya hay una ejecución en curso"}
@@ -0,0 +1,152 @@
+# test_servidor.py
+# Servidor asyncio contra una app Flask mínima: peticiones WSGI con keep-alive, cuerpos,
+# límites por IP y el stream de /eventos.
+import sys
+import types
+import socket
+import asyncio
+import threading
+import http.client
+
+import pytest
+from flask import Flask, request, session
+
+import reconocimiento as rc
+import servidor
+
+def _app():
+    app = Flask(__name__)
+    app.secret_key = "prueba"
+
+    @app.route("/hola")
+    def hola():
+        return "hola"
+
+    @app.route("/eco", methods=["POST"])
+    def eco():
+        return request.get_data()
+
+    @app.route("/entrar")
+    def entrar():
+        session["usuario"] = "admin"
+        return "ok"
+
+    @app.route("/eventos")
+    def eventos():
+        return "sin sesión", 401
+
+    return app
+
+@pytest.fixture
+def srv(monkeypatch):
+    # los streams consultan app.stream_args(); /eventos no lo usa
+    monkeypatch.setitem(sys.modules, "app", types.ModuleType("app"))
+    s = servidor.Servidor(_app(), "127.0.0.1", 0, threads=4)
+    ready = threading.Event()
+
+    def run():
+        try:
+            asyncio.run(s.serve(ready))
+        except asyncio.CancelledError:
+            pass
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    assert ready.wait(5)
+    yield s
+
+    def cancelar():
+        for task in asyncio.all_tasks(s.loop):
+            task.cancel()
+    s.loop.call_soon_threadsafe(cancelar)
+    t.join(5)
+
+def _conn(s):
+    return http.client.HTTPConnection("127.0.0.1", s.port, timeout=5)
+
+def test_peticiones_wsgi_en_la_misma_conexion(srv):
+    conn = _conn(srv)
+    for _ in range(3):
+        conn.request("GET", "/hola")
+        resp = conn.getresponse()
+        assert resp.status == 200 and resp.read() == b"hola"
+        assert resp.getheader("Connection") == "keep-alive"
+    conn.request("HEAD", "/hola")
+    resp = conn.getresponse()
+    assert resp.status == 200 and resp.read() == b""
+    conn.close()
+
+def test_cuerpo_de_la_peticion(srv):
+    conn = _conn(srv)
+    cuerpo = bytes(range(256)) * 1000
+    conn.request("POST", "/eco", body=cuerpo)
+    resp = conn.getresponse()
+    assert resp.status == 200 and resp.read() == cuerpo
+    conn.close()
+
+def test_cuerpo_demasiado_grande(srv, monkeypatch):
+    monkeypatch.setattr(servidor, "MAX_BODY", 10)
+    conn = _conn(srv)
+    conn.request("POST", "/eco", body=b"x" * 100)
+    resp = conn.getresponse()
+    assert resp.status == 413
+    assert resp.getheader("Connection") == "close"
+    conn.close()
+
+def test_transfer_encoding_se_rechaza_y_cierra(srv):
+    sock = socket.create_connection(("127.0.0.1", srv.port), timeout=5)
+    # el cuerpo chunked lleva dentro otra petición que no debe atenderse
+    sock.sendall(b"POST /eco HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+                 b"0\r\n\r\nGET /hola HTTP/1.1\r\nHost: x\r\n\r\n")
+    recibido = b""
+    while chunk := sock.recv(4096):
+        recibido += chunk
+    sock.close()
+    assert recibido.startswith(b"HTTP/1.1 501 ")
+    assert b"Connection: close" in recibido and b"hola" not in recibido
+
+def test_content_length_no_valido(srv):
+    sock = socket.create_connection(("127.0.0.1", srv.port), timeout=5)
+    sock.sendall(b"POST /eco HTTP/1.1\r\nHost: x\r\nContent-Length: -1\r\n\r\n")
+    recibido = b""
+    while chunk := sock.recv(4096):
+        recibido += chunk
+    sock.close()
+    assert recibido.startswith(b"HTTP/1.1 400 ")
+
+def test_limite_de_peticiones_por_ip(srv, monkeypatch):
+    monkeypatch.setattr(servidor, "RATE_BURST", 3.0)
+    monkeypatch.setattr(servidor, "RATE_LIMIT", 0.01)
+    estados = []
+    for _ in range(5):
+        conn = _conn(srv)
+        conn.request("GET", "/hola")
+        estados.append(conn.getresponse().status)
+        conn.close()
+    assert estados == [200, 200, 200, 429, 429]
+
+def test_stream_sin_sesion_lo_responde_la_app(srv):
+    conn = _conn(srv)
+    conn.request("GET", "/eventos")
+    assert conn.getresponse().status == 401
+    conn.close()
+
+def test_eventos_con_sesion(srv):
+    conn = _conn(srv)
+    conn.request("GET", "/entrar")
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie").split(";")[0]
+    conn.close()
+    sock = socket.create_connection(("127.0.0.1", srv.port), timeout=5)
+    sock.sendall(f"GET /eventos HTTP/1.1\r\nHost: x\r\nCookie: {cookie}\r\n\r\n".encode())
+    recibido = b""
+    while b"retry:" not in recibido:
+        recibido += sock.recv(4096)
+    assert recibido.startswith(b"HTTP/1.1 200 OK") and b"text/event-stream" in recibido
+    evento = rc.event_bus.publish("intruso", camara=1)
+    while b"event: intruso" not in recibido:
+        recibido += sock.recv(4096)
+    assert f"id: {evento['id']}".encode() in recibido
+    assert srv.clientes["eventos"] == 1
+    sock.close()